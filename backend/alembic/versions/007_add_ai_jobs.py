@@ -0,0 +1,45 @@
+"""Add ai_jobs table (durable AI analysis queue).
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "007"
+down_revision: Union[str, None] = "006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ai_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("ticket_id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(50), nullable=False, server_default="analyze"),
+        sa.Column("priority", sa.Integer(), nullable=False, server_default="50"),
+        sa.Column("status", sa.String(20), nullable=False, server_default="queued"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("max_attempts", sa.Integer(), nullable=False, server_default="3"),
+        sa.Column("run_after", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("locked_until", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("locked_by", sa.String(100), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.ForeignKeyConstraint(["ticket_id"], ["tickets.id"], ondelete="CASCADE"),
+    )
+    op.create_index("ix_ai_jobs_ticket_id", "ai_jobs", ["ticket_id"])
+    op.create_index("ix_ai_jobs_claim", "ai_jobs", ["status", "priority", "run_after"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ai_jobs_claim", table_name="ai_jobs")
+    op.drop_index("ix_ai_jobs_ticket_id", table_name="ai_jobs")
+    op.drop_table("ai_jobs")
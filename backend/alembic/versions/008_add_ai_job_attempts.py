@@ -0,0 +1,44 @@
+"""Add ai_job_attempts table (AI job attempt history for the recovery sweeper).
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "008"
+down_revision: Union[str, None] = "007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ai_job_attempts",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("job_id", sa.Integer(), nullable=False),
+        sa.Column("ticket_id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(50), nullable=False),
+        sa.Column("attempt", sa.Integer(), nullable=False),
+        sa.Column("worker", sa.String(100), nullable=True),
+        sa.Column("status", sa.String(20), nullable=False, server_default="running"),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("started_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("duration_ms", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["job_id"], ["ai_jobs.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["ticket_id"], ["tickets.id"], ondelete="CASCADE"),
+    )
+    op.create_index("ix_ai_job_attempts_job_id", "ai_job_attempts", ["job_id"])
+    op.create_index("ix_ai_job_attempts_ticket_id", "ai_job_attempts", ["ticket_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ai_job_attempts_ticket_id", table_name="ai_job_attempts")
+    op.drop_index("ix_ai_job_attempts_job_id", table_name="ai_job_attempts")
+    op.drop_table("ai_job_attempts")
@@ -0,0 +1,43 @@
+"""Add ai_batches table (bulk AI re-analysis jobs).
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "009"
+down_revision: Union[str, None] = "008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ai_batches",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("status", sa.String(20), nullable=False, server_default="queued"),
+        sa.Column("runner", sa.String(20), nullable=False, server_default="local"),
+        sa.Column("filters", sa.Text(), nullable=True),
+        sa.Column("notify", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("total", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("processed", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("succeeded", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("failed", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("provider_batch_id", sa.String(100), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index("ix_ai_batches_status", "ai_batches", ["status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ai_batches_status", table_name="ai_batches")
+    op.drop_table("ai_batches")
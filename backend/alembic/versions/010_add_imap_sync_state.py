@@ -0,0 +1,34 @@
+"""Add imap_sync_state table (UID-based incremental IMAP sync).
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "010"
+down_revision: Union[str, None] = "009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "imap_sync_state",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("account", sa.String(255), nullable=False),
+        sa.Column("folder", sa.String(255), nullable=False, server_default="INBOX"),
+        sa.Column("uidvalidity", sa.BigInteger(), nullable=True),
+        sa.Column("last_uid", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint("account", "folder", name="uq_imap_sync_state_account_folder"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("imap_sync_state")
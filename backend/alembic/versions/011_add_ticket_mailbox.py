@@ -0,0 +1,27 @@
+"""Add mailbox to tickets (which support mailbox received the email).
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "011"
+down_revision: Union[str, None] = "010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("tickets", sa.Column("mailbox", sa.String(100), nullable=True))
+    op.create_index("ix_tickets_mailbox", "tickets", ["mailbox"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tickets_mailbox", table_name="tickets")
+    op.drop_column("tickets", "mailbox")
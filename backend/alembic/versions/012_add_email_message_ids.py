@@ -0,0 +1,42 @@
+"""Add email_message_ids (Message-ID -> ticket lookup for email threading).
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "012"
+down_revision: Union[str, None] = "011"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "email_message_ids",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("message_id", sa.String(512), nullable=False),
+        sa.Column("ticket_id", sa.Integer(), sa.ForeignKey("tickets.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("direction", sa.String(20), nullable=False, server_default="inbound"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_email_message_ids_message_id", "email_message_ids", ["message_id"], unique=True)
+    op.create_index("ix_email_message_ids_ticket_id", "email_message_ids", ["ticket_id"])
+    # Уже созданные из почты тикеты — их Message-ID (external_id)
+    op.execute(
+        "INSERT INTO email_message_ids (message_id, ticket_id, direction) "
+        "SELECT external_id, MIN(id), 'inbound' FROM tickets "
+        "WHERE source = 'email' AND external_id IS NOT NULL GROUP BY external_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_email_message_ids_ticket_id", table_name="email_message_ids")
+    op.drop_index("ix_email_message_ids_message_id", table_name="email_message_ids")
+    op.drop_table("email_message_ids")
@@ -0,0 +1,32 @@
+"""Add tickets.content_simhash and tickets.duplicate_of_id (near-duplicate detection).
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "013"
+down_revision: Union[str, None] = "012"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("tickets", sa.Column("content_simhash", sa.BigInteger(), nullable=True))
+    op.add_column(
+        "tickets",
+        sa.Column("duplicate_of_id", sa.Integer(), sa.ForeignKey("tickets.id", ondelete="SET NULL"), nullable=True),
+    )
+    op.create_index("ix_tickets_duplicate_of_id", "tickets", ["duplicate_of_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tickets_duplicate_of_id", table_name="tickets")
+    op.drop_column("tickets", "duplicate_of_id")
+    op.drop_column("tickets", "content_simhash")
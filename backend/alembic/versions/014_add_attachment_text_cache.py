@@ -0,0 +1,45 @@
+"""Add attachment_text_cache and ticket_attachments.sha256 (extracted text cached by file content).
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "014"
+down_revision: Union[str, None] = "013"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "attachment_text_cache",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("sha256", sa.String(64), nullable=False),
+        sa.Column("kind", sa.String(20), nullable=False),
+        sa.Column("extractor_version", sa.String(32), nullable=False),
+        sa.Column("success", sa.Boolean(), nullable=False, server_default=sa.true()),
+        sa.Column("text", sa.Text(), nullable=True),
+        sa.Column("size_bytes", sa.BigInteger(), nullable=True),
+        sa.Column("extract_ms", sa.Integer(), nullable=True),
+        sa.Column("hits", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("last_hit_at", sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint("sha256", "kind", name="uq_attachment_text_cache_sha256_kind"),
+    )
+    op.create_index("ix_attachment_text_cache_sha256", "attachment_text_cache", ["sha256"])
+    op.add_column("ticket_attachments", sa.Column("sha256", sa.String(64), nullable=True))
+    op.create_index("ix_ticket_attachments_sha256", "ticket_attachments", ["sha256"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ticket_attachments_sha256", table_name="ticket_attachments")
+    op.drop_column("ticket_attachments", "sha256")
+    op.drop_index("ix_attachment_text_cache_sha256", table_name="attachment_text_cache")
+    op.drop_table("attachment_text_cache")
@@ -0,0 +1,42 @@
+"""Add per-attachment extraction results to ticket_attachments (text, status, pages, OCR, timing).
+
+Revision ID: 015
+Revises: 014
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "015"
+down_revision: Union[str, None] = "014"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("ticket_attachments", sa.Column("extract_status", sa.String(20), nullable=True))
+    op.add_column("ticket_attachments", sa.Column("extracted_text", sa.Text(), nullable=True))
+    op.add_column("ticket_attachments", sa.Column("page_count", sa.Integer(), nullable=True))
+    op.add_column("ticket_attachments", sa.Column("ocr_used", sa.Boolean(), nullable=True))
+    op.add_column("ticket_attachments", sa.Column("extract_ms", sa.Integer(), nullable=True))
+    op.add_column("ticket_attachments", sa.Column("extracted_at", sa.DateTime(timezone=True), nullable=True))
+    op.add_column("attachment_text_cache", sa.Column("page_count", sa.Integer(), nullable=True))
+    op.add_column(
+        "attachment_text_cache",
+        sa.Column("ocr_used", sa.Boolean(), nullable=False, server_default=sa.false()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("attachment_text_cache", "ocr_used")
+    op.drop_column("attachment_text_cache", "page_count")
+    op.drop_column("ticket_attachments", "extracted_at")
+    op.drop_column("ticket_attachments", "extract_ms")
+    op.drop_column("ticket_attachments", "ocr_used")
+    op.drop_column("ticket_attachments", "page_count")
+    op.drop_column("ticket_attachments", "extracted_text")
+    op.drop_column("ticket_attachments", "extract_status")
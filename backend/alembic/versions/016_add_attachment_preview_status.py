@@ -0,0 +1,25 @@
+"""Add preview_status to ticket_attachments (WebP thumbnail of images and first PDF page).
+
+Revision ID: 016
+Revises: 015
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "016"
+down_revision: Union[str, None] = "015"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("ticket_attachments", sa.Column("preview_status", sa.String(20), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("ticket_attachments", "preview_status")
@@ -0,0 +1,27 @@
+"""Add retry_uid / retry_count to imap_sync_state (attempt limit for a message that keeps failing).
+
+Revision ID: 017
+Revises: 016
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "017"
+down_revision: Union[str, None] = "016"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("imap_sync_state", sa.Column("retry_uid", sa.BigInteger(), nullable=True))
+    op.add_column("imap_sync_state", sa.Column("retry_count", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    op.drop_column("imap_sync_state", "retry_count")
+    op.drop_column("imap_sync_state", "retry_uid")
@@ -60,6 +60,58 @@ class Settings(BaseSettings):
     imap_port: int = 993
     imap_user: str = ""
     imap_pass: str = ""
+    imap_folders: str = "INBOX"  # папки одиночного ящика через запятую
+    # Несколько ящиков: JSON-список [{"name","host","port","user","pass","folders","rate_per_minute"}]
+    imap_mailboxes: str = ""
+    imap_rate_per_minute: int = 0  # лимит новых тикетов в минуту на ящик (0 — без ограничения)
+    # Постоянная IMAP-сессия: IDLE (push), переоткрытие IDLE, опрос без IDLE, макс. пауза reconnect (сек)
+    imap_idle: bool = True
+    imap_idle_renew_seconds: int = 300
+    imap_poll_interval_seconds: int = 30
+    imap_reconnect_max_seconds: int = 300
+    # Попыток обработать письмо, на котором встаёт синхронизация; дальше оно пропускается (ошибка в лог)
+    imap_max_message_attempts: int = 5
+    # Вложения писем крупнее порога (байт) сразу пишутся во временный файл, а не держатся в памяти
+    email_spool_threshold_bytes: int = 1_048_576
+    # Конвейер приёма: писем в очереди fetch -> persist, потоков и очередь тикетов извлечения текста вложений
+    ingest_queue_size: int = 20
+    ingest_extract_workers: int = 2
+    ingest_extract_queue_size: int = 100
+    # Извлечение текста вложений в пуле процессов: процессов (0 — по ядрам, до 4; -1 — в текущем потоке),
+    # лимит времени на файл (сек) и памяти на процесс (МБ, 0 — без лимита)
+    extract_processes: int = 0
+    extract_timeout_seconds: int = 120
+    extract_memory_mb: int = 2048
+    # Кэш извлечённого текста по SHA-256 файла (тот же файл у другого тикета / повторный анализ — без разбора)
+    extract_cache_enabled: bool = True
+    # OCR скан-PDF: страниц распознаётся одновременно (процессов tesseract на файл) и максимум страниц на файл
+    pdf_ocr_workers: int = 2
+    pdf_ocr_max_pages: int = 50
+    # Хранилище файлов вложений: local (backend/uploads) | s3 (S3-совместимое, общее для нескольких реплик).
+    # S3: endpoint (пусто — AWS; MinIO — http://minio:9000), адрес для ссылок клиентам, если другой,
+    # бакет, префикс ключей, регион, ключи доступа, срок presigned-ссылки на скачивание (сек)
+    storage_backend: str = "local"
+    s3_endpoint_url: str = ""
+    s3_public_endpoint_url: str = ""
+    s3_bucket: str = ""
+    s3_prefix: str = ""
+    s3_region: str = "us-east-1"
+    s3_access_key: str = ""
+    s3_secret_key: str = ""
+    s3_presign_expire_seconds: int = 3600
+    # Отдача вложений через nginx (X-Accel-Redirect, sendfile): внутренний location с alias на backend/uploads/
+    attachment_accel_redirect_prefix: str = ""
+    # Превью вложений (WebP: изображения, первая страница PDF): процессов пула и размер по большей стороне (px)
+    preview_workers: int = 2
+    preview_max_px: int = 320
+    # Ответ без In-Reply-To/References привязывается к тикету отправителя по теме (Re:/Fwd:) за столько дней
+    email_thread_subject_days: int = 14
+    # Почти-дубликаты писем (SimHash): окно поиска (мин, 0 — выкл.) и макс. расстояние Хэмминга (0..7)
+    duplicate_window_minutes: int = 60
+    duplicate_max_distance: int = 6
+    # Фильтр системных/спам писем: JSON-файл правил (пусто — встроенные) и период проверки его изменений (сек)
+    email_filters_file: str = ""
+    email_filters_reload_seconds: int = 10
     cron_secret: str = ""
     email_sync_interval_seconds: int = 60
 
@@ -69,6 +121,27 @@ class Settings(BaseSettings):
     telegram_chat_id: str = ""
     telegram_app_url: str = "http://localhost:3000"  # Ticket link base URL
 
+    # Очередь AI-задач (ai_jobs): фиксированный пул воркеров вместо потока на каждый тикет
+    ai_workers: int = 4
+    ai_job_max_attempts: int = 3
+    ai_job_visibility_timeout_seconds: int = 300  # аренда running-задачи; воркер продлевает её каждые 1/3 срока
+    # threads — AI_WORKERS потоков; async — один event loop, до AI_ASYNC_CONCURRENCY анализов одновременно
+    ai_worker_mode: str = "threads"
+    ai_async_concurrency: int = 100
+    # Квота LLM-провайдера (token bucket на процесс); при исчерпании тикет ждёт в pending
+    openai_rpm: int = 500
+    openai_tpm: int = 200_000
+    ai_rate_limit_wait_seconds: int = 20
+    # Sweeper: возвращает в очередь зависшие pending и failed тикеты (с лимитом попыток)
+    ai_sweeper_interval_seconds: int = 120
+    ai_sweeper_stale_minutes: int = 10
+    ai_sweeper_max_attempts: int = 6  # всего попыток на тикет (по всем задачам)
+    ai_sweeper_retry_cooldown_minutes: int = 15
+    ai_sweeper_batch_size: int = 50
+    # Пакетный повторный анализ: openai (Batch API) | local (офлайн mock, пробный прогон без записи) | auto (= openai)
+    ai_batch_runner: str = "auto"
+    ai_batch_poll_seconds: int = 30
+
     class Config:
         env_file = str(ROOT_ENV) if ROOT_ENV.exists() else str(ENV_FILE_PATH)
         env_file_encoding = "utf-8"
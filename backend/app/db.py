@@ -30,6 +30,33 @@ def get_db():
         db.close()
 
 
+def create_async_session_factory(pool_size: int = 10):
+    """
+    Async-движок для asyncio-воркеров AI (asyncpg / aiosqlite) по URL текущего sync-движка
+    (с учётом fallback на SQLite). Движок привязан к event loop вызывающего — владелец
+    должен вызвать `await async_engine.dispose()` при остановке.
+
+    Returns:
+        (async_engine, async_sessionmaker)
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    url = engine.url
+    connect_args = {}
+    if url.get_backend_name() == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    else:
+        # asyncpg не понимает sslmode в URL — переносим в connect_args
+        query = dict(url.query)
+        sslmode = query.pop("sslmode", None) or _connect_args.get("sslmode")
+        url = url.set(drivername="postgresql+asyncpg", query=query)
+        if sslmode and sslmode != "disable":
+            connect_args["ssl"] = sslmode
+    engine_kwargs = {"pool_size": pool_size, "max_overflow": pool_size} if url.get_backend_name() != "sqlite" else {}
+    async_engine = create_async_engine(url, pool_pre_ping=True, connect_args=connect_args, **engine_kwargs)
+    return async_engine, async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+
 def ensure_db_fallback():
     """Bağlantı başarısızsa (örn. Supabase erişilemez) SQLite'a geç, tabloları oluştur."""
     global engine, SessionLocal
@@ -46,6 +73,10 @@ def ensure_db_fallback():
         Base.metadata.create_all(bind=engine)
     ensure_ticket_ai_columns()
     ensure_ticket_attachments_table()
+    ensure_ai_tables()
+    ensure_imap_tables()
+    ensure_thread_tables()
+    ensure_attachment_cache_tables()
     _fix_category_underscores()
     _send_missed_telegram_alerts()
 
@@ -114,7 +145,7 @@ def _ticket_columns_pg(conn):
 
 
 def ensure_ticket_ai_columns():
-    """Добавляет в таблицу tickets отсутствующие колонки (ai_*, reply_*, client_token)."""
+    """Добавляет в таблицу tickets отсутствующие колонки (ai_*, reply_*, client_token, mailbox, дубликаты)."""
     try:
         with engine.connect() as conn:
             is_sqlite = "sqlite" in str(engine.url)
@@ -133,6 +164,9 @@ def ensure_ticket_ai_columns():
                 ("attachments_text", "ALTER TABLE tickets ADD COLUMN attachments_text TEXT" if is_sqlite else "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS attachments_text TEXT"),
                 ("ai_status", "ALTER TABLE tickets ADD COLUMN ai_status VARCHAR(20) NOT NULL DEFAULT 'pending'" if is_sqlite else "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS ai_status VARCHAR(20) NOT NULL DEFAULT 'pending'"),
                 ("ai_error", "ALTER TABLE tickets ADD COLUMN ai_error TEXT" if is_sqlite else "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS ai_error TEXT"),
+                ("mailbox", "ALTER TABLE tickets ADD COLUMN mailbox VARCHAR(100)" if is_sqlite else "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS mailbox VARCHAR(100)"),
+                ("content_simhash", "ALTER TABLE tickets ADD COLUMN content_simhash BIGINT" if is_sqlite else "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS content_simhash BIGINT"),
+                ("duplicate_of_id", "ALTER TABLE tickets ADD COLUMN duplicate_of_id INTEGER" if is_sqlite else "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS duplicate_of_id INTEGER"),
             ]
             for col_name, sql in adds:
                 if col_name not in cols:
@@ -202,6 +236,80 @@ def ensure_ticket_attachments_table():
         print(f"[DB] ensure_ticket_attachments_table: {e}", flush=True)
 
 
+def ensure_ai_tables():
+    """Создаёт таблицы ai_jobs (очередь), ai_job_attempts (история), ai_batches (batch-анализ) при отсутствии."""
+    try:
+        from app.models import AiJob, AiJobAttempt, AiBatch
+        for model in (AiJob, AiJobAttempt, AiBatch):
+            model.__table__.create(bind=engine, checkfirst=True)
+    except Exception as e:
+        print(f"[DB] ensure_ai_tables: {e}", flush=True)
+
+
+def ensure_imap_tables():
+    """Создаёт таблицу imap_sync_state (позиция UID-синхронизации) и недостающие колонки счётчика попыток."""
+    try:
+        from sqlalchemy import inspect
+        from app.models import ImapSyncState
+        with engine.begin() as conn:
+            ImapSyncState.__table__.create(bind=conn, checkfirst=True)
+            cols = {c["name"] for c in inspect(conn).get_columns("imap_sync_state")}
+            if "retry_uid" not in cols:
+                conn.execute(text("ALTER TABLE imap_sync_state ADD COLUMN retry_uid BIGINT"))
+            if "retry_count" not in cols:
+                conn.execute(text("ALTER TABLE imap_sync_state ADD COLUMN retry_count INTEGER NOT NULL DEFAULT 0"))
+    except Exception as e:
+        print(f"[DB] ensure_imap_tables: {e}", flush=True)
+
+
+def ensure_thread_tables():
+    """Создаёт email_message_ids (Message-ID -> тикет) и заполняет её по external_id существующих тикетов."""
+    try:
+        from app.models import EmailMessageId
+        with engine.begin() as conn:
+            EmailMessageId.__table__.create(bind=conn, checkfirst=True)
+            # Заполняем один раз — пока таблица пуста (в т.ч. после create_all на SQLite-fallback)
+            if conn.execute(text("SELECT 1 FROM email_message_ids LIMIT 1")).fetchone():
+                return
+            conn.execute(text(
+                "INSERT INTO email_message_ids (message_id, ticket_id, direction) "
+                "SELECT external_id, MIN(id), 'inbound' FROM tickets "
+                "WHERE source = 'email' AND external_id IS NOT NULL GROUP BY external_id"
+            ))
+    except Exception as e:
+        print(f"[DB] ensure_thread_tables: {e}", flush=True)
+
+
+def ensure_attachment_cache_tables():
+    """Создаёт attachment_text_cache и недостающие колонки разбора вложений (sha256, результат извлечения, превью)."""
+    try:
+        from sqlalchemy import inspect
+        from app.models import AttachmentTextCache
+        is_sqlite = "sqlite" in str(engine.url)
+        adds = [
+            ("ticket_attachments", "sha256", "VARCHAR(64)"),
+            ("ticket_attachments", "extract_status", "VARCHAR(20)"),
+            ("ticket_attachments", "extracted_text", "TEXT"),
+            ("ticket_attachments", "page_count", "INTEGER"),
+            ("ticket_attachments", "ocr_used", "BOOLEAN"),
+            ("ticket_attachments", "extract_ms", "INTEGER"),
+            ("ticket_attachments", "extracted_at", "DATETIME" if is_sqlite else "TIMESTAMP WITH TIME ZONE"),
+            ("ticket_attachments", "preview_status", "VARCHAR(20)"),
+            ("attachment_text_cache", "page_count", "INTEGER"),
+            ("attachment_text_cache", "ocr_used", "BOOLEAN NOT NULL DEFAULT " + ("0" if is_sqlite else "false")),
+        ]
+        with engine.begin() as conn:
+            AttachmentTextCache.__table__.create(bind=conn, checkfirst=True)
+            inspector = inspect(conn)
+            cols = {table: {c["name"] for c in inspector.get_columns(table)} for table in ("ticket_attachments", "attachment_text_cache")}
+            for table, column, ddl in adds:
+                if column not in cols[table]:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_ticket_attachments_sha256 ON ticket_attachments (sha256)"))
+    except Exception as e:
+        print(f"[DB] ensure_attachment_cache_tables: {e}", flush=True)
+
+
 def _fix_attachments_id_serial(conn):
     """If ticket_attachments.id has no default (not auto-increment), fix it."""
     try:
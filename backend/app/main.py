@@ -1,72 +1,14 @@
-import threading
-import time
-from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from app.db import engine, Base, ensure_db_fallback, SessionLocal
+from app.db import engine, Base, ensure_db_fallback
 from app import models  # noqa: F401 - tablolar Base.metadata'ya kayıt olsun
 from app.routers import health, categories, tickets, seed, email_stub, ai, admin_auth, analytics, cron
-from app.services.email_processor import fetch_and_process_emails
-from app.config import get_settings
-
-# Флаг для остановки фоновых потоков
-_shutdown = False
-
-# Интервал проверки почты (секунды) — макс. 10–30 с задержка
-EMAIL_CHECK_INTERVAL = 30
-
-
-def email_fetch_thread_func():
-    """Фоновый поток для проверки входящей почты."""
-    settings = get_settings()
-
-    # Проверяем, настроен ли IMAP
-    if not all([settings.imap_host, settings.imap_user, settings.imap_pass]):
-        print("[Email Thread] IMAP не настроен, поток не запущен", flush=True)
-        return
-
-    print(f"[Email Thread] Запуск потока проверки почты (интервал: {EMAIL_CHECK_INTERVAL}с)", flush=True)
-
-    # Ждём немного перед первой проверкой
-    time.sleep(5)
-
-    # Счётчик последовательных ошибок (чтобы не спамить логи)
-    consecutive_errors = 0
-    last_error_msg = ""
-
-    while not _shutdown:
-        try:
-            # Создаём новую сессию БД для каждой итерации
-            db = SessionLocal()
-            try:
-                results = fetch_and_process_emails(db)
-                consecutive_errors = 0  # Сбрасываем счётчик при успехе
-
-                for r in results:
-                    if r.get("status") == "ok" and r.get("ticket_id"):
-                        print(f"[Email Thread] Создан тикет #{r['ticket_id']}", flush=True)
-                    elif r.get("status") == "error":
-                        err_msg = r.get('message') or r.get('error', '')
-                        # Логируем только если это новая ошибка или первая в серии
-                        if consecutive_errors == 0 or err_msg != last_error_msg:
-                            print(f"[Email Thread] Ошибка IMAP: {err_msg}", flush=True)
-                            last_error_msg = err_msg
-                        consecutive_errors += 1
-            finally:
-                db.close()
-        except Exception as e:
-            err_str = str(e)
-            # Логируем только первую ошибку и каждую 10-ю
-            if consecutive_errors == 0 or consecutive_errors % 10 == 0:
-                print(f"[Email Thread] Ошибка ({consecutive_errors + 1}): {err_str}", flush=True)
-            consecutive_errors += 1
-            last_error_msg = err_str
-
-        time.sleep(EMAIL_CHECK_INTERVAL)
-
-    print("[Email Thread] Поток остановлен", flush=True)
-
+from app.services.imap_session import start_imap_listeners, stop_imap_listeners
+from app.services.ai_queue import start_ai_workers, stop_ai_workers
+from app.services.ai_sweeper import start_ai_sweeper, stop_ai_sweeper
+from app.services.ai_batch import resume_ai_batches
+from app.services.ingest_pipeline import start_ingest_pipeline, stop_ingest_pipeline
+from app.services.preview_service import start_preview_service, stop_preview_service
 
 app = FastAPI(title="Support MVP API", version="0.1.0")
 
@@ -101,13 +43,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "Content-Range", "Accept-Ranges", "ETag"],
 )
 
-# Вложения тикетов: uploads/tickets/{id}/...
-_uploads_dir = Path(__file__).resolve().parent.parent / "uploads"
-_uploads_dir.mkdir(parents=True, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=str(_uploads_dir)), name="uploads")
+# Вложения тикетов отдаются через GET /api/tickets/{id}/attachments/{attachment_id}/download (с проверкой доступа)
 
 app.include_router(health.router)
 app.include_router(admin_auth.router)
@@ -124,8 +63,27 @@ app.include_router(cron.router)
 def startup():
     ensure_db_fallback()
 
-    # Запускаем фоновый поток проверки почты
-    email_thread = threading.Thread(target=email_fetch_thread_func, daemon=True)
-    email_thread.start()
+    # Пул AI-воркеров: разбирает очередь ai_jobs (в т.ч. оставшиеся с прошлого запуска)
+    start_ai_workers()
+    # Sweeper: зависшие pending / failed с оставшимися попытками -> обратно в очередь
+    start_ai_sweeper()
+    # Незавершённые пакетные анализы (OpenAI Batch) продолжаются после рестарта
+    resume_ai_batches()
+
+    # Пул извлечения текста вложений (стадия конвейера приёма писем между тикетом и AI)
+    start_ingest_pipeline()
+    # Превью вложений (WebP изображений и первой страницы PDF) для карточки тикета
+    start_preview_service()
+    # Входящая почта: постоянное IMAP-соединение с IDLE (push вместо опроса раз в 30 с)
+    start_imap_listeners()
 
     print("[Main] Сервер запущен, фоновый поток email активен")
+
+
+@app.on_event("shutdown")
+def shutdown():
+    stop_imap_listeners()
+    stop_ingest_pipeline()
+    stop_preview_service()
+    stop_ai_sweeper()
+    stop_ai_workers()
@@ -4,5 +4,11 @@ from .message import Message
 from .ai_analysis import AiAnalysis
 from .kb_article import KbArticle
 from .ticket_attachment import TicketAttachment
+from .ai_job import AiJob
+from .ai_job_attempt import AiJobAttempt
+from .ai_batch import AiBatch
+from .imap_sync_state import ImapSyncState
+from .email_message_id import EmailMessageId
+from .attachment_text_cache import AttachmentTextCache
 
-__all__ = ["Category", "Ticket", "Message", "AiAnalysis", "KbArticle", "TicketAttachment"]
+__all__ = ["Category", "Ticket", "Message", "AiAnalysis", "KbArticle", "TicketAttachment", "AiJob", "AiJobAttempt", "AiBatch", "ImapSyncState", "EmailMessageId", "AttachmentTextCache"]
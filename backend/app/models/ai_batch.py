@@ -0,0 +1,23 @@
+"""Пакетный повторный AI-анализ (ai_batches): фильтр, раннер, прогресс."""
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy.sql import func
+from app.db import Base
+
+
+class AiBatch(Base):
+    __tablename__ = "ai_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued | building | running | writing | done | failed
+    runner = Column(String(20), nullable=False, default="local")  # openai | local
+    filters = Column(Text, nullable=True)  # JSON фильтра отбора тикетов
+    notify = Column(Integer, nullable=False, default=0)  # 1 = слать Telegram по результатам
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    succeeded = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    provider_batch_id = Column(String(100), nullable=True)  # id батча у провайдера (OpenAI Batch API)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
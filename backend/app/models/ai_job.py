@@ -0,0 +1,26 @@
+"""Очередь AI-задач (ai_jobs): персистентная, переживает рестарт процесса."""
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from app.db import Base
+
+
+class AiJob(Base):
+    __tablename__ = "ai_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    ticket_id = Column(Integer, ForeignKey("tickets.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String(50), nullable=False, default="analyze")  # analyze | attachments
+    priority = Column(Integer, nullable=False, default=50)  # меньше = раньше
+    status = Column(String(20), nullable=False, default="queued")  # queued | running | done | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime(timezone=True), nullable=False)  # не раньше этого времени (backoff)
+    locked_until = Column(DateTime(timezone=True), nullable=True)  # visibility timeout для running
+    locked_by = Column(String(100), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_ai_jobs_claim", "status", "priority", "run_after"),
+    )
@@ -0,0 +1,20 @@
+"""История попыток AI-задач (ai_job_attempts): одна строка на каждый захват задачи воркером."""
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.db import Base
+
+
+class AiJobAttempt(Base):
+    __tablename__ = "ai_job_attempts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("ai_jobs.id", ondelete="CASCADE"), nullable=False, index=True)
+    ticket_id = Column(Integer, ForeignKey("tickets.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String(50), nullable=False)
+    attempt = Column(Integer, nullable=False)  # номер попытки внутри задачи
+    worker = Column(String(100), nullable=True)
+    status = Column(String(20), nullable=False, default="running")  # running | done | failed | deferred
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    duration_ms = Column(Integer, nullable=True)
@@ -0,0 +1,23 @@
+"""Кэш извлечённого текста вложений по SHA-256 содержимого файла (один и тот же файл не разбирается дважды)."""
+from sqlalchemy import Column, Integer, String, BigInteger, Boolean, Text, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db import Base
+
+
+class AttachmentTextCache(Base):
+    __tablename__ = "attachment_text_cache"
+    __table_args__ = (UniqueConstraint("sha256", "kind", name="uq_attachment_text_cache_sha256_kind"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), nullable=False, index=True)  # hex SHA-256 байтов файла
+    kind = Column(String(20), nullable=False)  # тип экстрактора: pdf, image, text, docx, ... (attachment_kind)
+    extractor_version = Column(String(32), nullable=False)  # "pdf:1" — другая версия => разбор заново
+    success = Column(Boolean, nullable=False, default=True)
+    text = Column(Text, nullable=True)  # извлечённый текст или заметка для AI (success=False)
+    size_bytes = Column(BigInteger, nullable=True)
+    extract_ms = Column(Integer, nullable=True)  # сколько занял разбор
+    page_count = Column(Integer, nullable=True)
+    ocr_used = Column(Boolean, nullable=False, default=False)
+    hits = Column(Integer, nullable=False, default=0)  # сколько раз разбор не понадобился
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_hit_at = Column(DateTime(timezone=True), nullable=True)
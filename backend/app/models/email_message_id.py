@@ -0,0 +1,14 @@
+"""Индекс Message-ID -> тикет: входящие письма и отправленные ответы (сборка переписки по In-Reply-To/References)."""
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.db import Base
+
+
+class EmailMessageId(Base):
+    __tablename__ = "email_message_ids"
+
+    id = Column(Integer, primary_key=True, index=True)
+    message_id = Column(String(512), nullable=False, unique=True, index=True)  # "<...@...>" как в заголовке
+    ticket_id = Column(Integer, ForeignKey("tickets.id", ondelete="CASCADE"), nullable=False, index=True)
+    direction = Column(String(20), nullable=False, default="inbound")  # inbound, outbound
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,19 @@
+"""Позиция инкрементальной IMAP-синхронизации: (ящик, папка) -> UIDVALIDITY + последний UID."""
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db import Base
+
+
+class ImapSyncState(Base):
+    __tablename__ = "imap_sync_state"
+    __table_args__ = (UniqueConstraint("account", "folder", name="uq_imap_sync_state_account_folder"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    account = Column(String(255), nullable=False)  # user@host
+    folder = Column(String(255), nullable=False, default="INBOX")
+    uidvalidity = Column(BigInteger, nullable=True)  # смена = папку пересоздали, UID недействительны
+    last_uid = Column(BigInteger, nullable=False, default=0)  # все UID <= last_uid обработаны
+    # Письмо, на котором позиция остановилась из-за ошибки, и число неудачных попыток подряд
+    retry_uid = Column(BigInteger, nullable=True)
+    retry_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, Boolean
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db import Base
@@ -35,6 +35,7 @@ class Ticket(Base):
     priority = Column(String(50), nullable=False, default="medium", index=True)
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=True, index=True)
     source = Column(String(50), nullable=False, default="manual", index=True)
+    mailbox = Column(String(100), nullable=True, index=True)  # ящик, в который пришло письмо (IMAP_MAILBOXES name)
     received_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -72,6 +73,10 @@ class Ticket(Base):
     ai_status = Column(String(20), nullable=False, default="pending", index=True)
     ai_error = Column(Text, nullable=True)  # failed ise kısa hata mesajı
 
+    # Почти-дубликаты (near_duplicates): SimHash темы+текста и тикет-оригинал, чей анализ переиспользован
+    content_simhash = Column(BigInteger, nullable=True)
+    duplicate_of_id = Column(Integer, ForeignKey("tickets.id", ondelete="SET NULL"), nullable=True, index=True)
+
     category = relationship("Category", back_populates="tickets")
     messages = relationship("Message", back_populates="ticket", cascade="all, delete-orphan")
     ai_analyses = relationship("AiAnalysis", back_populates="ticket", cascade="all, delete-orphan")
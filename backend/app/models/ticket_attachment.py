@@ -1,5 +1,5 @@
 """Модель вложения тикета (email attachments)."""
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, BigInteger, Boolean, Text, DateTime, ForeignKey
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db import Base
@@ -13,7 +13,18 @@ class TicketAttachment(Base):
     filename = Column(String(512), nullable=False)
     mime_type = Column(String(128), nullable=False)
     size_bytes = Column(BigInteger, nullable=True)
-    storage_path = Column(String(1024), nullable=False)  # относительный путь: uploads/tickets/{ticket_id}/{uuid}-{filename}
+    storage_path = Column(String(1024), nullable=False)  # относительно uploads/: blobs/{sha256[:2]}/{sha256}{.ext} (раньше tickets/{ticket_id}/{uuid}-{filename})
+    sha256 = Column(String(64), nullable=True, index=True)  # hex SHA-256 содержимого (при сохранении; у старых — при первом разборе)
+    # Результат извлечения текста (attachment_text): статус (None — ещё не разбиралось, done, unsupported, failed),
+    # текст или заметка для AI, страниц в документе, распознавался ли OCR, длительность разбора
+    extract_status = Column(String(20), nullable=True)
+    extracted_text = Column(Text, nullable=True)
+    page_count = Column(Integer, nullable=True)
+    ocr_used = Column(Boolean, nullable=True)
+    extract_ms = Column(Integer, nullable=True)
+    extracted_at = Column(DateTime(timezone=True), nullable=True)
+    # Превью (preview_service): None — ещё не строилось, done, unsupported (не изображение/PDF), failed
+    preview_status = Column(String(20), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     ticket = relationship("Ticket", back_populates="attachments")
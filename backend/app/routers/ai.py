@@ -10,13 +10,16 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from app.db import get_db
-from app.models import Ticket
+from app.models import Message, Ticket, AiJobAttempt, AiBatch
+from app.schemas import AiBatchCreate, AiBatchRead
 from app.auth import require_admin_dep
 from app.services.openai_service import analyze_eris_email, analyze_with_openai
 from app.services.smtp_service import send_email
+from app.services.email_threads import normalize_subject, register_message_id, thread_headers
 from app.services.ai_agent import AIAgent
 from app.services.kb_search import get_kb_context
 from app.services.telegram_service import maybe_send_telegram_alert
+from app.services.rate_limiter import AiRateLimited
 from app.config import get_settings
 
 router = APIRouter(prefix="/api/ai", tags=["ai"])
@@ -58,7 +61,10 @@ def ai_analyze(
 
     # Используем AI-агент
     agent = AIAgent(db)
-    result = agent.process_ticket(ticket)
+    try:
+        result = agent.process_ticket(ticket)
+    except AiRateLimited:
+        raise HTTPException(status_code=429, detail="Превышен лимит запросов к AI, повторите позже")
 
     # Обновляем тикет
     agent.update_ticket_with_result(ticket, result)
@@ -86,6 +92,77 @@ def ai_analyze(
     )
 
 
+class AiAttemptRead(BaseModel):
+    id: int
+    job_id: int
+    kind: str
+    attempt: int
+    status: str
+    error: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    duration_ms: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+@router.get("/attempts/{ticket_id}", response_model=List[AiAttemptRead])
+def ai_attempts(
+    ticket_id: int,
+    db: Session = Depends(get_db),
+    _admin: bool = Depends(require_admin_dep),
+):
+    """История попыток AI-анализа тикета (очередь ai_jobs + sweeper)."""
+    return (
+        db.query(AiJobAttempt)
+        .filter(AiJobAttempt.ticket_id == ticket_id)
+        .order_by(AiJobAttempt.id)
+        .all()
+    )
+
+
+@router.post("/batch-reanalyze", response_model=AiBatchRead)
+def ai_batch_reanalyze(
+    body: AiBatchCreate,
+    db: Session = Depends(get_db),
+    _admin: bool = Depends(require_admin_dep),
+):
+    """
+    Пакетный повторный анализ тикетов по фильтру (после смены промпта / категорий).
+    Выполняется в фоне через OpenAI Batch API или локальный mock-раннер; прогресс — GET /batches/{id}.
+    """
+    from app.services.ai_batch import start_ai_batch
+
+    filters = body.model_dump(exclude={"runner", "notify"}, exclude_none=True)
+    try:
+        return start_ai_batch(db, filters, runner=body.runner, notify=body.notify)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/batches", response_model=List[AiBatchRead])
+def ai_batches(
+    db: Session = Depends(get_db),
+    _admin: bool = Depends(require_admin_dep),
+):
+    """Последние пакетные анализы."""
+    return db.query(AiBatch).order_by(AiBatch.id.desc()).limit(20).all()
+
+
+@router.get("/batches/{batch_id}", response_model=AiBatchRead)
+def ai_batch_status(
+    batch_id: int,
+    db: Session = Depends(get_db),
+    _admin: bool = Depends(require_admin_dep),
+):
+    """Прогресс пакетного анализа."""
+    batch = db.query(AiBatch).filter(AiBatch.id == batch_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Батч не найден")
+    return batch
+
+
 @router.post("/send-reply/{ticket_id}")
 def ai_send_reply(
     ticket_id: int,
@@ -110,11 +187,26 @@ def ai_send_reply(
     # Форматируем ответ с подписью ЭРИС
     formatted_reply = _format_eris_reply(reply_text, ticket.id)
 
-    ok, msg_id, err = send_email(to, f"Re: {ticket.subject}", formatted_reply)
+    # Ответ в цепочке письма клиента: его следующий ответ вернётся в этот же тикет
+    subject = ticket.subject or ""
+    if not normalize_subject(subject)[1]:
+        subject = f"Re: {subject}"
+    in_reply_to, references = thread_headers(db, ticket)
+    ok, msg_id, err = send_email(to, subject, formatted_reply, in_reply_to=in_reply_to, references=references)
     if not ok:
         print(f"[SMTP ERROR] Ticket #{ticket_id}, To: {to}, Error: {err}")
         raise HTTPException(status_code=503, detail=err or "Не удалось отправить письмо")
 
+    db.add(Message(
+        ticket_id=ticket.id,
+        direction="outbound",
+        channel="email",
+        parsed_text=reply_text,
+        subject=subject,
+        recipient_email=to,
+    ))
+    register_message_id(db, ticket.id, msg_id, direction="outbound")
+
     ticket.sent_reply = reply_text
     ticket.reply_sent = 1
     ticket.reply_sent_at = datetime.now(timezone.utc)
@@ -29,10 +29,23 @@ def cron_sync_inbox(
     Header: X-Cron-Secret: <CRON_SECRET>
     """
     from app.routers.email_stub import _run_sync
-    settings = get_settings()
-    if not settings.imap_host or not settings.imap_user:
+    from app.services.mailboxes import load_mailbox_configs
+    if not load_mailbox_configs():
         return {"status": "skipped", "message": "IMAP не настроен"}
     try:
         return _run_sync(db)
     except Exception:
         raise HTTPException(status_code=500, detail="Ошибка синхронизации почты")
+
+
+@router.post("/sweep-ai")
+def cron_sweep_ai(
+    db: Session = Depends(get_db),
+    _: None = Depends(require_cron_secret),
+):
+    """
+    Зависшие/упавшие AI-анализы -> обратно в очередь ai_jobs (то же, что фоновый sweeper).
+    Header: X-Cron-Secret: <CRON_SECRET>
+    """
+    from app.services.ai_sweeper import sweep_stuck_ai
+    return {"status": "ok", **sweep_stuck_ai(db)}
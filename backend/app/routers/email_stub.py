@@ -2,6 +2,7 @@
 Email endpoints: получение и обработка входящих писем.
 Admin: POST /api/email/fetch — синхронизация INBOX, только для авторизованного админа.
 Cron: POST /api/cron/sync-inbox — заголовок X-Cron-Secret обязателен.
+Admin: GET /api/email/filters — правила фильтра входящих и счётчики срабатываний.
 """
 from fastapi import APIRouter, HTTPException, Depends, Header
 from sqlalchemy.orm import Session
@@ -41,8 +42,8 @@ def fetch_emails(
     Получает новые письма из IMAP и создаёт тикеты (admin-only).
     Требует настройки IMAP_HOST, IMAP_USER, IMAP_PASS в .env.
     """
-    settings = get_settings()
-    if not settings.imap_host or not settings.imap_user:
+    from app.services.mailboxes import load_mailbox_configs
+    if not load_mailbox_configs():
         raise HTTPException(
             status_code=400,
             detail="IMAP не настроен. Укажите IMAP_HOST, IMAP_USER, IMAP_PASS в .env"
@@ -56,14 +57,29 @@ def fetch_emails(
 @router.get("/status")
 def email_status():
     """Проверяет статус настроек email интеграции."""
+    from app.services.mailboxes import load_mailbox_configs
+    from app.services.imap_session import get_imap_listener
     settings = get_settings()
+    mailboxes = load_mailbox_configs()
 
     return {
         "imap": {
-            "configured": bool(settings.imap_host and settings.imap_user),
+            "configured": bool(mailboxes),
             "host": settings.imap_host or "не настроен",
             "port": settings.imap_port,
-            "user": settings.imap_user[:3] + "***" if settings.imap_user else "не настроен"
+            "user": settings.imap_user[:3] + "***" if settings.imap_user else "не настроен",
+            "mailboxes": [
+                {
+                    "name": mb.name,
+                    "host": mb.host,
+                    "folders": [
+                        {"folder": f, "connected": bool(get_imap_listener(mb.name, f) and get_imap_listener(mb.name, f).connected)}
+                        for f in mb.folders
+                    ],
+                    "rate_per_minute": mb.rate_per_minute,
+                }
+                for mb in mailboxes
+            ],
         },
         "smtp": {
             "configured": bool(settings.smtp_host and settings.smtp_user),
@@ -79,6 +95,22 @@ def email_status():
     }
 
 
+@router.get("/filters")
+def email_filters(_admin: bool = Depends(require_admin_dep)):
+    """Правила фильтра системных/спам писем (встроенные + EMAIL_FILTERS_FILE) и сколько раз сработало каждое."""
+    from app.services.email_filters import get_filter_engine
+    engine = get_filter_engine()
+    return {"source": engine.source, "rules": engine.stats()}
+
+
+@router.post("/filters/reload")
+def reload_email_filters(_admin: bool = Depends(require_admin_dep)):
+    """Перечитывает EMAIL_FILTERS_FILE сразу, не дожидаясь проверки mtime."""
+    from app.services.email_filters import reload_filter_engine
+    engine = reload_filter_engine()
+    return {"source": engine.source, "rules": len(engine.rules)}
+
+
 @router.post("/send")
 def send_email_endpoint():
     """Future: send reply via SMTP. Use /api/ai/send-reply/{ticket_id} instead."""
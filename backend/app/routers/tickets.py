@@ -3,22 +3,27 @@ import csv
 import json
 from datetime import datetime
 from typing import Optional, List
-from fastapi import APIRouter, Depends, HTTPException, Query, Request, Header, BackgroundTasks, UploadFile, File
-from fastapi.responses import StreamingResponse, Response
+from urllib.parse import quote, urlencode
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Header, UploadFile, File
+from fastapi.responses import RedirectResponse, StreamingResponse, Response
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from app.db import get_db
-from app.models import Ticket, Category, AiAnalysis, TicketAttachment
-from app.schemas import TicketCreate, TicketRead, TicketUpdate, TicketsResponse, AnalyzeResponse, SuggestReplyResponse, TicketAttachmentRead
+from app.models import Ticket, Category, AiAnalysis, TicketAttachment, Message
+from app.schemas import TicketCreate, TicketRead, TicketUpdate, TicketsResponse, AnalyzeResponse, SuggestReplyResponse, TicketAttachmentRead, MessageRead
 from app.repositories.ticket_repo import TicketRepository
 from app.services.mock_ai import MockAIService
 from app.auth import require_admin, require_admin_dep
-from app.services.ai_agent import AIAgent
-from app.services.device_extract import extract_device_model
-from app.services.telegram_service import maybe_send_telegram_alert
-from app.services.attachment_storage import save_attachment
-from app.services.attachment_extract import extract_text_from_attachment
 from app.config import get_settings
+from app.services.device_extract import extract_device_model
+from app.services.attachment_storage import AttachmentTooLarge, attachment_download_url, get_storage, store_attachment_stream
+from app.services.extraction_cache import file_sha256
+from app.services.file_download import file_download_response
+from app.services.preview_service import (
+    PREVIEW_DONE, PREVIEW_MEDIA_TYPE, PREVIEW_RETRY_AFTER_SEC, PREVIEW_VERSION, enqueue_previews, preview_key,
+    preview_kind, request_preview,
+)
+from app.services.ai_queue import enqueue_ai_job, JOB_ANALYZE, JOB_ATTACHMENTS, PRIORITY_HIGH
 
 router = APIRouter(prefix="/api", tags=["tickets"])
 
@@ -52,49 +57,6 @@ def get_request_categories(
     return RequestCategoriesResponse(items=items)
 
 
-def process_ticket_ai_background(ticket_id: int):
-    """Фоновая обработка тикета AI-агентом (ручное создание). ai_status=done/failed."""
-    from app.db import SessionLocal
-
-    db = SessionLocal()
-    try:
-        settings = get_settings()
-        ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
-        if not ticket:
-            return
-        if not settings.openai_api_key:
-            ticket.ai_status = "done"
-            ticket.ai_error = None
-            db.commit()
-            return
-
-        print(f"[AI Background] Начинаем обработку тикета #{ticket_id}")
-        agent = AIAgent(db)
-        result = agent.process_ticket(ticket, attachments_summary="", attachments_extracted_text=(ticket.attachments_text or ""))
-        agent.update_ticket_with_result(ticket, result)
-        ticket.ai_status = "done"
-        ticket.ai_error = None
-        db.commit()
-        print(f"[AI Background] Обработка тикета #{ticket_id} завершена")
-        try:
-            maybe_send_telegram_alert(db, ticket)
-        except Exception as tg_err:
-            print(f"[AI Background] Telegram alert skip: {tg_err}")
-    except Exception as e:
-        err_msg = str(e)[:500]
-        print(f"[AI Background] Ошибка тикета #{ticket_id}: {err_msg}")
-        try:
-            ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
-            if ticket:
-                ticket.ai_status = "failed"
-                ticket.ai_error = err_msg
-                db.commit()
-        except Exception:
-            db.rollback()
-    finally:
-        db.close()
-
-
 @router.get("/tickets", response_model=TicketsResponse)
 def list_tickets(
     request: Request,
@@ -125,7 +87,7 @@ def list_tickets(
 
 
 @router.post("/tickets", response_model=TicketRead)
-def create_ticket(data: TicketCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def create_ticket(data: TicketCreate, db: Session = Depends(get_db)):
     device_from_text = extract_device_model((data.subject or "") + "\n" + (data.body or ""))
     ticket = Ticket(
         sender_email=data.sender_email,
@@ -147,9 +109,9 @@ def create_ticket(data: TicketCreate, background_tasks: BackgroundTasks, db: Ses
     db.commit()
     db.refresh(ticket)
 
-    # AI анализ в фоновом режиме - клиент не ждёт
-    print(f"[AI] Тикет #{ticket.id} создан. Запуск фоновой обработки...")
-    background_tasks.add_task(process_ticket_ai_background, ticket.id)
+    # AI анализ через очередь ai_jobs - клиент не ждёт
+    print(f"[AI] Тикет #{ticket.id} создан. Задача AI поставлена в очередь")
+    enqueue_ai_job(db, ticket.id, kind=JOB_ANALYZE, priority=PRIORITY_HIGH)
 
     return ticket
 
@@ -362,62 +324,36 @@ MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB per file
 MAX_FILES_PER_UPLOAD = 5
 
 
-def _rerun_ai_with_attachments(ticket_id: int):
-    """Re-process AI after new attachments are uploaded (web form)."""
-    from app.db import SessionLocal
-
-    db = SessionLocal()
-    try:
-        ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
-        if not ticket:
-            return
-        atts = db.query(TicketAttachment).filter(TicketAttachment.ticket_id == ticket_id).all()
-        if not atts:
-            return
-
-        from app.services.attachment_storage import UPLOADS_DIR
-        summary_parts = []
-        extracted_parts = []
-        for att in atts:
-            summary_parts.append(f"- {att.filename} ({att.mime_type}, {(att.size_bytes or 0) / 1024:.1f} KB)")
-            file_path = UPLOADS_DIR / att.storage_path
-            if file_path.exists():
-                data = file_path.read_bytes()
-                ok, text = extract_text_from_attachment(att.filename, att.mime_type, data)
-                if text and text.strip():
-                    extracted_parts.append(f"[{att.filename}]\n{text}")
-
-        attachments_summary = "\n".join(summary_parts)
-        attachments_extracted_text = "\n\n".join(extracted_parts)
-        ticket.attachments_text = attachments_extracted_text or None
-
-        settings = get_settings()
-        if settings.openai_api_key:
-            agent = AIAgent(db)
-            result = agent.process_ticket(
-                ticket,
-                attachments_summary=attachments_summary,
-                attachments_extracted_text=attachments_extracted_text,
-            )
-            agent.update_ticket_with_result(ticket, result)
-            ticket.ai_status = "done"
-            ticket.ai_error = None
-        db.commit()
-    except Exception as e:
-        print(f"[Attachment AI] Error re-processing ticket #{ticket_id}: {e}")
-        try:
-            db.rollback()
-        except Exception:
-            pass
-    finally:
-        db.close()
+def _attachment_url(att: TicketAttachment, client_token: Optional[str] = None, action: str = "download") -> str:
+    """Относительная ссылка на файл / превью (через прокси фронтенда); клиенту — с его client_token."""
+    url = f"/api/tickets/{att.ticket_id}/attachments/{att.id}/{action}"
+    return f"{url}?{urlencode({'client_token': client_token})}" if client_token else url
+
+
+def _attachment_read(att: TicketAttachment, with_text: bool = False, client_token: Optional[str] = None) -> TicketAttachmentRead:
+    return TicketAttachmentRead(
+        id=att.id,
+        ticket_id=att.ticket_id,
+        filename=att.filename,
+        mime_type=att.mime_type,
+        size_bytes=att.size_bytes,
+        storage_path=att.storage_path,
+        created_at=att.created_at,
+        download_url=_attachment_url(att, client_token),
+        # Ссылка — только на готовое превью: пока оно строится, карточка показывает значок типа файла
+        preview_url=_attachment_url(att, client_token, "preview") if att.preview_status == PREVIEW_DONE else None,
+        extract_status=att.extract_status,
+        page_count=att.page_count,
+        ocr_used=att.ocr_used,
+        extract_ms=att.extract_ms,
+        extracted_text=att.extracted_text if with_text else None,
+    )
 
 
 @router.post("/tickets/{ticket_id}/attachments", response_model=List[TicketAttachmentRead])
 def upload_ticket_attachments(
     ticket_id: int,
     request: Request,
-    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
     client_token: Optional[str] = Query(None),
     x_client_token: Optional[str] = Header(None, alias="X-Client-Token"),
@@ -427,6 +363,7 @@ def upload_ticket_attachments(
     ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
+    token = None
     if not require_admin(request):
         token = (client_token or x_client_token or "").strip()
         if not token or ticket.client_token != token:
@@ -436,7 +373,6 @@ def upload_ticket_attachments(
         raise HTTPException(status_code=400, detail=f"Максимум {MAX_FILES_PER_UPLOAD} файлов за раз")
 
     results: List[TicketAttachmentRead] = []
-    base_url = str(request.base_url).rstrip("/")
 
     for f in files:
         fname = f.filename or "attachment"
@@ -447,40 +383,35 @@ def upload_ticket_attachments(
                 status_code=400,
                 detail=f"Тип файла '{fname}' ({mime}) не поддерживается. Допустимые: PDF, JPG, PNG, DOCX, XLS, TXT, CSV.",
             )
-        data = f.file.read()
-        if len(data) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Файл '{fname}' превышает лимит {MAX_FILE_SIZE // (1024 * 1024)} MB",
-            )
+        too_large = HTTPException(
+            status_code=400,
+            detail=f"Файл '{fname}' превышает лимит {MAX_FILE_SIZE // (1024 * 1024)} MB",
+        )
+        if f.size is not None and f.size > MAX_FILE_SIZE:
+            raise too_large
+        # Блоками во временный файл (хэш и лимит — по дороге), затем в хранилище по содержимому
+        try:
+            stored = store_attachment_stream(f.file, fname, max_bytes=MAX_FILE_SIZE)
+        except AttachmentTooLarge:
+            raise too_large
 
-        storage_path = save_attachment(ticket_id, fname, data)
         att = TicketAttachment(
             ticket_id=ticket_id,
             filename=fname,
             mime_type=mime,
-            size_bytes=len(data),
-            storage_path=storage_path,
+            size_bytes=stored.size,
+            storage_path=stored.storage_path,
+            sha256=stored.sha256,
         )
         db.add(att)
         db.flush()
 
-        results.append(
-            TicketAttachmentRead(
-                id=att.id,
-                ticket_id=att.ticket_id,
-                filename=att.filename,
-                mime_type=att.mime_type,
-                size_bytes=att.size_bytes,
-                storage_path=att.storage_path,
-                created_at=att.created_at,
-                download_url=f"{base_url}/uploads/{att.storage_path}",
-            )
-        )
+        results.append(_attachment_read(att, client_token=token))
 
     db.commit()
 
-    background_tasks.add_task(_rerun_ai_with_attachments, ticket_id)
+    enqueue_ai_job(db, ticket_id, kind=JOB_ATTACHMENTS, priority=PRIORITY_HIGH)
+    enqueue_previews(r.id for r in results)
 
     return results
 
@@ -497,25 +428,145 @@ def get_ticket_attachments(
     ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    if not require_admin(request):
+    is_admin = require_admin(request)
+    token = None
+    if not is_admin:
         token = (client_token or x_client_token or "").strip()
         if not token or ticket.client_token != token:
             raise HTTPException(status_code=403, detail="Нет доступа к этому обращению")
     rows = db.query(TicketAttachment).filter(TicketAttachment.ticket_id == ticket_id).order_by(TicketAttachment.id).all()
-    base_url = str(request.base_url).rstrip("/")
-    return [
-        TicketAttachmentRead(
-            id=r.id,
-            ticket_id=r.ticket_id,
-            filename=r.filename,
-            mime_type=r.mime_type,
-            size_bytes=r.size_bytes,
-            storage_path=r.storage_path,
-            created_at=r.created_at,
-            download_url=f"{base_url}/uploads/{r.storage_path}",
+    # Превью, не построенные фоном (сервер был остановлен, вне BACKLOG_LIMIT), — в очередь
+    enqueue_previews(r.id for r in rows if r.preview_status is None and preview_kind(r.filename, r.mime_type))
+    return [_attachment_read(r, with_text=is_admin, client_token=token) for r in rows]
+
+
+@router.api_route("/tickets/{ticket_id}/attachments/{attachment_id}/download", methods=["GET", "HEAD"])
+def download_ticket_attachment(
+    ticket_id: int,
+    attachment_id: int,
+    request: Request,
+    download: bool = Query(False),
+    client_token: Optional[str] = Query(None),
+    x_client_token: Optional[str] = Header(None, alias="X-Client-Token"),
+    db: Session = Depends(get_db),
+):
+    """
+    Файл вложения. Доступ: админ или владелец по client_token. Range, ETag (SHA-256 содержимого),
+    кэш immutable; S3 — редирект на presigned-ссылку. download=1 — сохранить, а не открыть.
+    """
+    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    if not require_admin(request):
+        token = (client_token or x_client_token or "").strip()
+        if not token or ticket.client_token != token:
+            raise HTTPException(status_code=403, detail="Нет доступа к этому обращению")
+    att = (
+        db.query(TicketAttachment)
+        .filter(TicketAttachment.id == attachment_id, TicketAttachment.ticket_id == ticket_id)
+        .first()
+    )
+    if not att:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    presigned = attachment_download_url(att.storage_path, att.filename, att.mime_type)
+    if presigned:
+        return RedirectResponse(presigned, status_code=307)
+    path = get_storage().local_path(att.storage_path)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Файл вложения не найден")
+    if not att.sha256:
+        # Вложение, сохранённое до хранилища по содержимому: хэш считается один раз
+        att.sha256 = file_sha256(str(path))
+        db.commit()
+    prefix = get_settings().attachment_accel_redirect_prefix.rstrip("/")
+    return file_download_response(
+        request,
+        path,
+        etag=f'"{att.sha256}"',
+        media_type=att.mime_type or "application/octet-stream",
+        filename=att.filename,
+        download=download,
+        accel_redirect=f"{prefix}/{quote(att.storage_path)}" if prefix else None,
+    )
+
+
+@router.api_route("/tickets/{ticket_id}/attachments/{attachment_id}/preview", methods=["GET", "HEAD"])
+def preview_ticket_attachment(
+    ticket_id: int,
+    attachment_id: int,
+    request: Request,
+    client_token: Optional[str] = Query(None),
+    x_client_token: Optional[str] = Header(None, alias="X-Client-Token"),
+    db: Session = Depends(get_db),
+):
+    """
+    Превью вложения (WebP: изображение / первая страница PDF). Доступ — как к файлу; ETag и кэш immutable.
+    Ещё не построенное превью ставится в очередь PreviewService: 202 + Retry-After; 404 — превью для такого файла нет.
+    """
+    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    if not require_admin(request):
+        token = (client_token or x_client_token or "").strip()
+        if not token or ticket.client_token != token:
+            raise HTTPException(status_code=403, detail="Нет доступа к этому обращению")
+    att = (
+        db.query(TicketAttachment)
+        .filter(TicketAttachment.id == attachment_id, TicketAttachment.ticket_id == ticket_id)
+        .first()
+    )
+    if not att:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    status = att.preview_status
+    ready = request_preview(att)
+    if att.preview_status != status:
+        db.commit()
+    if ready is None:
+        return Response(
+            status_code=202,
+            headers={"Retry-After": str(PREVIEW_RETRY_AFTER_SEC), "Cache-Control": "no-store"},
         )
-        for r in rows
-    ]
+    if not ready:
+        raise HTTPException(status_code=404, detail="Превью недоступно")
+
+    key = preview_key(att.storage_path)
+    name = f"{att.filename.rsplit('.', 1)[0] or 'preview'}.webp"
+    storage = get_storage()
+    presigned = storage.presigned_url(key, name, PREVIEW_MEDIA_TYPE)
+    if presigned:
+        return RedirectResponse(presigned, status_code=307)
+    path = storage.local_path(key)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Превью недоступно")
+    prefix = get_settings().attachment_accel_redirect_prefix.rstrip("/")
+    return file_download_response(
+        request,
+        path,
+        etag=f'"{att.sha256 or att.id}-thumb{PREVIEW_VERSION}"',
+        media_type=PREVIEW_MEDIA_TYPE,
+        filename=name,
+        accel_redirect=f"{prefix}/{quote(key)}" if prefix else None,
+    )
+
+
+@router.get("/tickets/{ticket_id}/messages", response_model=List[MessageRead])
+def get_ticket_messages(
+    ticket_id: int,
+    request: Request,
+    client_token: Optional[str] = Query(None),
+    x_client_token: Optional[str] = Header(None, alias="X-Client-Token"),
+    db: Session = Depends(get_db),
+):
+    """Переписка по тикету (продолжения письма клиента и отправленные ответы). Доступ: админ или владелец."""
+    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    if not require_admin(request):
+        token = (client_token or x_client_token or "").strip()
+        if not token or ticket.client_token != token:
+            raise HTTPException(status_code=403, detail="Нет доступа к этому обращению")
+    return db.query(Message).filter(Message.ticket_id == ticket_id).order_by(Message.id).all()
 
 
 @router.delete("/tickets/{ticket_id}")
@@ -2,10 +2,12 @@ from .category import CategoryCreate, CategoryRead, CategoryUpdate
 from .ticket import TicketCreate, TicketRead, TicketUpdate, TicketListQuery, TicketsResponse, TicketAttachmentRead
 from .message import MessageCreate, MessageRead
 from .ai_analysis import AiAnalysisRead, AnalyzeResponse, SuggestReplyResponse
+from .ai_batch import AiBatchCreate, AiBatchRead
 
 __all__ = [
     "CategoryCreate", "CategoryRead", "CategoryUpdate",
     "TicketCreate", "TicketRead", "TicketUpdate", "TicketListQuery", "TicketsResponse", "TicketAttachmentRead",
     "MessageCreate", "MessageRead",
     "AiAnalysisRead", "AnalyzeResponse", "SuggestReplyResponse",
+    "AiBatchCreate", "AiBatchRead",
 ]
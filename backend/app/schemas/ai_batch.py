@@ -0,0 +1,36 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Optional, List
+
+
+class AiBatchCreate(BaseModel):
+    """Фильтр отбора тикетов для пакетного повторного анализа."""
+    request_category: Optional[str] = None
+    outside_allowed_categories: bool = False  # категории, которых больше нет в ALLOWED_CATEGORIES
+    ai_status: Optional[str] = None
+    status: Optional[str] = None
+    source: Optional[str] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    ticket_ids: Optional[List[int]] = None
+    limit: int = Field(1000, ge=1, le=20000)
+    runner: Optional[str] = None  # openai | local (пробный прогон, без записи) | None = AI_BATCH_RUNNER
+    notify: bool = False  # Telegram по результатам (для истории обычно не нужен)
+
+
+class AiBatchRead(BaseModel):
+    id: int
+    status: str
+    runner: str
+    total: int
+    processed: int
+    succeeded: int
+    failed: int
+    provider_batch_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
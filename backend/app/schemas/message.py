@@ -20,6 +20,9 @@ class MessageRead(BaseModel):
     direction: str
     channel: str
     parsed_text: str
+    subject: Optional[str] = None
+    sender_email: Optional[str] = None
+    recipient_email: Optional[str] = None
     created_at: Optional[datetime] = None
 
     class Config:
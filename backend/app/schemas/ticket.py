@@ -34,6 +34,7 @@ class TicketUpdate(BaseModel):
 class TicketRead(TicketBase):
     id: int
     external_id: Optional[str] = None
+    mailbox: Optional[str] = None
     client_token: Optional[str] = None
     received_at: Optional[datetime] = None
     created_at: Optional[datetime] = None
@@ -63,6 +64,8 @@ class TicketRead(TicketBase):
     # AI analiz durumu: pending | done | failed (takılı kalmayı önlemek)
     ai_status: Optional[str] = None
     ai_error: Optional[str] = None
+    # Почти-дубликат: анализ взят у этого тикета
+    duplicate_of_id: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -131,6 +134,13 @@ class TicketAttachmentRead(BaseModel):
     storage_path: str
     created_at: Optional[datetime] = None
     download_url: Optional[str] = None  # URL для скачивания / просмотра
+    preview_url: Optional[str] = None  # уменьшенное превью (WebP) изображения / первой страницы PDF
+    # Извлечение текста: статус (None — ещё не разбиралось, done, unsupported, failed), страниц, OCR, длительность
+    extract_status: Optional[str] = None
+    page_count: Optional[int] = None
+    ocr_used: Optional[bool] = None
+    extract_ms: Optional[int] = None
+    extracted_text: Optional[str] = None  # только для админа: что вложение дало AI
 
     class Config:
         from_attributes = True
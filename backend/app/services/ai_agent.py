@@ -3,13 +3,14 @@
 Объединяет поиск по базе знаний и вызов LLM.
 """
 import json
-from typing import Optional
+from typing import Optional, List, Tuple
 from dataclasses import dataclass, asdict
 from sqlalchemy.orm import Session
 
-from app.services.kb_search import KBSearchService, get_kb_context, HistorySearchService, get_history_context
-from app.services.openai_service import analyze_eris_email, ErisAnalysisResult, ALLOWED_CATEGORIES
+from app.services.kb_search import KBSearchService, get_kb_context, HistorySearchService, get_history_context, HistorySearchResult
+from app.services.openai_service import analyze_eris_email, analyze_eris_email_async, ErisAnalysisResult, ALLOWED_CATEGORIES
 from app.services.device_extract import extract_device_model
+from app.services.rate_limiter import AiRateLimited
 
 
 @dataclass
@@ -78,30 +79,7 @@ class AIAgent:
         Returns:
             AIAgentResult с извлечёнными данными и ответом
         """
-        query = f"{subject} {body}"
-
-        # 1. Поиск похожих обращений в истории
-        history_context = self.history_service.get_history_context_for_llm(query, top_k=2)
-        history_results = self.history_service.search_similar_tickets(query, top_k=2)
-        history_used = len(history_results)
-
-        if history_used > 0:
-            best_match = history_results[0]
-            print(f"[AI Agent] Найдено {history_used} похожих обращений в истории (лучшее: {best_match.similarity:.0%})")
-
-        # 2. Поиск в базе знаний (статьи)
-        kb_context = self.kb_service.get_context_for_llm(query, top_k=3)
-        kb_results = self.kb_service.search(query, top_k=3)
-        kb_articles_used = len(kb_results)
-
-        print(f"[AI Agent] Найдено {kb_articles_used} релевантных статей в KB")
-
-        # 3. Объединяем контекст (история приоритетнее)
-        combined_context = ""
-        if history_context:
-            combined_context += history_context + "\n\n"
-        if kb_context:
-            combined_context += kb_context
+        combined_context, history_results, kb_articles_used = self.build_context(subject, body)
 
         # 4. Вызов LLM с объединённым контекстом (включая текст из вложений)
         try:
@@ -113,32 +91,12 @@ class AIAgent:
                 attachments_summary=attachments_summary or "",
                 attachments_extracted_text=attachments_extracted_text or "",
             )
-
-            # Определяем confidence на основе найденных источников
-            if history_used > 0 and history_results[0].similarity >= 0.65:
-                confidence = 0.90  # Высокая уверенность - есть похожее обращение
-            elif kb_articles_used > 0:
-                confidence = 0.80  # Средняя - есть статьи KB
-            else:
-                confidence = 0.60  # Базовая - только LLM
-
             # 5. Формируем результат
-            return AIAgentResult(
-                sender_full_name=eris_result.sender_full_name,
-                object_name=eris_result.object_name,
-                sender_phone=eris_result.sender_phone,
-                serial_numbers=eris_result.serial_numbers,
-                device_type=eris_result.device_type,
-                sentiment=eris_result.sentiment,
-                request_category=eris_result.request_category,
-                issue_summary=eris_result.issue_summary,
-                reply=eris_result.reply,
-                operator_required=eris_result.operator_required,
-                operator_reason=eris_result.operator_reason,
-                kb_articles_used=kb_articles_used + history_used,
-                confidence=confidence
-            )
+            return self.result_from_eris(eris_result, history_results, kb_articles_used)
 
+        except AiRateLimited:
+            # Квота исчерпана — не подменяем ответ fallback'ом, задача повторится позже
+            raise
         except Exception as e:
             print(f"[AI Agent] Ошибка LLM: {e}")
             # Fallback ответ
@@ -150,11 +108,94 @@ class AIAgent:
                 confidence=0.3
             )
 
+    def preload(self) -> None:
+        """Кэширует статьи KB и историю для массовой обработки (batch re-analysis)."""
+        self.kb_service.preload()
+        self.history_service.preload()
+
+    def build_context(self, subject: str, body: str, log: bool = True) -> Tuple[str, List[HistorySearchResult], int]:
+        """
+        Шаги 1–3 пайплайна: поиск в истории и KB, объединённый контекст для промпта.
+        log=False — без построчных логов (batch на тысячи тикетов).
+
+        Returns:
+            (combined_context, history_results, kb_articles_used)
+        """
+        query = f"{subject} {body}"
+
+        # 1. Поиск похожих обращений в истории
+        history_results = self.history_service.search_similar_tickets(query, top_k=2)
+        history_context = self.history_service.format_history_context_for_llm(history_results)
+        history_used = len(history_results)
+
+        if log and history_used > 0:
+            best_match = history_results[0]
+            print(f"[AI Agent] Найдено {history_used} похожих обращений в истории (лучшее: {best_match.similarity:.0%})")
+
+        # 2. Поиск в базе знаний (статьи)
+        kb_results = self.kb_service.search(query, top_k=3)
+        kb_context = self.kb_service.format_context_for_llm(kb_results)
+        kb_articles_used = len(kb_results)
+
+        if log:
+            print(f"[AI Agent] Найдено {kb_articles_used} релевантных статей в KB")
+
+        # 3. Объединяем контекст (история приоритетнее)
+        combined_context = ""
+        if history_context:
+            combined_context += history_context + "\n\n"
+        if kb_context:
+            combined_context += kb_context
+        return combined_context, history_results, kb_articles_used
+
+    def result_from_eris(
+        self,
+        eris_result: ErisAnalysisResult,
+        history_results: List[HistorySearchResult],
+        kb_articles_used: int,
+    ) -> AIAgentResult:
+        """Преобразует ответ LLM в AIAgentResult (confidence — по найденным источникам)."""
+        top_similarity = history_results[0].similarity if history_results else 0.0
+        return self.result_from_sources(eris_result, len(history_results), top_similarity, kb_articles_used)
+
+    def result_from_sources(
+        self,
+        eris_result: ErisAnalysisResult,
+        history_used: int,
+        top_similarity: float,
+        kb_articles_used: int,
+    ) -> AIAgentResult:
+        """То же по числу источников и лучшей похожести (batch: контекст собран при отправке запроса)."""
+        # Определяем confidence на основе найденных источников
+        if history_used > 0 and top_similarity >= 0.65:
+            confidence = 0.90  # Высокая уверенность - есть похожее обращение
+        elif kb_articles_used > 0:
+            confidence = 0.80  # Средняя - есть статьи KB
+        else:
+            confidence = 0.60  # Базовая - только LLM
+
+        return AIAgentResult(
+            sender_full_name=eris_result.sender_full_name,
+            object_name=eris_result.object_name,
+            sender_phone=eris_result.sender_phone,
+            serial_numbers=eris_result.serial_numbers,
+            device_type=eris_result.device_type,
+            sentiment=eris_result.sentiment,
+            request_category=eris_result.request_category,
+            issue_summary=eris_result.issue_summary,
+            reply=eris_result.reply,
+            operator_required=eris_result.operator_required,
+            operator_reason=eris_result.operator_reason,
+            kb_articles_used=kb_articles_used + history_used,
+            confidence=confidence
+        )
+
     def process_ticket(
         self,
         ticket,
         attachments_summary: str = "",
         attachments_extracted_text: str = "",
+        body: Optional[str] = None,
     ) -> AIAgentResult:
         """
         Обрабатывает тикет из БД.
@@ -163,13 +204,14 @@ class AIAgent:
             ticket: Объект Ticket из БД
             attachments_summary: Краткое описание вложений (имя, mime, размер)
             attachments_extracted_text: Извлечённый из вложений текст для контекста AI
+            body: текст вместо ticket.body (продолжение переписки — только новые сообщения)
 
         Returns:
             AIAgentResult
         """
         return self.process_email(
             subject=ticket.subject or "",
-            body=ticket.body or "",
+            body=body if body is not None else (ticket.body or ""),
             sender_email=ticket.sender_email or "",
             attachments_summary=attachments_summary or "",
             attachments_extracted_text=attachments_extracted_text or "",
@@ -230,6 +272,72 @@ class AIAgent:
         return mapping.get(request_category, "other")
 
 
+class AsyncAIAgent(AIAgent):
+    """
+    Асинхронный вариант AIAgent (AsyncSession + AsyncOpenAI) для asyncio-воркеров:
+    ожидание LLM не держит поток, сотни анализов идут на одном event loop.
+    Поиск по KB/истории — тот же sync-код через AsyncSession.run_sync.
+    """
+
+    def __init__(self, session, client=None):
+        self.session = session  # AsyncSession
+        self.client = client  # общий AsyncOpenAI
+
+    async def build_context(self, subject: str, body: str, log: bool = True) -> Tuple[str, List[HistorySearchResult], int]:
+        return await self.session.run_sync(lambda db: AIAgent(db).build_context(subject, body, log))
+
+    async def process_email(
+        self,
+        subject: str,
+        body: str,
+        sender_email: str = "",
+        attachments_summary: str = "",
+        attachments_extracted_text: str = "",
+    ) -> AIAgentResult:
+        combined_context, history_results, kb_articles_used = await self.build_context(subject, body)
+        # Соединение с БД не держим на время ответа LLM
+        await self.session.commit()
+
+        try:
+            eris_result = await analyze_eris_email_async(
+                subject=subject,
+                body=body,
+                sender_email=sender_email,
+                kb_context=combined_context,
+                attachments_summary=attachments_summary or "",
+                attachments_extracted_text=attachments_extracted_text or "",
+                client=self.client,
+            )
+            return self.result_from_eris(eris_result, history_results, kb_articles_used)
+
+        except AiRateLimited:
+            raise
+        except Exception as e:
+            print(f"[AI Agent] Ошибка LLM: {e}")
+            return AIAgentResult(
+                sentiment="neutral",
+                request_category="другое",
+                reply=self._generate_fallback_reply(),
+                kb_articles_used=kb_articles_used,
+                confidence=0.3
+            )
+
+    async def process_ticket(
+        self,
+        ticket,
+        attachments_summary: str = "",
+        attachments_extracted_text: str = "",
+        body: Optional[str] = None,
+    ) -> AIAgentResult:
+        return await self.process_email(
+            subject=ticket.subject or "",
+            body=body if body is not None else (ticket.body or ""),
+            sender_email=ticket.sender_email or "",
+            attachments_summary=attachments_summary or "",
+            attachments_extracted_text=attachments_extracted_text or "",
+        )
+
+
 def process_email_with_agent(
     db: Session,
     subject: str,
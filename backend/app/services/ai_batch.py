@@ -0,0 +1,459 @@
+"""
+Пакетный повторный AI-анализ (после смены промпта или ALLOWED_CATEGORIES).
+
+Пайплайн:
+1. Отбор тикетов по фильтру (категория, ai_status, даты, id, ...)
+2. Массовая сборка промптов: KB и история загружаются один раз, тикеты — чанками
+3. Отправка через batch-интерфейс:
+   - openai: OpenAI Batch API (JSONL, /v1/chat/completions, окно 24h, ~50% дешевле);
+   - local: офлайн mock-раннер с тем же форматом JSONL — пробный прогон (dry run): считает
+     результаты, в тикеты ничего не пишет; выбирается только явно (runner=local)
+4. Запись результатов чанками (один commit на чанк) + прогресс в ai_batches
+confidence считается по тому же контексту (история, KB), что ушёл в промпт: число источников
+и лучшая похожесть едут в custom_id запроса и возвращаются в строке результата.
+Прерванный батч OpenAI продолжает опрос после рестарта (provider_batch_id).
+"""
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import AiBatch, Ticket, TicketAttachment
+from app.services.openai_service import (
+    ALLOWED_CATEGORIES,
+    ERIS_MAX_TOKENS,
+    ERIS_TEMPERATURE,
+    build_eris_messages,
+    parse_eris_response,
+)
+
+# Предел тикетов в одном батче (OpenAI: до 50 000 запросов на входной файл)
+BATCH_MAX_TICKETS = 20_000
+# Тикетов на один запрос к БД при сборке промптов и при записи результатов
+CHUNK_SIZE = 200
+OPENAI_BATCH_ENDPOINT = "/v1/chat/completions"
+
+RUNNER_OPENAI = "openai"
+RUNNER_LOCAL = "local"
+
+_ACTIVE_STATUSES = ("queued", "building", "running", "writing")
+
+
+def _custom_id(ticket_id: int, history_used: int = 0, top_similarity: float = 0.0, kb_articles_used: int = 0) -> str:
+    """ticket-{id}-{найдено в истории}-{лучшая похожесть}-{статей KB}."""
+    return f"ticket-{ticket_id}-{history_used}-{top_similarity:.3f}-{kb_articles_used}"
+
+
+def _ticket_id_from_custom(custom_id: str) -> Optional[int]:
+    try:
+        return int((custom_id or "").split("-")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _context_from_custom(custom_id: str) -> Tuple[int, float, int]:
+    """(history_used, top_similarity, kb_articles_used) из custom_id; старый формат ticket-{id} — нули."""
+    try:
+        _, _, history_used, top_similarity, kb_articles_used = (custom_id or "").split("-")
+        return int(history_used), float(top_similarity), int(kb_articles_used)
+    except ValueError:
+        return 0, 0.0, 0
+
+
+# ─── Отбор и сборка запросов ──────────────────────────────────────────
+
+
+def select_ticket_ids(db: Session, filters: dict) -> List[int]:
+    """Id тикетов по фильтру батча (по возрастанию id, не больше limit)."""
+    q = db.query(Ticket.id)
+    if filters.get("ticket_ids"):
+        q = q.filter(Ticket.id.in_(filters["ticket_ids"]))
+    if filters.get("request_category"):
+        # Точное совпадение: нужны и категории, которых уже нет в whitelist
+        q = q.filter(Ticket.request_category == filters["request_category"])
+    if filters.get("outside_allowed_categories"):
+        q = q.filter((Ticket.request_category.is_(None)) | (~Ticket.request_category.in_(ALLOWED_CATEGORIES)))
+    if filters.get("ai_status"):
+        q = q.filter(Ticket.ai_status == filters["ai_status"])
+    if filters.get("status"):
+        q = q.filter(Ticket.status == filters["status"])
+    if filters.get("source"):
+        q = q.filter(Ticket.source == filters["source"])
+    # Даты в filters хранятся строками (JSON)
+    if filters.get("created_from"):
+        q = q.filter(Ticket.created_at >= datetime.fromisoformat(str(filters["created_from"])))
+    if filters.get("created_to"):
+        q = q.filter(Ticket.created_at < datetime.fromisoformat(str(filters["created_to"])))
+    limit = min(int(filters.get("limit") or BATCH_MAX_TICKETS), BATCH_MAX_TICKETS)
+    return [row[0] for row in q.order_by(Ticket.id).limit(limit).all()]
+
+
+def build_batch_requests(db: Session, ticket_ids: List[int]) -> Iterator[dict]:
+    """
+    Строки JSONL в формате OpenAI Batch API. KB/история загружаются один раз (preload),
+    тикеты и их вложения — одним запросом на чанк.
+    """
+    from app.services.ai_agent import AIAgent
+
+    settings = get_settings()
+    model = settings.openai_model or "gpt-4o-mini"
+    agent = AIAgent(db)
+    agent.preload()
+
+    for i in range(0, len(ticket_ids), CHUNK_SIZE):
+        chunk = ticket_ids[i:i + CHUNK_SIZE]
+        tickets = db.query(Ticket).filter(Ticket.id.in_(chunk)).order_by(Ticket.id).all()
+        atts_by_ticket: Dict[int, List[TicketAttachment]] = {}
+        for a in db.query(TicketAttachment).filter(TicketAttachment.ticket_id.in_(chunk)).all():
+            atts_by_ticket.setdefault(a.ticket_id, []).append(a)
+
+        for t in tickets:
+            subject, body = t.subject or "", t.body or ""
+            kb_context, history_results, kb_articles_used = agent.build_context(subject, body, log=False)
+            attachments_summary = "; ".join(
+                f"{a.filename} ({a.mime_type}, {a.size_bytes or 0} bytes)" for a in atts_by_ticket.get(t.id, [])
+            )
+            messages = build_eris_messages(
+                subject,
+                body,
+                t.sender_email or "",
+                kb_context,
+                attachments_summary,
+                (t.attachments_text or "").strip(),
+            )
+            yield {
+                "custom_id": _custom_id(
+                    t.id,
+                    len(history_results),
+                    history_results[0].similarity if history_results else 0.0,
+                    kb_articles_used,
+                ),
+                "method": "POST",
+                "url": OPENAI_BATCH_ENDPOINT,
+                "body": {
+                    "model": model,
+                    "messages": messages,
+                    "max_tokens": ERIS_MAX_TOKENS,
+                    "temperature": ERIS_TEMPERATURE,
+                },
+            }
+        # Прочитанные тикеты больше не нужны в identity map
+        db.expunge_all()
+
+
+# ─── Раннеры ──────────────────────────────────────────────────────────
+
+
+class BatchRunner(ABC):
+    """Исполняет JSONL-запросы и отдаёт строки результата в формате OpenAI Batch output."""
+
+    name: str = ""
+
+    @abstractmethod
+    def run(
+        self,
+        requests: Iterable[dict],
+        on_submitted: Callable[[str], None],
+        on_progress: Callable[[int], None],
+    ) -> Iterator[dict]:
+        pass
+
+    def resume(self, provider_batch_id: str, on_progress: Callable[[int], None]) -> Iterator[dict]:
+        raise RuntimeError(f"Раннер {self.name} не поддерживает продолжение после рестарта")
+
+
+class OpenAIBatchRunner(BatchRunner):
+    """OpenAI Batch API: загрузка JSONL, создание батча, опрос статуса, скачивание результата."""
+
+    name = RUNNER_OPENAI
+
+    def __init__(self):
+        from openai import OpenAI
+
+        settings = get_settings()
+        if not (settings.openai_api_key or "").strip():
+            raise ValueError("OPENAI_API_KEY не задан — используйте runner=local")
+        self.client = OpenAI(api_key=settings.openai_api_key.strip(), timeout=120.0)
+        self.poll_sec = max(5, settings.ai_batch_poll_seconds)
+
+    def run(self, requests, on_submitted, on_progress):
+        payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in requests).encode("utf-8")
+        if not payload:
+            return iter(())
+        input_file = self.client.files.create(file=("reanalyze.jsonl", payload), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=OPENAI_BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        on_submitted(batch.id)
+        print(f"[AI Batch] OpenAI batch {batch.id} отправлен", flush=True)
+        return self.resume(batch.id, on_progress)
+
+    def resume(self, provider_batch_id, on_progress):
+        while True:
+            batch = self.client.batches.retrieve(provider_batch_id)
+            counts = batch.request_counts
+            if counts is not None:
+                on_progress((counts.completed or 0) + (counts.failed or 0))
+            if batch.status == "completed":
+                break
+            if batch.status in ("failed", "expired", "cancelled"):
+                raise RuntimeError(f"OpenAI batch {provider_batch_id}: {batch.status}")
+            time.sleep(self.poll_sec)
+
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+class LocalBatchRunner(BatchRunner):
+    """
+    Офлайн mock-раннер: тот же вход/выход, что у Batch API, ответ строится эвристиками
+    по тексту письма (категория из whitelist, тональность, модель прибора). Без сети и ключа.
+    Результаты фиктивные — батч с этим раннером в тикеты не пишет (dry run).
+    """
+
+    name = RUNNER_LOCAL
+    NEGATIVE_MARKERS = ("жалоб", "недовол", "возмущ", "безобраз", "ужасн", "претензи")
+
+    def run(self, requests, on_submitted, on_progress):
+        done = 0
+        for req in requests:
+            content = self._mock_completion(req["body"]["messages"])
+            done += 1
+            on_progress(done)
+            yield {
+                "custom_id": req["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"message": {"role": "assistant", "content": content}}]},
+                },
+                "error": None,
+            }
+
+    def _mock_completion(self, messages: List[dict]) -> str:
+        from app.services.device_extract import extract_device_model
+
+        text = (messages[-1].get("content") or "").lower()
+        category = next((c for c in ALLOWED_CATEGORIES if c != "другое" and c in text), "другое")
+        sentiment = "negative" if any(m in text for m in self.NEGATIVE_MARKERS) else "neutral"
+        return json.dumps({
+            "full_name": None,
+            "object_name": None,
+            "phone": None,
+            "serial_numbers": [],
+            "device_type": extract_device_model(text),
+            "sentiment": sentiment,
+            "category": category,
+            "issue_summary": None,
+            "reply": "Благодарим за обращение в службу технической поддержки ЭРИС. Ваш запрос получен и будет рассмотрен специалистом.",
+            "operator_required": False,
+            "operator_reason": None,
+        }, ensure_ascii=False)
+
+
+def resolve_runner_name(name: Optional[str]) -> str:
+    """
+    auto -> openai. Mock-раннер только по явному runner=local: подставлять его молча нельзя.
+    Raises: ValueError — нужен OpenAI, а ключа нет.
+    """
+    name = (name or get_settings().ai_batch_runner or "auto").strip().lower()
+    if name == RUNNER_LOCAL:
+        return name
+    if not get_settings().openai_api_key:
+        raise ValueError("OPENAI_API_KEY не задан — пакетный анализ недоступен (runner=local — пробный прогон без записи)")
+    return RUNNER_OPENAI
+
+
+def get_batch_runner(name: str) -> BatchRunner:
+    if name == RUNNER_OPENAI:
+        return OpenAIBatchRunner()
+    return LocalBatchRunner()
+
+
+# ─── Запись результатов ───────────────────────────────────────────────
+
+
+def _response_content(line: dict) -> Optional[str]:
+    resp = line.get("response") or {}
+    if resp.get("status_code") != 200:
+        return None
+    try:
+        return resp["body"]["choices"][0]["message"]["content"] or ""
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def _line_error(line: dict) -> str:
+    err = line.get("error") or {}
+    if isinstance(err, dict) and err.get("message"):
+        return str(err["message"])[:500]
+    resp = line.get("response") or {}
+    return f"HTTP {resp.get('status_code')}"[:500]
+
+
+def _write_chunk(db: Session, batch: AiBatch, chunk: List[dict], notify: bool, dry_run: bool = False) -> None:
+    """Применяет результаты чанка к тикетам и коммитит одним UPDATE-пакетом. dry_run — только счётчики батча."""
+    from app.services.ai_agent import AIAgent
+    from app.services.telegram_service import maybe_send_telegram_alert, should_send_telegram_alert
+
+    by_id = {}
+    for line in chunk:
+        tid = _ticket_id_from_custom(line.get("custom_id", ""))
+        if tid is not None:
+            by_id[tid] = line
+    tickets = db.query(Ticket).filter(Ticket.id.in_(list(by_id))).all() if by_id else []
+    agent = AIAgent(db)
+    now = datetime.now(timezone.utc)
+    alerts = []
+    for t in tickets:
+        line = by_id[t.id]
+        content = _response_content(line)
+        if content is None:
+            # Предыдущий результат не трогаем, только фиксируем ошибку
+            if not dry_run:
+                t.ai_error = _line_error(line)
+            batch.failed += 1
+            continue
+        eris = parse_eris_response(content, t.subject or "", t.body or "")
+        if dry_run:
+            batch.succeeded += 1
+            continue
+        history_used, top_similarity, kb_articles_used = _context_from_custom(line.get("custom_id", ""))
+        agent.update_ticket_with_result(
+            t, agent.result_from_sources(eris, history_used, top_similarity, kb_articles_used)
+        )
+        t.ai_status = "done"
+        t.ai_error = None
+        batch.succeeded += 1
+        if should_send_telegram_alert(t.sentiment, t.operator_required, t.telegram_notified_at):
+            if notify:
+                alerts.append(t)
+            else:
+                # Исторические тикеты: не слать (и не догонять на старте) алерты за старые обращения
+                t.telegram_notified_at = now
+    batch.failed += len(by_id) - len(tickets)  # тикет удалён, пока батч шёл
+    batch.processed += len(by_id)
+    db.commit()
+    for t in alerts:
+        try:
+            maybe_send_telegram_alert(db, t)
+        except Exception as tg_err:
+            print(f"[AI Batch] Telegram skip: {tg_err}")
+    db.expunge_all()
+
+
+# ─── Оркестрация ──────────────────────────────────────────────────────
+
+
+def _set(db: Session, batch_id: int, **values) -> None:
+    db.query(AiBatch).filter(AiBatch.id == batch_id).update(values)
+    db.commit()
+
+
+def run_ai_batch(batch_id: int) -> None:
+    """Выполняет батч целиком (вызывается в отдельном потоке)."""
+    from app.db import SessionLocal
+
+    db = SessionLocal()
+    build_db = None
+    try:
+        batch = db.query(AiBatch).filter(AiBatch.id == batch_id).first()
+        if not batch or batch.status not in _ACTIVE_STATUSES:
+            return
+        filters = json.loads(batch.filters or "{}")
+        notify = bool(batch.notify)
+        runner = get_batch_runner(batch.runner)
+
+        # local-раннер отдаёт результаты потоком: сборка, выполнение и запись идут вперемешку,
+        # прогресс = записанные тикеты. Для OpenAI прогресс сначала — выполненные провайдером.
+        streaming = runner.name == RUNNER_LOCAL
+        dry_run = runner.name == RUNNER_LOCAL
+        if dry_run:
+            print(f"[AI Batch] #{batch_id}: раннер local — пробный прогон, тикеты не изменяются", flush=True)
+
+        def on_progress(n: int) -> None:
+            if not streaming:
+                _set(db, batch_id, processed=n)
+
+        def on_submitted(provider_id: str) -> None:
+            _set(db, batch_id, provider_batch_id=provider_id)
+
+        if batch.provider_batch_id:
+            print(f"[AI Batch] #{batch_id}: продолжение опроса {batch.provider_batch_id}", flush=True)
+            outputs = runner.resume(batch.provider_batch_id, on_progress)
+        else:
+            _set(db, batch_id, status="building", processed=0, succeeded=0, failed=0, error=None)
+            ticket_ids = select_ticket_ids(db, filters)
+            _set(db, batch_id, total=len(ticket_ids), status="running")
+            print(f"[AI Batch] #{batch_id}: {len(ticket_ids)} тикетов, раннер {runner.name}", flush=True)
+            build_db = SessionLocal()
+            outputs = runner.run(build_batch_requests(build_db, ticket_ids), on_submitted, on_progress)
+
+        if not streaming:
+            outputs = list(outputs)  # ждём завершения батча у провайдера
+        _set(db, batch_id, status="writing", processed=0)
+        batch = db.query(AiBatch).filter(AiBatch.id == batch_id).first()
+        chunk: List[dict] = []
+        for line in outputs:
+            chunk.append(line)
+            if len(chunk) >= CHUNK_SIZE:
+                _write_chunk(db, batch, chunk, notify, dry_run)
+                batch = db.query(AiBatch).filter(AiBatch.id == batch_id).first()
+                chunk = []
+        if chunk:
+            _write_chunk(db, batch, chunk, notify, dry_run)
+        _set(db, batch_id, status="done", finished_at=datetime.now(timezone.utc))
+        batch = db.query(AiBatch).filter(AiBatch.id == batch_id).first()
+        print(f"[AI Batch] #{batch_id}: готово ({batch.succeeded} ок, {batch.failed} ошибок)", flush=True)
+    except Exception as e:
+        print(f"[AI Batch] #{batch_id}: ошибка — {e}", flush=True)
+        try:
+            db.rollback()
+            _set(db, batch_id, status="failed", error=str(e)[:500], finished_at=datetime.now(timezone.utc))
+        except Exception:
+            db.rollback()
+    finally:
+        if build_db is not None:
+            build_db.close()
+        db.close()
+
+
+def start_ai_batch(db: Session, filters: dict, runner: Optional[str] = None, notify: bool = False) -> AiBatch:
+    """Создаёт батч и запускает его в фоне."""
+    batch = AiBatch(
+        status="queued",
+        runner=resolve_runner_name(runner),
+        filters=json.dumps(filters, ensure_ascii=False, default=str),
+        notify=1 if notify else 0,
+    )
+    db.add(batch)
+    db.commit()
+    db.refresh(batch)
+    threading.Thread(target=run_ai_batch, args=(batch.id,), daemon=True, name=f"ai-batch-{batch.id}").start()
+    return batch
+
+
+def resume_ai_batches() -> None:
+    """Startup: незавершённые батчи продолжаются (OpenAI — опрос по provider_batch_id, иначе заново)."""
+    from app.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        ids = [row[0] for row in db.query(AiBatch.id).filter(AiBatch.status.in_(_ACTIVE_STATUSES)).all()]
+    except Exception as e:
+        print(f"[AI Batch] resume: {e}", flush=True)
+        ids = []
+    finally:
+        db.close()
+    for batch_id in ids:
+        threading.Thread(target=run_ai_batch, args=(batch_id,), daemon=True, name=f"ai-batch-{batch_id}").start()
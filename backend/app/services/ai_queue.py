@@ -0,0 +1,618 @@
+"""
+Очередь AI-задач поверх БД (таблица ai_jobs) + фиксированный пул воркеров.
+
+Все источники (веб-форма, IMAP, загрузка вложений) только ставят задачу в очередь;
+анализ выполняют AI_WORKERS потоков. Задачи переживают рестарт процесса:
+- PostgreSQL: захват через SELECT ... FOR UPDATE SKIP LOCKED;
+- SQLite: условный UPDATE (status/locked_until в WHERE) + процессный lock.
+Выполняющаяся задача продлевает аренду (locked_until) каждые visibility timeout / 3 (LeaseHeartbeat);
+зависшая running-задача (воркер умер) снова доступна после visibility timeout, а если попытки
+исчерпаны — переводится в failed. Завершить задачу может только воркер, который её держит.
+"""
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session, aliased
+
+from app.config import get_settings
+from app.models import AiJob, AiJobAttempt, Ticket, TicketAttachment
+from app.services.rate_limiter import AiRateLimited
+
+# Типы задач
+JOB_ANALYZE = "analyze"  # первичный анализ тикета
+JOB_ATTACHMENTS = "attachments"  # повторный анализ после загрузки вложений
+JOB_FOLLOW_UP = "follow_up"  # ответ клиента в переписке: анализ только новых сообщений
+
+# Приоритеты (меньше = раньше)
+PRIORITY_HIGH = 10  # веб-форма: клиент ждёт ответ в UI
+PRIORITY_NORMAL = 50  # входящая почта
+PRIORITY_LOW = 100  # фоновые/массовые перезапуски
+
+# Backoff между попытками: 30s, 60s, 120s, ...
+RETRY_BASE_DELAY_SEC = 30
+# Пауза воркера, если очередь пуста (enqueue в этом процессе будит раньше)
+IDLE_POLL_SEC = 2.0
+# Backpressure: через сколько вернуть задачу, если квота LLM исчерпана (без retry-after)
+RATE_LIMIT_DEFER_SEC = 15
+
+# SQLite не умеет SKIP LOCKED — сериализуем захват внутри процесса
+_sqlite_claim_lock = threading.Lock()
+
+
+@dataclass
+class ClaimedJob:
+    """Захваченная воркером задача (без ORM-объекта, чтобы не держать сессию)."""
+    id: int
+    ticket_id: int
+    kind: str
+    attempts: int
+    max_attempts: int
+    attempt_id: Optional[int] = None  # строка в ai_job_attempts
+    started: float = 0.0  # time.monotonic() захвата
+    worker_id: Optional[str] = None  # locked_by: завершение и продление аренды — только им
+
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _is_sqlite(db: Session) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def enqueue_ai_job(
+    db: Session,
+    ticket_id: int,
+    kind: str = JOB_ANALYZE,
+    priority: int = PRIORITY_NORMAL,
+    commit: bool = True,
+) -> AiJob:
+    """
+    Ставит AI-задачу в очередь. Если для тикета уже есть queued/running задача того же типа —
+    возвращает её (без дублей при повторных загрузках/синках). follow_up — только queued:
+    выполняющаяся задача уже собрала сообщения, ответ, пришедший во время анализа, иначе
+    остался бы без анализа.
+    """
+    statuses = ("queued",) if kind == JOB_FOLLOW_UP else ("queued", "running")
+    existing = db.query(AiJob).filter(
+        AiJob.ticket_id == ticket_id,
+        AiJob.kind == kind,
+        AiJob.status.in_(statuses),
+    ).first()
+    if existing:
+        if priority < existing.priority and existing.status == "queued":
+            existing.priority = priority
+            if commit:
+                db.commit()
+        return existing
+
+    job = AiJob(
+        ticket_id=ticket_id,
+        kind=kind,
+        priority=priority,
+        status="queued",
+        attempts=0,
+        max_attempts=max(1, get_settings().ai_job_max_attempts),
+        run_after=_utcnow(),
+    )
+    db.add(job)
+    if commit:
+        db.commit()
+    _wake_workers()
+    return job
+
+
+def _lease() -> timedelta:
+    return timedelta(seconds=max(30, get_settings().ai_job_visibility_timeout_seconds))
+
+
+def _owned(job: ClaimedJob):
+    """Условие UPDATE: задача всё ещё у этого воркера (аренду не забрал другой после visibility timeout)."""
+    return and_(AiJob.id == job.id, AiJob.status == "running", AiJob.locked_by == job.worker_id)
+
+
+def _fail_abandoned_jobs(db: Session, now: datetime) -> None:
+    """
+    running-задачи с истёкшей арендой и исчерпанными попытками (воркер падает на них каждый раз —
+    OOM, segfault в OCR) -> failed вместо бесконечного повторного захвата; тикет -> failed.
+    """
+    rows = db.execute(
+        select(AiJob.id, AiJob.ticket_id).where(
+            AiJob.status == "running", AiJob.locked_until < now, AiJob.attempts >= AiJob.max_attempts
+        )
+    ).all()
+    if not rows:
+        return
+    err = "Воркер не завершил задачу (процесс упал или завис), попытки исчерпаны"
+    for job_id, ticket_id in rows:
+        res = db.execute(
+            update(AiJob)
+            .where(AiJob.id == job_id, AiJob.status == "running", AiJob.locked_until < now)
+            .values(status="failed", locked_until=None, last_error=err, updated_at=now)
+        )
+        if not res.rowcount:
+            continue
+        db.execute(
+            update(AiJobAttempt)
+            .where(AiJobAttempt.job_id == job_id, AiJobAttempt.status == "running")
+            .values(status="failed", error=err, finished_at=now)
+        )
+        db.execute(update(Ticket).where(Ticket.id == ticket_id).values(ai_status="failed", ai_error=err))
+        print(f"[AI Queue] Тикет #{ticket_id}: задача {job_id} — {err}", flush=True)
+    db.commit()
+
+
+def claim_next_job(db: Session, worker_id: str) -> Optional[ClaimedJob]:
+    """
+    Атомарно забирает следующую доступную задачу (queued или running с истёкшим locked_until).
+    queued-задача ждёт, пока выполняется задача того же типа по тому же тикету (follow_up).
+    """
+    now = _utcnow()
+    lease = _lease()
+    other = aliased(AiJob)
+    ticket_busy = (
+        select(other.id)
+        .where(
+            other.ticket_id == AiJob.ticket_id,
+            other.kind == AiJob.kind,
+            other.id != AiJob.id,
+            other.status == "running",
+            other.locked_until >= now,
+        )
+        .exists()
+    )
+    available = or_(
+        and_(AiJob.status == "queued", AiJob.run_after <= now, ~ticket_busy),
+        and_(AiJob.status == "running", AiJob.locked_until < now, AiJob.attempts < AiJob.max_attempts),
+    )
+    stmt = (
+        select(AiJob.id)
+        .where(available)
+        .order_by(AiJob.priority, AiJob.run_after, AiJob.id)
+        .limit(1)
+    )
+    sqlite = _is_sqlite(db)
+    if not sqlite:
+        stmt = stmt.with_for_update(skip_locked=True)
+
+    lock = _sqlite_claim_lock if sqlite else None
+    if lock:
+        lock.acquire()
+    try:
+        _fail_abandoned_jobs(db, now)
+        job_id = db.execute(stmt).scalar()
+        if job_id is None:
+            db.rollback()
+            return None
+        res = db.execute(
+            update(AiJob)
+            .where(AiJob.id == job_id, available)
+            .values(
+                status="running",
+                attempts=AiJob.attempts + 1,
+                locked_by=worker_id,
+                locked_until=now + lease,
+                updated_at=now,
+            )
+        )
+        if not res.rowcount:
+            db.rollback()
+            return None
+        db.commit()
+    finally:
+        if lock:
+            lock.release()
+
+    job = db.query(AiJob).filter(AiJob.id == job_id).first()
+    # Повторный захват после истёкшей аренды: прежняя попытка так и не завершилась
+    db.execute(
+        update(AiJobAttempt)
+        .where(AiJobAttempt.job_id == job.id, AiJobAttempt.status == "running")
+        .values(status="failed", error="Аренда истекла (воркер не завершил задачу)", finished_at=now)
+    )
+    attempt = AiJobAttempt(
+        job_id=job.id,
+        ticket_id=job.ticket_id,
+        kind=job.kind,
+        attempt=job.attempts,
+        worker=worker_id,
+        status="running",
+        started_at=now,
+    )
+    db.add(attempt)
+    db.commit()
+    return ClaimedJob(
+        id=job.id,
+        ticket_id=job.ticket_id,
+        kind=job.kind,
+        attempts=job.attempts,
+        max_attempts=job.max_attempts,
+        attempt_id=attempt.id,
+        started=time.monotonic(),
+        worker_id=worker_id,
+    )
+
+
+def renew_lease(db: Session, job: ClaimedJob) -> bool:
+    """Продлевает аренду задачи. Returns: False — задачу уже забрал другой воркер (или она завершена)."""
+    res = db.execute(update(AiJob).where(_owned(job)).values(locked_until=_utcnow() + _lease()))
+    db.commit()
+    return bool(res.rowcount)
+
+
+def holds_lease(db: Session, job: ClaimedJob) -> bool:
+    """Задача всё ещё у этого воркера — можно записывать результат в тикет."""
+    return db.execute(select(AiJob.id).where(_owned(job))).first() is not None
+
+
+class LeaseHeartbeat:
+    """
+    Продлевает аренду задачи, пока выполняется обработчик (with LeaseHeartbeat(job): ...):
+    извлечение вложений + LLM могут идти дольше visibility timeout. Отдельный поток и своя сессия —
+    работает и для потоковых воркеров, и для async-пула.
+    """
+
+    def __init__(self, job: ClaimedJob):
+        self.job = job
+        self.interval = max(5.0, _lease().total_seconds() / 3)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"ai-lease-{self.job.id}")
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        from app.db import SessionLocal
+
+        while not self._stop.wait(self.interval):
+            db = SessionLocal()
+            try:
+                if not renew_lease(db, self.job):
+                    print(f"[AI Queue] Задача {self.job.id}: аренда потеряна, результат не будет записан", flush=True)
+                    return
+            except Exception as e:
+                print(f"[AI Queue] Задача {self.job.id}: не удалось продлить аренду: {e}", flush=True)
+                try:
+                    db.rollback()
+                except Exception:
+                    pass
+            finally:
+                db.close()
+
+
+def _finish_attempt(db: Session, job: ClaimedJob, status: str, error: Optional[str] = None) -> None:
+    """Закрывает строку истории попыток (коммит — вместе с изменением задачи)."""
+    if job.attempt_id is None:
+        return
+    db.execute(
+        update(AiJobAttempt)
+        .where(AiJobAttempt.id == job.attempt_id)
+        .values(
+            status=status,
+            error=error,
+            finished_at=_utcnow(),
+            duration_ms=int((time.monotonic() - job.started) * 1000) if job.started else None,
+        )
+    )
+
+
+def _lease_lost(db: Session, job: ClaimedJob) -> None:
+    db.rollback()
+    print(f"[AI Queue] Задача {job.id} (тикет #{job.ticket_id}): аренду забрал другой воркер — результат отброшен")
+
+
+def complete_job(db: Session, job: ClaimedJob) -> bool:
+    """Returns: False — задача уже не у этого воркера (аренда истекла), ничего не записано."""
+    res = db.execute(
+        update(AiJob)
+        .where(_owned(job))
+        .values(status="done", locked_until=None, last_error=None, updated_at=_utcnow())
+    )
+    if not res.rowcount:
+        _lease_lost(db, job)
+        return False
+    _finish_attempt(db, job, "done")
+    db.commit()
+    return True
+
+
+def fail_job(db: Session, job: ClaimedJob, error: str) -> bool:
+    """
+    Фиксирует ошибку. Если попытки остались — задача вернётся в очередь с backoff,
+    тикет остаётся ai_status=pending. Иначе задача и тикет -> failed.
+    Задачу уже забрал другой воркер — ничего не меняется.
+    Returns: True если будет повтор.
+    """
+    db.rollback()
+    err = (error or "")[:500]
+    now = _utcnow()
+    retry = job.attempts < job.max_attempts
+    if retry:
+        delay = RETRY_BASE_DELAY_SEC * (2 ** max(0, job.attempts - 1))
+        values = dict(status="queued", run_after=now + timedelta(seconds=delay))
+    else:
+        values = dict(status="failed")
+    res = db.execute(
+        update(AiJob)
+        .where(_owned(job))
+        .values(locked_until=None, last_error=err, updated_at=now, **values)
+    )
+    if not res.rowcount:
+        _lease_lost(db, job)
+        return False
+    _finish_attempt(db, job, "failed", err)
+    ticket = db.query(Ticket).filter(Ticket.id == job.ticket_id).first()
+    if ticket:
+        ticket.ai_error = err
+        ticket.ai_status = "pending" if retry else "failed"
+    db.commit()
+    return retry
+
+
+def defer_job(db: Session, job: ClaimedJob, delay_sec: float) -> None:
+    """
+    Backpressure: квота LLM исчерпана — задача возвращается в очередь без расхода попытки,
+    тикет остаётся ai_status=pending (не failed).
+    """
+    db.rollback()
+    now = _utcnow()
+    res = db.execute(
+        update(AiJob)
+        .where(_owned(job))
+        .values(
+            status="queued",
+            attempts=AiJob.attempts - 1,
+            run_after=now + timedelta(seconds=max(1.0, delay_sec)),
+            locked_until=None,
+            updated_at=now,
+        )
+    )
+    if not res.rowcount:
+        _lease_lost(db, job)
+        return
+    _finish_attempt(db, job, "deferred")
+    db.commit()
+
+
+# ─── Обработчики задач ────────────────────────────────────────────────
+
+
+def _attachments_summary(atts: List[TicketAttachment]) -> str:
+    """Краткий список вложений для промпта (без повторного извлечения текста)."""
+    return "; ".join(f"{a.filename} ({a.mime_type}, {a.size_bytes or 0} bytes)" for a in atts)
+
+
+def _extract_attachments(atts: List[TicketAttachment]) -> Tuple[str, str]:
+    """
+    Разбирает ещё не разобранные вложения (параллельно, в пуле процессов extraction_service)
+    и собирает текст всех вложений из их строк.
+    Returns: (attachments_summary, attachments_extracted_text).
+    """
+    from app.services.attachment_text import assemble_attachments_text, extract_pending_attachments
+
+    extract_pending_attachments(atts)
+    summary = "\n".join(f"- {att.filename} ({att.mime_type}, {(att.size_bytes or 0) / 1024:.1f} KB)" for att in atts)
+    return summary, assemble_attachments_text(atts) or ""
+
+
+@dataclass
+class JobInput:
+    """Аргументы AIAgent.process_ticket, собранные обработчиком задачи (одни и те же для обоих пулов)."""
+    attachments_summary: str
+    attachments_extracted_text: str
+    body: Optional[str] = None
+
+
+def _handle_analyze(db: Session, ticket: Ticket) -> Optional[JobInput]:
+    """Анализ тикета AI-агентом по уже сохранённым вложениям/тексту."""
+    if not get_settings().openai_api_key:
+        return None
+    atts = db.query(TicketAttachment).filter(TicketAttachment.ticket_id == ticket.id).all()
+    return JobInput(_attachments_summary(atts), (ticket.attachments_text or "").strip())
+
+
+def _handle_attachments(db: Session, ticket: Ticket) -> Optional[JobInput]:
+    """Повторный анализ после загрузки вложений (веб-форма): извлечение текста новых файлов + AI."""
+    atts = db.query(TicketAttachment).filter(TicketAttachment.ticket_id == ticket.id).all()
+    attachments_summary, attachments_extracted_text = _extract_attachments(atts)
+    ticket.attachments_text = attachments_extracted_text or None
+    if not get_settings().openai_api_key:
+        return None
+    return JobInput(attachments_summary, attachments_extracted_text)
+
+
+def _handle_follow_up(db: Session, ticket: Ticket) -> Optional[JobInput]:
+    """Инкрементальный анализ: краткое содержание + прошлый ответ + новые сообщения клиента."""
+    from app.services.email_threads import build_follow_up_body
+
+    if not get_settings().openai_api_key:
+        return None
+    atts = db.query(TicketAttachment).filter(TicketAttachment.ticket_id == ticket.id).all()
+    return JobInput(
+        _attachments_summary(atts),
+        (ticket.attachments_text or "").strip(),
+        body=build_follow_up_body(db, ticket),
+    )
+
+
+_HANDLERS = {
+    JOB_ANALYZE: _handle_analyze,
+    JOB_ATTACHMENTS: _handle_attachments,
+    JOB_FOLLOW_UP: _handle_follow_up,
+}
+
+
+def prepare_job(db: Session, job: ClaimedJob) -> Tuple[Optional[Ticket], Optional[JobInput]]:
+    """
+    Шаг «до LLM», общий для AiWorkerPool и AsyncAiWorkerPool: тикет + данные от обработчика задачи.
+    Тикет удалён — задача закрывается, (None, None). JobInput None — анализ не нужен (нет OPENAI_API_KEY).
+    """
+    ticket = db.query(Ticket).filter(Ticket.id == job.ticket_id).first()
+    if not ticket:
+        complete_job(db, job)
+        return None, None
+    handler = _HANDLERS.get(job.kind)
+    if handler is None:
+        raise ValueError(f"Неизвестный тип AI-задачи: {job.kind}")
+    return ticket, handler(db, ticket)
+
+
+def finish_job(db: Session, job: ClaimedJob, ticket: Ticket) -> bool:
+    """
+    Шаг «после LLM», общий для обоих пулов: ai_status=done, задача done, обновление дубликатов.
+    Returns: False — аренду забрал другой воркер (задача шла дольше visibility timeout), его результат не затираем.
+    """
+    from app.services.near_duplicates import propagate_to_duplicates
+
+    if not holds_lease(db, job):
+        _lease_lost(db, job)
+        return False
+    ticket.ai_status = "done"
+    ticket.ai_error = None
+    db.commit()
+    if not complete_job(db, job):
+        return False
+    print(f"[AI Queue] Тикет #{ticket.id}: задача {job.kind} выполнена (попытка {job.attempts})")
+    try:
+        propagate_to_duplicates(db, ticket)
+    except Exception as dup_err:
+        db.rollback()
+        print(f"[AI Queue] Тикет #{ticket.id}: дубликаты не обновлены: {dup_err}")
+    return True
+
+
+def run_job(db: Session, job: ClaimedJob) -> None:
+    """Выполняет задачу: ai_status=done + Telegram при успехе; исключение — для fail_job."""
+    from app.services.ai_agent import AIAgent
+    from app.services.telegram_service import maybe_send_telegram_alert
+
+    with LeaseHeartbeat(job):
+        ticket, job_input = prepare_job(db, job)
+        if ticket is None:
+            return
+        if job_input is not None:
+            agent = AIAgent(db)
+            result = agent.process_ticket(
+                ticket,
+                attachments_summary=job_input.attachments_summary,
+                attachments_extracted_text=job_input.attachments_extracted_text,
+                body=job_input.body,
+            )
+            agent.update_ticket_with_result(ticket, result)
+    if not finish_job(db, job, ticket):
+        return
+    try:
+        maybe_send_telegram_alert(db, ticket)
+    except Exception as tg_err:
+        print(f"[AI Queue] Telegram skip: {tg_err}")
+
+
+# ─── Пул воркеров ─────────────────────────────────────────────────────
+
+
+class AiWorkerPool:
+    """Фиксированное число потоков, разбирающих ai_jobs. Всплеск писем не порождает новых потоков."""
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.size):
+            t = threading.Thread(target=self._loop, args=(f"{self._prefix}:{i}",), daemon=True, name=f"ai-worker-{i}")
+            t.start()
+            self._threads.append(t)
+        print(f"[AI Queue] Запущено воркеров: {self.size}", flush=True)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads = []
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _loop(self, worker_id: str) -> None:
+        from app.db import SessionLocal
+
+        while not self._stop.is_set():
+            db = SessionLocal()
+            job = None
+            try:
+                job = claim_next_job(db, worker_id)
+                if job is not None:
+                    try:
+                        run_job(db, job)
+                    except AiRateLimited as e:
+                        delay = e.retry_after or RATE_LIMIT_DEFER_SEC
+                        defer_job(db, job, delay)
+                        print(f"[AI Queue] Тикет #{job.ticket_id}: лимит LLM, отложено на {delay:.0f}с")
+                        # Не выбираем следующую задачу сразу — квота всё равно исчерпана
+                        self._stop.wait(min(delay, RATE_LIMIT_DEFER_SEC))
+                    except Exception as e:
+                        err_msg = str(e)[:500]
+                        retry = fail_job(db, job, err_msg)
+                        print(
+                            f"[AI Queue] Тикет #{job.ticket_id}: ошибка ({job.attempts}/{job.max_attempts})"
+                            f"{', повтор позже' if retry else ''} — {err_msg}"
+                        )
+            except Exception as e:
+                print(f"[AI Queue] Ошибка воркера {worker_id}: {e}")
+                try:
+                    db.rollback()
+                except Exception:
+                    pass
+            finally:
+                db.close()
+            if job is None:
+                self._wake.wait(IDLE_POLL_SEC)
+                self._wake.clear()
+
+
+_pool = None  # AiWorkerPool | AsyncAiWorkerPool
+
+
+def _wake_workers() -> None:
+    if _pool is not None:
+        _pool.wake()
+
+
+def start_ai_workers():
+    """Запускает пул воркеров (один раз на процесс): потоки или asyncio (AI_WORKER_MODE=async)."""
+    global _pool
+    if _pool is None:
+        settings = get_settings()
+        if (settings.ai_worker_mode or "").strip().lower() == "async":
+            from app.services.ai_queue_async import AsyncAiWorkerPool
+            _pool = AsyncAiWorkerPool(settings.ai_async_concurrency)
+        else:
+            _pool = AiWorkerPool(settings.ai_workers)
+        _pool.start()
+    return _pool
+
+
+def stop_ai_workers() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
@@ -0,0 +1,218 @@
+"""
+Asyncio-режим очереди ai_jobs (AI_WORKER_MODE=async).
+
+Вместо AI_WORKERS потоков — один поток с event loop: одновременно в работе до
+AI_ASYNC_CONCURRENCY задач (semaphore). Ожидание LLM (AsyncOpenAI) и БД (AsyncSession)
+не держит поток, поэтому сотни анализов помещаются в небольшой контейнер.
+Шаги до и после LLM — те же функции ai_queue (prepare_job / finish_job, обработчики _HANDLERS),
+семантика очереди (retry, backpressure, история попыток) не меняется. Захват (процессный
+SQLite-lock) и подготовка задачи (извлечение вложений) идут в пуле потоков со своей сессией.
+"""
+import asyncio
+import os
+import socket
+import threading
+import time
+from typing import Optional, Set, Tuple
+
+from app.config import get_settings
+from app.models import Ticket
+from app.services.ai_queue import (
+    ClaimedJob,
+    IDLE_POLL_SEC,
+    JobInput,
+    LeaseHeartbeat,
+    RATE_LIMIT_DEFER_SEC,
+    claim_next_job,
+    complete_job,
+    defer_job,
+    fail_job,
+    finish_job,
+    prepare_job,
+)
+from app.services.rate_limiter import AiRateLimited
+
+# Сколько ждать незавершённые задачи при остановке (сек)
+SHUTDOWN_GRACE_SEC = 10.0
+
+
+def _in_thread_session(fn, *args):
+    """fn(db, *args) со своей sync-сессией — для вызова через asyncio.to_thread."""
+    from app.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+def _prepare(db, job: ClaimedJob) -> Tuple[bool, Optional[JobInput]]:
+    """prepare_job + коммит извлечённого текста вложений. Returns: (тикет есть, данные для LLM)."""
+    ticket, job_input = prepare_job(db, job)
+    if ticket is None:
+        return False, None
+    db.commit()
+    return True, job_input
+
+
+async def run_job_async(session, client, job: ClaimedJob) -> None:
+    """Асинхронный аналог ai_queue.run_job; исключение — для fail_job."""
+    from app.services.ai_agent import AsyncAIAgent
+
+    # Извлечение текста (PDF/OCR) и sync-запросы обработчика — CPU и диск, уводим с event loop
+    found, job_input = await asyncio.to_thread(_in_thread_session, _prepare, job)
+    if not found:
+        return
+    ticket = await session.get(Ticket, job.ticket_id)
+    if not ticket:
+        await asyncio.to_thread(_in_thread_session, complete_job, job)
+        return
+    if job_input is not None:
+        agent = AsyncAIAgent(session, client)
+        result = await agent.process_ticket(
+            ticket,
+            attachments_summary=job_input.attachments_summary,
+            attachments_extracted_text=job_input.attachments_extracted_text,
+            body=job_input.body,
+        )
+        agent.update_ticket_with_result(ticket, result)
+    if not await session.run_sync(finish_job, job, ticket):
+        return
+
+    from app.services.telegram_service import should_send_telegram_alert
+    if should_send_telegram_alert(ticket.sentiment, ticket.operator_required, ticket.telegram_notified_at):
+        await asyncio.to_thread(_send_alert, ticket.id)
+
+
+def _send_alert(ticket_id: int) -> None:
+    """Telegram — sync HTTP, выполняется в пуле потоков со своей сессией."""
+    from app.db import SessionLocal
+    from app.services.telegram_service import maybe_send_telegram_alert
+
+    db = SessionLocal()
+    try:
+        ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+        if ticket:
+            maybe_send_telegram_alert(db, ticket)
+    except Exception as tg_err:
+        print(f"[AI Queue] Telegram skip: {tg_err}")
+    finally:
+        db.close()
+
+
+class AsyncAiWorkerPool:
+    """Один поток с event loop; интерфейс как у AiWorkerPool (start/stop/wake)."""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._paused_until = 0.0
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}:async"
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._thread_main, args=(ready,), daemon=True, name="ai-worker-async")
+        self._thread.start()
+        ready.wait(5.0)
+        print(f"[AI Queue] Async-воркер запущен, одновременно до {self.concurrency} задач", flush=True)
+
+    def stop(self, timeout: float = SHUTDOWN_GRACE_SEC + 5.0) -> None:
+        if self._loop and self._stop:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._loop.call_soon_threadsafe(self._wake.set)
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def wake(self) -> None:
+        if self._loop and self._wake:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass  # loop уже закрыт
+
+    def _thread_main(self, ready: threading.Event) -> None:
+        asyncio.run(self._main(ready))
+
+    async def _main(self, ready: threading.Event) -> None:
+        from app.db import create_async_session_factory
+
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._wake = asyncio.Event()
+        ready.set()
+
+        settings = get_settings()
+        async_engine, session_factory = create_async_session_factory(pool_size=min(self.concurrency, 20))
+        client = None
+        if settings.openai_api_key:
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(api_key=settings.openai_api_key.strip(), timeout=60.0)
+
+        sem = asyncio.Semaphore(self.concurrency)
+        tasks: Set[asyncio.Task] = set()
+        try:
+            while not self._stop.is_set():
+                await sem.acquire()
+                # Квота LLM исчерпана — не захватываем новые задачи, пока не истечёт пауза
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    sem.release()
+                    await self._sleep(pause)
+                    continue
+                job = None
+                try:
+                    # Захват — в потоке: SQLite-lock в claim_next_job и sync-запрос не блокируют event loop
+                    job = await asyncio.to_thread(_in_thread_session, claim_next_job, self._worker_id)
+                except Exception as e:
+                    print(f"[AI Queue] Ошибка async-воркера: {e}")
+                if job is None:
+                    sem.release()
+                    await self._sleep(IDLE_POLL_SEC)
+                    continue
+                task = asyncio.create_task(self._run(session_factory, client, job, sem))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            if tasks:
+                await asyncio.wait(set(tasks), timeout=SHUTDOWN_GRACE_SEC)
+            if client is not None:
+                await client.close()
+            await async_engine.dispose()
+
+    async def _sleep(self, seconds: float) -> None:
+        """Пауза до timeout, enqueue (wake) или остановки."""
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _run(self, session_factory, client, job: ClaimedJob, sem: asyncio.Semaphore) -> None:
+        try:
+            async with session_factory() as session:
+                try:
+                    with LeaseHeartbeat(job):
+                        await run_job_async(session, client, job)
+                except AiRateLimited as e:
+                    delay = e.retry_after or RATE_LIMIT_DEFER_SEC
+                    await session.run_sync(defer_job, job, delay)
+                    self._paused_until = max(self._paused_until, time.monotonic() + min(delay, RATE_LIMIT_DEFER_SEC))
+                    print(f"[AI Queue] Тикет #{job.ticket_id}: лимит LLM, отложено на {delay:.0f}с")
+                except Exception as e:
+                    err_msg = str(e)[:500]
+                    retry = await session.run_sync(fail_job, job, err_msg)
+                    print(
+                        f"[AI Queue] Тикет #{job.ticket_id}: ошибка ({job.attempts}/{job.max_attempts})"
+                        f"{', повтор позже' if retry else ''} — {err_msg}"
+                    )
+        except Exception as e:
+            print(f"[AI Queue] Ошибка async-воркера (тикет #{job.ticket_id}): {e}")
+        finally:
+            sem.release()
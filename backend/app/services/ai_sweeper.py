@@ -0,0 +1,171 @@
+"""
+Sweeper зависших AI-анализов.
+
+Периодически (AI_SWEEPER_INTERVAL_SECONDS) возвращает в очередь ai_jobs:
+- pending-тикеты старше AI_SWEEPER_STALE_MINUTES без активной задачи
+  (процесс умер посреди анализа, тикеты из времён до очереди);
+- тикеты, дольше AI_SWEEPER_STALE_MINUTES стоящие в extracting (стадия извлечения вложений
+  упала или потеряла тикет) — с текстом уже разобранных вложений;
+- failed-тикеты, у которых всего попыток (ai_job_attempts) меньше AI_SWEEPER_MAX_ATTEMPTS
+  и с последней попытки прошло AI_SWEEPER_RETRY_COOLDOWN_MINUTES (сбой провайдера).
+За один проход ставится не больше AI_SWEEPER_BATCH_SIZE задач и только пока очередь
+не переполнена — разбор идёт пулом воркеров с фиксированной параллельностью.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import AiJob, AiJobAttempt, Ticket
+from app.services.ai_queue import enqueue_ai_job, JOB_ANALYZE, JOB_FOLLOW_UP, PRIORITY_LOW
+from app.services.ingest_pipeline import AI_STATUS_EXTRACTING, follow_up_ticket_ids, queue_with_available_text
+
+
+def _active_job_exists():
+    return (
+        select(AiJob.id)
+        .where(AiJob.ticket_id == Ticket.id, AiJob.status.in_(("queued", "running")))
+        .exists()
+    )
+
+
+def sweep_stuck_ai(db: Session) -> dict:
+    """Один проход sweeper'а. Returns: {"pending": n, "extracting": k, "failed": m, "skipped_backlog": bool}."""
+    settings = get_settings()
+    now = datetime.now(timezone.utc)
+    result = {"pending": 0, "extracting": 0, "failed": 0, "skipped_backlog": False}
+
+    backlog = db.query(func.count(AiJob.id)).filter(AiJob.status == "queued").scalar() or 0
+    budget = max(0, settings.ai_sweeper_batch_size - backlog)
+    if budget == 0:
+        result["skipped_backlog"] = True
+        return result
+
+    # 1. Зависшие pending
+    stale_cutoff = now - timedelta(minutes=settings.ai_sweeper_stale_minutes)
+    pending_ids = [
+        row[0]
+        for row in db.query(Ticket.id)
+        .filter(Ticket.ai_status == "pending", Ticket.created_at < stale_cutoff, ~_active_job_exists())
+        .order_by(Ticket.id)
+        .limit(budget)
+        .all()
+    ]
+    for ticket_id in pending_ids:
+        enqueue_ai_job(db, ticket_id, kind=JOB_ANALYZE, priority=PRIORITY_LOW, commit=False)
+    result["pending"] = len(pending_ids)
+    budget -= len(pending_ids)
+
+    # 2. Зависшие в extracting (updated_at — момент перевода в extracting)
+    if budget > 0:
+        extracting = (
+            db.query(Ticket)
+            .filter(Ticket.ai_status == AI_STATUS_EXTRACTING, Ticket.updated_at < stale_cutoff)
+            .order_by(Ticket.id)
+            .limit(budget)
+            .all()
+        )
+        threaded = follow_up_ticket_ids(db, [t.id for t in extracting])
+        for ticket in extracting:
+            queue_with_available_text(db, ticket, JOB_FOLLOW_UP if ticket.id in threaded else JOB_ANALYZE)
+        result["extracting"] = len(extracting)
+        budget -= len(extracting)
+
+    # 3. failed с оставшимися попытками
+    if budget > 0:
+        attempts_total = (
+            select(func.count(AiJobAttempt.id))
+            .where(AiJobAttempt.ticket_id == Ticket.id, AiJobAttempt.status != "deferred")
+            .scalar_subquery()
+        )
+        last_try = select(func.max(AiJob.updated_at)).where(AiJob.ticket_id == Ticket.id).scalar_subquery()
+        cooldown_cutoff = now - timedelta(minutes=settings.ai_sweeper_retry_cooldown_minutes)
+        failed_ids = [
+            row[0]
+            for row in db.query(Ticket.id)
+            .filter(
+                Ticket.ai_status == "failed",
+                attempts_total < settings.ai_sweeper_max_attempts,
+                (last_try.is_(None)) | (last_try < cooldown_cutoff),
+                ~_active_job_exists(),
+            )
+            .order_by(Ticket.id)
+            .limit(budget)
+            .all()
+        ]
+        for ticket_id in failed_ids:
+            # Повторяем тот же тип задачи, что упал последним (например, attachments)
+            last_kind = (
+                db.query(AiJob.kind)
+                .filter(AiJob.ticket_id == ticket_id)
+                .order_by(AiJob.id.desc())
+                .limit(1)
+                .scalar()
+            )
+            enqueue_ai_job(db, ticket_id, kind=last_kind or JOB_ANALYZE, priority=PRIORITY_LOW, commit=False)
+            db.query(Ticket).filter(Ticket.id == ticket_id).update({"ai_status": "pending"})
+        result["failed"] = len(failed_ids)
+
+    db.commit()
+    if result["pending"] or result["extracting"] or result["failed"]:
+        print(
+            f"[AI Sweeper] Возвращено в очередь: pending={result['pending']}, "
+            f"extracting={result['extracting']}, failed={result['failed']}",
+            flush=True,
+        )
+    return result
+
+
+class AiSweeper:
+    """Фоновый поток, запускающий sweep_stuck_ai с интервалом."""
+
+    def __init__(self, interval_sec: int):
+        self.interval = max(10, interval_sec)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="ai-sweeper")
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        from app.db import SessionLocal
+
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                sweep_stuck_ai(db)
+            except Exception as e:
+                print(f"[AI Sweeper] Ошибка: {e}", flush=True)
+                try:
+                    db.rollback()
+                except Exception:
+                    pass
+            finally:
+                db.close()
+            self._stop.wait(self.interval)
+
+
+_sweeper: Optional[AiSweeper] = None
+
+
+def start_ai_sweeper() -> AiSweeper:
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = AiSweeper(get_settings().ai_sweeper_interval_seconds)
+        _sweeper.start()
+    return _sweeper
+
+
+def stop_ai_sweeper() -> None:
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.stop()
+        _sweeper = None
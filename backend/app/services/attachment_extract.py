@@ -1,54 +1,103 @@
 """
 Извлечение текста из вложений (PDF, изображения) для передачи в AI.
-- PDF: pypdf text extraction, при пустом — OCR (pdf2image + pytesseract).
-- Изображения (jpg/png/webp): pytesseract OCR.
+- PDF: текстовый слой pypdf по страницам, страницы без него — постраничный OCR (pdf_ocr).
+- Изображения (jpg/png/webp): предобработка + pytesseract OCR (image_ocr).
+- Таблицы (xlsx/xls): потоковое чтение строк (spreadsheet_extract).
 - Видео: не анализируем, возвращаем заметку для AI.
 """
-from typing import Tuple
+from typing import List, Optional, Tuple
 
 # Максимум символов извлечённого текста для промпта (без обрезки с "...")
 EXTRACTED_TEXT_MAX_CHARS = 30_000
-# PDF OCR: максимум страниц (большие документы не обрабатываем полностью)
-PDF_OCR_MAX_PAGES = 10
 
 
-def extract_text_from_attachment(filename: str, mime_type: str, data: bytes) -> Tuple[bool, str]:
+# Версия экстрактора по типу вложения: увеличивается при изменении разбора этого типа —
+# закэшированный по содержимому файла текст (extraction_cache) с другой версией разбирается заново
+EXTRACTOR_VERSIONS = {
+    "pdf": 3,  # 2: число страниц и признак OCR; 3: OCR страниц без текстового слоя
+    "image": 3,  # 2: признак OCR; 3: предобработка и адаптивный OCR
+    "text": 1,
+    "docx": 1,
+    "spreadsheet": 1,
+    "doc": 1,
+    "video": 1,
+    "other": 1,
+}
+
+
+def attachment_kind(filename: str, mime_type: str) -> str:
+    """Тип вложения (ключ EXTRACTOR_VERSIONS), по которому выбирается экстрактор."""
+    mime = (mime_type or "").lower()
+    fn = (filename or "").lower()
+    if "pdf" in mime or fn.endswith(".pdf"):
+        return "pdf"
+    if any(x in mime for x in ("image/jpeg", "image/jpg", "image/png", "image/webp")):
+        return "image"
+    if "text/plain" in mime or "text/csv" in mime or fn.endswith((".txt", ".csv")):
+        return "text"
+    if fn.endswith(".docx") or "wordprocessingml" in mime:
+        return "docx"
+    if fn.endswith(".doc") or "msword" in mime:
+        return "doc"
+    if fn.endswith((".xlsx", ".xlsm", ".xls")) or "spreadsheetml" in mime or "ms-excel" in mime:
+        return "spreadsheet"
+    if "video/" in mime or fn.endswith((".mp4", ".webm", ".mov", ".avi")):
+        return "video"
+    return "other"
+
+
+def extractor_version(kind: str) -> str:
+    """Строка версии для кэша: "pdf:1"."""
+    return f"{kind}:{EXTRACTOR_VERSIONS.get(kind, 0)}"
+
+
+def extract_text_from_attachment(
+    filename: str, mime_type: str, data: bytes, info: Optional[dict] = None
+) -> Tuple[bool, str]:
     """
     Извлекает текст из вложения.
 
+    info — если передан, дополняется сведениями о разборе: page_count (страниц в документе),
+    ocr (True — текст распознавался OCR).
+
     Returns:
         (success, text_or_note)
         - success=True: text — извлечённый текст (может быть пустым если не удалось прочитать).
         - success=False: text — краткая заметка для AI (например "видео получено, оператор проверит").
     """
-    mime = (mime_type or "").lower()
-    fn = (filename or "").lower()
+    kind = attachment_kind(filename, mime_type)
+    if info is None:
+        info = {}
 
     # PDF
-    if "pdf" in mime or fn.endswith(".pdf"):
-        return _extract_pdf(data)
+    if kind == "pdf":
+        return _extract_pdf(data, info)
 
     # Изображения
-    if any(x in mime for x in ("image/jpeg", "image/jpg", "image/png", "image/webp")):
-        return _extract_image(data)
+    if kind == "image":
+        return _extract_image(data, info)
 
     # TXT / CSV
-    if "text/plain" in mime or "text/csv" in mime or fn.endswith((".txt", ".csv")):
+    if kind == "text":
         return _extract_text_file(data)
 
     # DOCX
-    if fn.endswith(".docx") or "wordprocessingml" in mime:
+    if kind == "docx":
         return _extract_docx(data)
 
+    # XLSX / XLS — потоковое чтение строк
+    if kind == "spreadsheet":
+        return _extract_spreadsheet(data)
+
     # DOC (eski format) - cikaramiyoruz ama bilgi veriyoruz
-    if fn.endswith(".doc") or "msword" in mime:
+    if kind == "doc":
         return False, "Получен файл в формате .doc. Для автоматического анализа рекомендуем формат .docx или PDF."
 
     # Видео — не анализируем
-    if "video/" in mime or fn.endswith((".mp4", ".webm", ".mov", ".avi")):
+    if kind == "video":
         return False, "Получено видео-вложение. Анализ видео не выполняется; оператор просмотрит вручную."
 
-    # Остальные типы (xls и т.д.) — не извлекаем
+    # Остальные типы — не извлекаем
     return False, "Вложение получено, но автоматическое извлечение текста для данного формата не поддерживается. Попросите клиента описать содержание текстом или прислать PDF/изображение."
 
 
@@ -67,6 +116,20 @@ def _extract_text_file(data: bytes) -> Tuple[bool, str]:
         return False, "Не удалось прочитать текстовый файл."
 
 
+def _extract_spreadsheet(data: bytes) -> Tuple[bool, str]:
+    """XLSX/XLS: строки листов + заводские номера из столбцов (spreadsheet_extract)."""
+    try:
+        from app.services.spreadsheet_extract import extract_spreadsheet
+        text = extract_spreadsheet(data, EXTRACTED_TEXT_MAX_CHARS)
+        if text.strip():
+            return True, _truncate_safe(text.strip())
+        return True, ""
+    except MemoryError:
+        raise
+    except Exception:
+        return False, "Не удалось прочитать таблицу. Пожалуйста, сохраните её в формате XLSX или CSV, либо опишите содержание текстом."
+
+
 def _extract_docx(data: bytes) -> Tuple[bool, str]:
     """DOCX: python-docx ile paragraf metinlerini cikarir."""
     try:
@@ -92,69 +155,60 @@ def _extract_docx(data: bytes) -> Tuple[bool, str]:
         return False, "Не удалось прочитать DOCX файл. Пожалуйста, опишите содержание текстом или отправьте в формате PDF."
 
 
-def _extract_pdf(data: bytes) -> Tuple[bool, str]:
-    """PDF: сначала текст, при пустом — OCR (макс PDF_OCR_MAX_PAGES страниц)."""
-    text = _pdf_text_extract(data)
-    if (text or "").strip():
-        return True, _truncate_safe(text.strip())
-    # OCR fallback
+def _extract_pdf(data: bytes, info: dict) -> Tuple[bool, str]:
+    """PDF: текстовый слой по страницам, страницы без него — постраничный OCR (pdf_ocr)."""
+    from app.services.pdf_ocr import extract_pdf_pages
+
+    page_texts = _pdf_page_texts(data)
+    if page_texts is None:
+        # pypdf не прочитал документ — pdfminer, затем OCR всех страниц
+        text = _pdfminer_text(data)
+        if text.strip():
+            return True, _truncate_safe(text.strip())
+    else:
+        info["page_count"] = len(page_texts)
     try:
-        ocr_text = _pdf_ocr(data)
-        if (ocr_text or "").strip():
-            return True, _truncate_safe(ocr_text.strip())
+        text = extract_pdf_pages(data, page_texts, EXTRACTED_TEXT_MAX_CHARS, info)
+        if text.strip():
+            return True, _truncate_safe(text.strip())
     except Exception:
         pass
     # OCR недоступен или не сработал — AI всё равно получит пояснение и сформирует ответ
     return True, "[PDF содержит только изображения; OCR не удался. Пожалуйста, опишите содержание текстом или отправьте в другом формате.]"
 
 
-def _pdf_text_extract(data: bytes) -> str:
-    """Извлечение текста из PDF через pypdf (или pdfminer.six)."""
+def _pdf_page_texts(data: bytes) -> Optional[List[str]]:
+    """Текстовый слой каждой страницы (pypdf); None — документ не читается."""
     try:
         from pypdf import PdfReader
         from io import BytesIO
         reader = PdfReader(BytesIO(data))
-        parts = []
+        texts = []
         for page in reader.pages:
-            t = page.extract_text()
-            if t:
-                parts.append(t)
-        return "\n\n".join(parts) if parts else ""
+            try:
+                texts.append(page.extract_text() or "")
+            except Exception:
+                texts.append("")
+        return texts
     except Exception:
-        try:
-            from pdfminer.high_level import extract_text
-            from io import BytesIO
-            return extract_text(BytesIO(data)) or ""
-        except Exception:
-            return ""
+        return None
 
 
-def _pdf_ocr(data: bytes) -> str:
-    """OCR по страницам PDF (pdf2image + pytesseract). Максимум PDF_OCR_MAX_PAGES страниц."""
+def _pdfminer_text(data: bytes) -> str:
     try:
-        from pdf2image import convert_from_bytes
-        import pytesseract
-        images = convert_from_bytes(data, dpi=150)
-        parts = []
-        for i, img in enumerate(images):
-            if i >= PDF_OCR_MAX_PAGES:
-                break
-            text = pytesseract.image_to_string(img, lang="rus+eng")
-            if text and text.strip():
-                parts.append(text.strip())
-        return "\n\n".join(parts) if parts else ""
+        from pdfminer.high_level import extract_text
+        from io import BytesIO
+        return extract_text(BytesIO(data)) or ""
     except Exception:
         return ""
 
 
-def _extract_image(data: bytes) -> Tuple[bool, str]:
-    """Изображение: pytesseract OCR."""
+def _extract_image(data: bytes, info: dict) -> Tuple[bool, str]:
+    """Изображение: предобработка (поворот, масштаб, наклон, блоки текста) + OCR — см. image_ocr."""
+    info["ocr"] = True
     try:
-        import pytesseract
-        from PIL import Image
-        from io import BytesIO
-        img = Image.open(BytesIO(data))
-        text = pytesseract.image_to_string(img, lang="rus+eng")
+        from app.services.image_ocr import ocr_image
+        text = ocr_image(data, info)
         if (text or "").strip():
             return True, _truncate_safe(text.strip())
         return True, ""
@@ -1,32 +1,196 @@
 """
-Локальное сохранение вложений тикетов.
-Путь: uploads/tickets/{ticket_id}/{uuid}-{filename}
+Хранилище вложений тикетов — по содержимому (content-addressed).
+Ключ: blobs/{sha256[:2]}/{sha256}{.ext}; где лежат файлы — STORAGE_BACKEND (storage_backends):
+local — backend/uploads, s3 — S3-совместимый бакет (общий для нескольких реплик backend).
+
+Файл копируется блоками во временный файл (uploads/tmp), по дороге считаются SHA-256 и размер
+(лимит проверяется сразу, без чтения файла в память), затем переносится в хранилище по хэшу.
+Одинаковые файлы (инструкция, которую прикладывают к каждому письму) хранятся один раз: если
+такой blob уже есть, временный файл удаляется. Строки ticket_attachments ссылаются на blob
+через storage_path; вложения, сохранённые раньше (uploads/tickets/{ticket_id}/{uuid}-{filename}),
+остаются на своих путях.
 """
-import uuid
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from functools import lru_cache
+from typing import BinaryIO, Optional
+
+from app.config import get_settings
+from app.services.storage_backends import AttachmentStorage, LocalStorage, S3Storage
 
 # Корень backend
 _BACKEND_DIR = Path(__file__).resolve().parent.parent.parent
 UPLOADS_DIR = _BACKEND_DIR / "uploads"
-ATTACHMENTS_SUBDIR = "tickets"
+ATTACHMENTS_SUBDIR = "tickets"  # старые вложения: tickets/{ticket_id}/{uuid}-{filename}
+BLOBS_SUBDIR = "blobs"
+TMP_SUBDIR = "tmp"  # на том же диске, что blobs/ локального хранилища — перенос без копирования
+
+COPY_CHUNK_BYTES = 1024 * 1024
+# Расширение сохраняется в имени blob: по нему определяется Content-Type при отдаче
+_EXT_RE = re.compile(r"\.[a-z0-9]{1,8}$")
+
+
+class AttachmentTooLarge(ValueError):
+    """Файл больше допустимого размера (запись прервана, временный файл удалён)."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"файл больше {max_bytes} байт")
+        self.max_bytes = max_bytes
+
+
+@dataclass
+class StoredAttachment:
+    storage_path: str  # ключ в хранилище (для local — путь относительно uploads/)
+    sha256: str
+    size: int
+    deduplicated: bool = False  # такой файл уже был в хранилище
 
 
 def get_uploads_base() -> Path:
     return UPLOADS_DIR
 
 
-def save_attachment(ticket_id: int, filename: str, data: bytes) -> str:
+@lru_cache
+def get_storage() -> AttachmentStorage:
+    """Хранилище по STORAGE_BACKEND (local | s3); один экземпляр на процесс."""
+    settings = get_settings()
+    backend = (settings.storage_backend or "local").strip().lower()
+    if backend == "s3":
+        return S3Storage(
+            bucket=settings.s3_bucket,
+            prefix=settings.s3_prefix,
+            endpoint_url=settings.s3_endpoint_url,
+            public_endpoint_url=settings.s3_public_endpoint_url,
+            region=settings.s3_region,
+            access_key=settings.s3_access_key,
+            secret_key=settings.s3_secret_key,
+            presign_expire_seconds=settings.s3_presign_expire_seconds,
+        )
+    if backend != "local":
+        print(f"[Storage] Неизвестный STORAGE_BACKEND={backend!r}, используется local", flush=True)
+    return LocalStorage(UPLOADS_DIR)
+
+
+def attachment_download_url(storage_path: str, filename: Optional[str] = None, mime_type: Optional[str] = None) -> Optional[str]:
+    """Прямая ссылка на файл в хранилище (presigned S3); None — файл отдаёт backend."""
+    return get_storage().presigned_url(storage_path, filename, mime_type)
+
+
+def _blob_ext(filename: Optional[str]) -> str:
+    match = _EXT_RE.search((filename or "").lower())
+    return match.group(0) if match else ""
+
+
+def _blob_storage_path(sha256: str, filename: Optional[str]) -> str:
+    return f"{BLOBS_SUBDIR}/{sha256[:2]}/{sha256}{_blob_ext(filename)}"
+
+
+def _tmp_dir() -> Path:
+    path = UPLOADS_DIR / TMP_SUBDIR
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _commit_blob(tmp_path: str, sha256: str, size: int, filename: Optional[str]) -> StoredAttachment:
+    """Временный файл -> хранилище по хэшу; такой blob уже есть — временный файл удаляется."""
+    storage_path = _blob_storage_path(sha256, filename)
+    storage = get_storage()
+    if storage.exists(storage_path):
+        os.unlink(tmp_path)
+        return StoredAttachment(storage_path, sha256, size, deduplicated=True)
+    storage.put_file(tmp_path, storage_path, mimetypes.guess_type(storage_path)[0])
+    return StoredAttachment(storage_path, sha256, size)
+
+
+def store_attachment_stream(src: BinaryIO, filename: Optional[str], max_bytes: Optional[int] = None) -> StoredAttachment:
+    """
+    Копирует поток блоками во временный файл (SHA-256 и размер — по дороге) и кладёт в хранилище.
+    Raises: AttachmentTooLarge — поток длиннее max_bytes (прочитано не больше max_bytes + блок).
     """
-    Сохраняет файл в uploads/tickets/{ticket_id}/{uuid}-{filename}.
-    Возвращает относительный storage_path (без ведущего uploads/ для URL: /uploads/...).
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(prefix="upload-", dir=_tmp_dir())
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise AttachmentTooLarge(max_bytes)
+                h.update(chunk)
+                out.write(chunk)
+        return _commit_blob(tmp_path, h.hexdigest(), size, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def store_attachment_bytes(data: bytes, filename: Optional[str]) -> StoredAttachment:
+    """Небольшое вложение письма (в памяти) -> хранилище."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    fd, tmp_path = tempfile.mkstemp(prefix="upload-", dir=_tmp_dir())
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        return _commit_blob(tmp_path, sha256, len(data), filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def store_attachment_file(src_path: str, filename: Optional[str]) -> StoredAttachment:
     """
-    base = UPLOADS_DIR / ATTACHMENTS_SUBDIR / str(ticket_id)
-    base.mkdir(parents=True, exist_ok=True)
-    safe_name = (filename or "attachment").replace("..", "").strip() or "attachment"
-    unique = uuid.uuid4().hex[:12]
-    final_name = f"{unique}-{safe_name}"
-    path = base / final_name
-    path.write_bytes(data)
-    # Относительный путь от uploads/ для хранения в БД и формирования URL
-    return f"{ATTACHMENTS_SUBDIR}/{ticket_id}/{final_name}"
+    Крупное вложение письма из временного файла: хэшируется блоками и переносится в хранилище
+    без загрузки в память. Исходный файл забирается.
+    """
+    h = hashlib.sha256()
+    size = 0
+    with open(src_path, "rb") as src:
+        for chunk in iter(lambda: src.read(COPY_CHUNK_BYTES), b""):
+            size += len(chunk)
+            h.update(chunk)
+    sha256 = h.hexdigest()
+    storage_path = _blob_storage_path(sha256, filename)
+    if get_storage().exists(storage_path):
+        os.unlink(src_path)  # такой файл уже есть — не переносим
+        return StoredAttachment(storage_path, sha256, size, deduplicated=True)
+    fd, tmp_path = tempfile.mkstemp(prefix="upload-", dir=_tmp_dir())
+    os.close(fd)
+    try:
+        shutil.move(src_path, tmp_path)
+        return _commit_blob(tmp_path, sha256, size, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def store_derived_bytes(storage_path: str, data: bytes, content_type: Optional[str] = None) -> None:
+    """Производный файл (превью) под заданным ключом рядом с оригиналом; существующий перезаписывается."""
+    fd, tmp_path = tempfile.mkstemp(prefix="derived-", dir=_tmp_dir())
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        get_storage().put_file(tmp_path, storage_path, content_type)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
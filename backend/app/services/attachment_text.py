@@ -0,0 +1,81 @@
+"""
+Текст вложений тикета для AI — по строкам ticket_attachments.
+
+Результат извлечения хранится в каждом вложении (extract_status, extracted_text, page_count,
+ocr_used, extract_ms), tickets.attachments_text собирается из этих строк. Новое вложение
+(загрузка через веб-форму, продолжение переписки) разбирается одно: у уже разобранных результат
+есть. Прерванный разбор (таймаут, память) помечается failed и повторяется при следующем анализе.
+"""
+import threading
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from app.models import TicketAttachment
+from app.services.attachment_storage import get_storage
+from app.services.extraction_service import ExtractionJob, ExtractionResult, extract_attachments
+
+# extract_status вложения (None — ещё не разбиралось)
+EXTRACT_DONE = "done"
+EXTRACT_UNSUPPORTED = "unsupported"  # формат не разбирается, в extracted_text — заметка для AI
+EXTRACT_FAILED = "failed"  # разбор прерван, в extracted_text — заметка; повторяется
+
+
+def needs_extraction(att: TicketAttachment) -> bool:
+    return att.extract_status is None or att.extract_status == EXTRACT_FAILED
+
+
+def apply_extraction_result(att: TicketAttachment, job: ExtractionJob, result: ExtractionResult) -> None:
+    """Результат разбора -> колонки вложения (без commit)."""
+    if result.success:
+        att.extract_status = EXTRACT_DONE
+    else:
+        att.extract_status = EXTRACT_UNSUPPORTED if result.cacheable else EXTRACT_FAILED
+    att.extracted_text = (result.text or "").strip() or None
+    att.page_count = result.page_count
+    att.ocr_used = result.ocr_used
+    att.extract_ms = result.duration_ms
+    att.extracted_at = datetime.now(timezone.utc)
+    att.sha256 = att.sha256 or job.sha256
+
+
+def extract_pending_attachments(atts: List[TicketAttachment], stop: Optional[threading.Event] = None) -> Optional[int]:
+    """
+    Разбирает вложения без результата (новые и прерванные) — параллельно, через кэш и пул процессов;
+    результаты пишутся в строки (без commit). Returns: сколько разобрано; None — остановка (stop),
+    успевшие результаты при этом тоже записаны.
+    """
+    storage = get_storage()
+    jobs, todo = [], []
+    # Файлы нужны на диске на время разбора (S3 — временные копии, удаляются после)
+    with ExitStack() as files:
+        for att in atts:
+            if not needs_extraction(att):
+                continue
+            path = files.enter_context(storage.local_copy(att.storage_path))
+            if path is None:
+                print(f"[Attachments] Тикет #{att.ticket_id}: файл вложения не найден: {att.filename}", flush=True)
+                continue
+            jobs.append(ExtractionJob(path, att.filename, att.mime_type, att.sha256))
+            todo.append(att)
+        results = extract_attachments(jobs, stop)
+    for att, job, result in zip(todo, jobs, results):
+        if result is not None:
+            apply_extraction_result(att, job, result)
+    if any(r is None for r in results):
+        return None
+    return len(todo)
+
+
+def assemble_attachments_text(atts: List[TicketAttachment]) -> Optional[str]:
+    """Текст вложений для промпта: "[имя]:\\nтекст" / "[имя]: заметка" в порядке загрузки."""
+    parts = []
+    for att in sorted(atts, key=lambda a: a.id):
+        text = (att.extracted_text or "").strip()
+        if not text:
+            continue
+        if att.extract_status == EXTRACT_DONE:
+            parts.append(f"[{att.filename}]:\n{text}")
+        else:
+            parts.append(f"[{att.filename}]: {text}")
+    return "\n\n---\n\n".join(parts) if parts else None
@@ -5,82 +5,60 @@ Email integration: interfaces and implementations.
 """
 import imaplib
 import email
+import binascii
+import os
 import ssl
+import tempfile
+import uuid
+from email.parser import BytesFeedParser, BytesHeaderParser
 from email.header import decode_header
 from email.message import Message as EmailMessage
 from email.utils import parseaddr, parsedate_to_datetime
 from abc import ABC, abstractmethod
-from typing import List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime
 import re
 
+from app.config import get_settings
 
-# Фильтры для пропуска системных/спам писем
-BLOCKED_SENDERS = [
-    "noreply@",
-    "no-reply@",
-    "mailer-daemon@",
-    "postmaster@",
-    "donotreply@",
-    "notifications@",
-    "alert@",
-    "alerts@",
-    "security@google",
-    "accounts.google.com",
-    "googlemail.com",
-    "facebookmail.com",
-    "twitter.com",
-    "linkedin.com",
-    "newsletter@",
-    "marketing@",
-    "promo@",
-    "spam@",
-    "bounce@",
-    "daemon@",
-]
-
-BLOCKED_SUBJECTS = [
-    "security alert",
-    "password reset",
-    "verify your email",
-    "confirm your email",
-    "sign-in attempt",
-    "suspicious activity",
-    "unsubscribe",
-    "newsletter",
-    "подтверждение почты",
-    "подтвердите email",
-    "сброс пароля",
-    "оповещение безопасности",
-    "подозрительная активность",
-]
-
-
-def is_email_filtered(sender_email: str, subject: str) -> bool:
-    """Проверяет, нужно ли пропустить это письмо (системное/спам)."""
-    sender_lower = (sender_email or "").lower()
-    subject_lower = (subject or "").lower()
-
-    # Проверка отправителя
-    for blocked in BLOCKED_SENDERS:
-        if blocked in sender_lower:
-            return True
-
-    # Проверка темы
-    for blocked in BLOCKED_SUBJECTS:
-        if blocked in subject_lower:
-            return True
-
-    return False
+
+# Правила фильтра — в email_filters (файл EMAIL_FILTERS_FILE, горячая перезагрузка)
+from app.services.email_filters import get_filter_engine
+
+
+def is_email_filtered(sender_email: str, subject: str, headers=None) -> bool:
+    """Проверяет, нужно ли пропустить это письмо (системное/спам). headers — заголовки письма (.get)."""
+    return get_filter_engine().check(sender_email, subject, headers) is not None
 
 
 @dataclass
 class EmailAttachment:
-    """Один вложенный файл из письма."""
+    """Один вложенный файл из письма (крупный — во временном файле path, data пустое)."""
     filename: str
     mime_type: str
-    data: bytes
+    data: bytes = b""
+    path: Optional[str] = None
+    size: int = 0
+
+    def __post_init__(self):
+        if not self.size:
+            self.size = len(self.data)
+
+    def read_bytes(self) -> bytes:
+        if self.path is None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def cleanup(self) -> None:
+        """Удаляет временный файл (если его не забрал store_attachment_file)."""
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
 
 
 @dataclass
@@ -94,6 +72,331 @@ class RawEmailMessage:
     received_at: Optional[datetime]
     uid: Optional[str] = None  # UID для пометки как прочитанное
     attachments: List["EmailAttachment"] = field(default_factory=list)  # Вложения (PDF, изображения и т.д.)
+    in_reply_to: Optional[str] = None  # Message-ID письма, на которое отвечают
+    references: List[str] = field(default_factory=list)  # цепочка References (от старых к новым)
+
+    def cleanup(self) -> None:
+        for att in self.attachments:
+            att.cleanup()
+
+
+_MESSAGE_ID_RE = re.compile(r"<[^<>\s]+>")
+
+
+def parse_message_ids(value: Optional[str]) -> List[str]:
+    """Значение In-Reply-To / References -> ["<id@host>", ...] в порядке следования."""
+    return _MESSAGE_ID_RE.findall(str(value or ""))
+
+
+def _uid_set(uids: List[int]) -> str:
+    """[1,2,3,7,9,10] -> "1:3,7,9:10" (компактный sequence set для UID FETCH)."""
+    parts = []
+    start = prev = None
+    for uid in sorted(uids):
+        if start is None:
+            start = prev = uid
+        elif uid == prev + 1:
+            prev = uid
+        else:
+            parts.append(f"{start}:{prev}" if prev != start else str(start))
+            start = prev = uid
+    if start is not None:
+        parts.append(f"{start}:{prev}" if prev != start else str(start))
+    return ",".join(parts)
+
+
+def _fetch_items(data: list) -> Iterator[Tuple[bytes, bytes]]:
+    """
+    Ответ imaplib на FETCH -> (метаданные, literal). Атрибуты после literal
+    (часть серверов шлёт UID/RFC822.SIZE после тела) приходят отдельной строкой — склеиваем.
+    Список расходуется: ссылка на literal убирается из data, чтобы разобранное письмо
+    освобождалось сразу, а не вместе со всем пакетом.
+    """
+    i = 0
+    while i < len(data):
+        item, data[i] = data[i], None
+        if isinstance(item, tuple):
+            meta, literal = item
+            item = None
+            if i + 1 < len(data) and isinstance(data[i + 1], bytes):
+                meta += b" " + data[i + 1]
+                i += 1
+            yield meta, literal
+            literal = None
+        i += 1
+
+
+# Порция для разбора письма и для записи крупного вложения на диск
+PARSE_CHUNK_BYTES = 64 * 1024
+_B64_JUNK_RE = re.compile(rb"[^A-Za-z0-9+/=]+")
+# Заголовок-метка части, тело которой уже на диске (значение — ключ в spooled_parts письма)
+SPOOLED_HEADER = "X-Eris-Spooled"
+# Строка-граница MIME не длиннее 70 символов + "--"/"--" и пробелы: более длинный хвост без
+# перевода строки — заведомо не граница и сразу уходит в тело части
+_MAX_BOUNDARY_LINE = 1024
+
+
+class _PartSpool:
+    """Тело части -> временный файл, декодируется по мере поступления строк (base64 / quoted-printable)."""
+
+    def __init__(self, cte: str):
+        self.cte = cte
+        fd, self.path = tempfile.mkstemp(prefix="eris-att-")
+        self._out = os.fdopen(fd, "wb")
+        self.size = 0
+        self._tail = b""  # base64: неполная четвёрка; quoted-printable: оборванная "=X"
+        self._eol = b""  # перевод строки предыдущей строки: последний принадлежит границе, не телу
+
+    def write(self, data: bytes, eol: bytes) -> None:
+        """data — строка тела без перевода строки (или её фрагмент, тогда eol пустой)."""
+        if self.cte == "base64":
+            chunk = self._tail + _B64_JUNK_RE.sub(b"", data)
+            cut = len(chunk) // 4 * 4
+            self._tail = chunk[cut:]
+            if cut:
+                self._emit(binascii.a2b_base64(chunk[:cut]))
+            return
+        self._emit(self._eol)
+        self._eol = eol
+        if self.cte == "quoted-printable":
+            data = self._tail + data
+            self._tail = b""
+            if eol and data.endswith(b"="):
+                # мягкий перенос: строка продолжается без перевода
+                data, self._eol = data[:-1], b""
+            elif not eol and b"=" in data[-2:]:
+                cut = data.rindex(b"=", len(data) - 2)
+                data, self._tail = data[:cut], data[cut:]
+            data = binascii.a2b_qp(data)
+        self._emit(data)
+
+    def _emit(self, data: bytes) -> None:
+        if data:
+            self._out.write(data)
+            self.size += len(data)
+
+    def close(self) -> Tuple[str, int]:
+        try:
+            tail = self._tail.rstrip(b"=")
+            if self.cte == "base64" and tail:
+                self._emit(binascii.a2b_base64(tail + b"=" * (-len(tail) % 4)))
+            elif self.cte == "quoted-printable" and self._tail:
+                self._emit(self._tail)
+        finally:
+            self._out.close()
+        return self.path, self.size
+
+    def abort(self) -> None:
+        self._out.close()
+        _unlink_quiet(self.path)
+
+
+def _for_each_line(data: bytes, handle: Callable[[bytes], None]) -> int:
+    """Строки data (с \n на конце) по одной в handle; возвращает начало недописанного хвоста."""
+    start = 0
+    while True:
+        end = data.find(b"\n", start)
+        if end < 0:
+            return start
+        handle(data[start:end + 1])
+        start = end + 1
+
+
+def _split_eol(line: bytes) -> Tuple[bytes, bytes]:
+    content = line.rstrip(b"\r\n")
+    return content, line[len(content):]
+
+
+def _unlink_quiet(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class _SpoolingParser:
+    """
+    BytesFeedParser, который не держит в памяти крупные вложения.
+
+    Поток письма режется на строки, границы multipart отслеживаются по заголовкам частей.
+    Тело листовой части (не text/* или с Content-Disposition: attachment) внутри multipart,
+    выросшее больше threshold, пишется во временный файл уже декодированным, а парсеру
+    достаются только заголовки части + SPOOLED_HEADER и пустое тело. Файлы — в spooled_parts
+    у разобранного письма (ключ -> (path, size)); подделать ключ заголовком в письме нельзя.
+    """
+
+    def __init__(self, threshold: int):
+        self.threshold = max(threshold, 1)
+        self._parser = BytesFeedParser()
+        self._tail = b""
+        self._mid_line = False  # предыдущий фрагмент без перевода строки: продолжение — не граница
+        self._boundaries: List[bytes] = []
+        self._state = "headers"  # headers | leaf (тело листовой части) | pass (тело multipart)
+        self._headers: List[bytes] = []
+        self._body = bytearray()
+        self._body_size = 0
+        self._spoolable = False
+        self._cte = ""
+        self._spool: Optional[_PartSpool] = None
+        self.spooled: Dict[str, Tuple[str, int]] = {}
+
+    def feed(self, data: bytes) -> None:
+        data = self._tail + data
+        end = _for_each_line(data, self._line)
+        # Последняя строка без \n (в т.ч. оборванный \r\n) ждёт продолжения
+        self._tail = data[end:]
+        if len(self._tail) > _MAX_BOUNDARY_LINE and self._state != "headers":
+            self._line(self._tail, fragment=True)
+            self._tail = b""
+
+    def close(self) -> EmailMessage:
+        if self._tail:
+            self._line(self._tail)
+            self._tail = b""
+        if self._state == "leaf":
+            self._end_leaf()
+        elif self._headers:
+            self._parser.feed(b"".join(self._headers))
+            self._headers = []
+        msg = self._parser.close()
+        msg.spooled_parts = self.spooled
+        return msg
+
+    def abort(self) -> None:
+        """Ошибка разбора: временные файлы больше никому не нужны."""
+        if self._spool is not None:
+            self._spool.abort()
+            self._spool = None
+        for path, _ in self.spooled.values():
+            _unlink_quiet(path)
+        self.spooled.clear()
+
+    def _line(self, line: bytes, fragment: bool = False) -> None:
+        content, eol = (line, b"") if fragment else _split_eol(line)
+        continuation, self._mid_line = self._mid_line, fragment
+        if not continuation and self._boundaries and content.startswith(b"--"):
+            found = self._match_boundary(content)
+            if found is not None:
+                self._boundary(line, *found)
+                return
+        if self._state == "headers":
+            self._headers.append(line)
+            if not content:
+                self._end_headers()
+        elif self._state == "leaf":
+            self._leaf_line(content, eol)
+        else:
+            self._parser.feed(line)
+
+    def _match_boundary(self, content: bytes) -> Optional[Tuple[int, bool]]:
+        """Строка-граница одного из открытых multipart -> (уровень, закрывающая ли)."""
+        content = content.rstrip(b" \t")
+        for level in range(len(self._boundaries) - 1, -1, -1):
+            marker = b"--" + self._boundaries[level]
+            if content == marker:
+                return level, False
+            if content == marker + b"--":
+                return level, True
+        return None
+
+    def _boundary(self, line: bytes, level: int, closing: bool) -> None:
+        if self._state == "leaf":
+            self._end_leaf()
+        elif self._state == "headers" and self._headers:
+            self._parser.feed(b"".join(self._headers))
+            self._headers = []
+        # Граница внешнего multipart закрывает и все вложенные
+        del self._boundaries[level + 1:]
+        self._parser.feed(line)
+        if closing:
+            self._boundaries.pop()
+            self._state = "pass"
+        else:
+            self._state = "headers"
+
+    def _end_headers(self) -> None:
+        part = BytesHeaderParser().parsebytes(b"".join(self._headers))
+        ctype = part.get_content_type()
+        boundary = part.get_boundary() if ctype.startswith("multipart/") else None
+        if boundary or ctype == "message/rfc822":
+            self._parser.feed(b"".join(self._headers))
+            self._headers = []
+            if boundary:
+                self._boundaries.append(boundary.encode("utf-8", "surrogateescape"))
+                self._state = "pass"
+            # message/rfc822: дальше заголовки вложенного письма
+            return
+        disposition = str(part.get("Content-Disposition", "")).lower()
+        self._spoolable = bool(self._boundaries) and (
+            part.get_content_maintype() != "text" or "attachment" in disposition
+        )
+        self._cte = str(part.get("Content-Transfer-Encoding", "")).strip().lower()
+        self._body = bytearray()
+        self._state = "leaf"
+
+    def _leaf_line(self, content: bytes, eol: bytes) -> None:
+        if self._spool is not None:
+            self._spool.write(content, eol)
+            return
+        self._body += content
+        self._body += eol
+        if self._spoolable and len(self._body) > self.threshold:
+            self._spool = _PartSpool(self._cte)
+            body, self._body = bytes(self._body), bytearray()
+            # Буфер — целые строки (последняя может быть фрагментом без перевода строки)
+            end = _for_each_line(body, lambda line: self._spool.write(*_split_eol(line)))
+            if end < len(body):
+                self._spool.write(body[end:], b"")
+
+    def _end_leaf(self) -> None:
+        headers, self._headers = self._headers, []
+        if self._spool is not None:
+            path, size = self._spool.close()
+            self._spool = None
+            key = uuid.uuid4().hex
+            self.spooled[key] = (path, size)
+            # Метка — перед пустой строкой, завершающей заголовки части
+            blank = headers.pop()
+            headers += [f"{SPOOLED_HEADER}: {key}".encode("ascii") + (blank or b"\r\n"), blank]
+            self._parser.feed(b"".join(headers))
+        else:
+            self._parser.feed(b"".join(headers))
+            self._parser.feed(bytes(self._body))
+        self._body = bytearray()
+        self._state = "pass"
+
+
+def _parse_bytes(raw: bytes, threshold: int) -> EmailMessage:
+    """Разбор письма потоковым парсером (порциями), крупные вложения — сразу на диск."""
+    parser = _SpoolingParser(threshold)
+    view = memoryview(raw)
+    try:
+        for i in range(0, len(view), PARSE_CHUNK_BYTES):
+            parser.feed(view[i:i + PARSE_CHUNK_BYTES].tobytes())
+        return parser.close()
+    except Exception:
+        parser.abort()
+        raise
+    finally:
+        view.release()
+
+
+def _release_spooled(msg: EmailMessage) -> None:
+    """Удаляет файлы частей, не ставших вложениями (письмо отфильтровано, часть пропущена)."""
+    spooled = getattr(msg, "spooled_parts", None) or {}
+    for path, _ in spooled.values():
+        _unlink_quiet(path)
+    spooled.clear()
+
+
+@dataclass
+class ImapCheckpoint:
+    """Позиция UID-синхронизации папки (хранится в imap_sync_state)."""
+    uidvalidity: Optional[int] = None
+    last_uid: int = 0
+    # UID не дошедших до обработчика писем (ошибка разбора, нет в ответе FETCH): позиция
+    # откатывается перед ними (process_new_emails), письмо забирается снова
+    failed_uids: List[int] = field(default_factory=list)
 
 
 class EmailFetcher(ABC):
@@ -141,103 +444,375 @@ class ImapEmailFetcher(EmailFetcher):
         self.user = user
         self.password = password
         self.folder = folder
+        self.uidvalidity: Optional[int] = None  # из ответа на SELECT (connect)
+        self.spool_threshold = get_settings().email_spool_threshold_bytes
+        self.filtered_count = 0  # отфильтровано за последний iter_new_messages
 
-    def fetch_new_messages(self) -> List[RawEmailMessage]:
+    def connect(self, timeout: Optional[float] = None) -> imaplib.IMAP4_SSL:
+        """Открывает SSL-соединение, логинится и выбирает папку."""
+        # Создаём SSL контекст
+        context = ssl.create_default_context()
+
+        # Пробуем подключиться
+        try:
+            mail = imaplib.IMAP4_SSL(self.host, self.port, ssl_context=context, timeout=timeout)
+        except (ssl.SSLError, OSError):
+            # Пробуем без строгой проверки SSL
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            mail = imaplib.IMAP4_SSL(self.host, self.port, ssl_context=context, timeout=timeout)
+
+        mail.login(self.user, self.password)
+        mail.select(self.folder)
+        # UIDVALIDITY приходит в ответе на SELECT
+        _, data = mail.response("UIDVALIDITY")
+        self.uidvalidity = int(data[0]) if data and data[0] else None
+        return mail
+
+    def fetch_new_messages(
+        self,
+        mail: Optional[imaplib.IMAP4] = None,
+        checkpoint: Optional["ImapCheckpoint"] = None,
+        is_known: Optional[Callable[[List[str]], Set[str]]] = None,
+    ) -> List[RawEmailMessage]:
+        """Все новые письма списком (см. iter_new_messages). Временные файлы вложений удаляет вызывающий (cleanup)."""
+        return list(self.iter_new_messages(mail, checkpoint, is_known))
+
+    def iter_new_messages(
+        self,
+        mail: Optional[imaplib.IMAP4] = None,
+        checkpoint: Optional["ImapCheckpoint"] = None,
+        is_known: Optional[Callable[[List[str]], Set[str]]] = None,
+    ) -> Iterator[RawEmailMessage]:
         """
-        Получает все непрочитанные письма из папки.
+        Получает новые письма из папки — по одному, сразу после разбора.
         Автоматически фильтрует системные/спам письма.
 
-        Returns:
-            Список RawEmailMessage (только реальные письма от клиентов)
+        Args:
+            mail: уже открытое соединение с выбранной папкой (долгоживущая IMAP-сессия);
+                  None — подключиться, забрать письма и отключиться.
+            checkpoint: позиция UID-синхронизации — забираются только UID > last_uid
+                  (BODY.PEEK, флаги \\Seen не трогаются) и checkpoint сдвигается.
+                  None — по-старому: SEARCH UNSEEN + пометка прочитанным.
+            is_known: Message-ID -> уже есть тикет; такие письма не скачиваются целиком.
+
+        Yields:
+            RawEmailMessage (только реальные письма от клиентов). Крупные вложения —
+            во временных файлах: после обработки письма вызвать msg.cleanup().
         """
-        messages = []
-        filtered_count = 0
-        mail = None
+        own_connection = mail is None
+        self.filtered_count = 0
+        count = 0
 
         try:
-            # Создаём SSL контекст
-            context = ssl.create_default_context()
-
-            # Пробуем подключиться
-            try:
-                mail = imaplib.IMAP4_SSL(self.host, self.port, ssl_context=context)
-            except (ssl.SSLError, OSError):
-                # Пробуем без строгой проверки SSL
-                context = ssl.create_default_context()
-                context.check_hostname = False
-                context.verify_mode = ssl.CERT_NONE
-                mail = imaplib.IMAP4_SSL(self.host, self.port, ssl_context=context)
-
-            mail.login(self.user, self.password)
-            mail.select(self.folder)
-
-            # Ищем непрочитанные письма
-            status, msg_ids = mail.search(None, "UNSEEN")
-
-            if status != "OK" or not msg_ids[0]:
-                mail.logout()
-                return []
-
-            # Получаем каждое письмо
-            for num in msg_ids[0].split():
+            if own_connection:
+                mail = self.connect()
+            if checkpoint is None:
+                messages = self._fetch_unseen(mail)
+            else:
+                messages = self._fetch_since(mail, checkpoint, is_known)
+            for msg in messages:
+                count += 1
+                yield msg
+        except Exception as e:
+            print(f"[IMAP] Ошибка подключения: {e}")
+            raise
+        finally:
+            if own_connection and mail is not None:
                 try:
-                    status, data = mail.fetch(num, "(RFC822)")
-                    if status != "OK":
-                        continue
-
-                    raw_email = data[0][1]
-                    msg = email.message_from_bytes(raw_email)
-
-                    # Парсим заголовки
-                    subject = self._decode_header(msg["Subject"])
-                    sender_name, sender_email = self._parse_sender(msg["From"])
-                    message_id = msg["Message-ID"] or f"msg-{num.decode()}"
-
-                    # ФИЛЬТРАЦИЯ: пропускаем системные/спам письма (логируем без PII)
-                    if is_email_filtered(sender_email, subject):
-                        print("[IMAP] Пропущено (фильтр): отправитель/тема в блок-листе")
-                        mail.store(num, "+FLAGS", "\\Seen")
-                        filtered_count += 1
-                        continue
-
-                    # Парсим дату
-                    received_at = None
-                    if msg["Date"]:
-                        try:
-                            received_at = parsedate_to_datetime(msg["Date"])
-                        except:
-                            pass
-
-                    # Парсим тело письма и вложения
-                    body = self._get_body(msg)
-                    attachments = self._get_attachments(msg)
-
-                    messages.append(RawEmailMessage(
-                        message_id=message_id,
-                        subject=subject,
-                        body=body,
-                        sender_email=sender_email,
-                        sender_name=sender_name,
-                        received_at=received_at,
-                        uid=num.decode(),
-                        attachments=attachments,
-                    ))
-
-                    # Помечаем как прочитанное
-                    mail.store(num, "+FLAGS", "\\Seen")
+                    mail.logout()
+                except Exception:
+                    pass
+
+        if count or self.filtered_count:
+            print(f"[IMAP] Получено {count} новых писем (отфильтровано: {self.filtered_count})")
+
+    def _fetch_unseen(self, mail: imaplib.IMAP4) -> Iterator[RawEmailMessage]:
+        """SEARCH UNSEEN по номерам сообщений; обработанные помечаются \\Seen."""
+        # Ищем непрочитанные письма
+        status, msg_ids = mail.search(None, "UNSEEN")
+        if status != "OK" or not msg_ids[0]:
+            return
+
+        # Получаем каждое письмо
+        for num in msg_ids[0].split():
+            try:
+                status, data = mail.fetch(num, "(RFC822)")
+                if status != "OK":
+                    continue
 
-                except Exception as e:
-                    print(f"[IMAP] Ошибка обработки письма {num}: {e}")
+                msg = _parse_bytes(data[0][1], self.spool_threshold)
+                data = None
+                parsed = self._parse_message(msg, num.decode())
+                msg = None
+                if parsed is None:
+                    mail.store(num, "+FLAGS", "\\Seen")
+                    self.filtered_count += 1
                     continue
 
-            mail.logout()
+                # Помечаем как прочитанное
+                mail.store(num, "+FLAGS", "\\Seen")
 
-        except Exception as e:
-            print(f"[IMAP] Ошибка подключения: {e}")
-            raise
+            except Exception as e:
+                print(f"[IMAP] Ошибка обработки письма {num}: {e}")
+                continue
+            yield parsed
+
+    def _fetch_since(
+        self,
+        mail: imaplib.IMAP4,
+        checkpoint: "ImapCheckpoint",
+        is_known: Optional[Callable[[List[str]], Set[str]]] = None,
+    ) -> Iterator[RawEmailMessage]:
+        """
+        Инкрементально по UID: только UID > checkpoint.last_uid. Не зависит от флагов \\Seen,
+        поэтому чтение ящика людьми не теряет и не дублирует тикеты.
+        Первая синхронизация или смена UIDVALIDITY: база — текущий максимальный UID,
+        непрочитанные до него забираются (как раньше), дальше — строго по UID.
+        Два прохода: заголовки + RFC822.SIZE для всех, тело — только для прошедших
+        фильтр и дедупликацию (рассылки не скачиваются целиком).
+        Письмо отдаётся сразу после разбора — пакет FETCH не копится списком RawEmailMessage.
+        Сырых писем в памяти — не больше пакета (FETCH_BATCH_BYTES); письмо крупнее
+        FETCH_STREAM_BYTES скачивается отдельно, частями по FETCH_CHUNK_BYTES.
+        """
+        uidvalidity = self.uidvalidity or self._status_uidvalidity(mail)
+        if checkpoint.uidvalidity is None or uidvalidity != checkpoint.uidvalidity:
+            if checkpoint.uidvalidity is not None:
+                print(f"[IMAP] UIDVALIDITY изменился ({checkpoint.uidvalidity} -> {uidvalidity}), новая база по UNSEEN")
+            top = self._uid_search(mail, "UID", "*")
+            top_uid = max(top) if top else 0
+            uids = self._uid_search(mail, "UNSEEN", "UID", f"1:{top_uid}") if top_uid else []
+            checkpoint.uidvalidity = uidvalidity
+            checkpoint.last_uid = top_uid
+        else:
+            # "n:*" всегда включает последнее письмо, даже если его UID < n — фильтруем
+            uids = [u for u in self._uid_search(mail, "UID", f"{checkpoint.last_uid + 1}:*") if u > checkpoint.last_uid]
+            if uids:
+                checkpoint.last_uid = max(uids)
 
-        print(f"[IMAP] Получено {len(messages)} новых писем (отфильтровано: {filtered_count})")
-        return messages
+        if not uids:
+            return
+
+        # Фаза 1: только заголовки + размер одним FETCH по диапазону UID
+        sizes = {}
+        filtered_count = 0
+        candidates = []
+        for uid, size, header_bytes in self._fetch_headers(mail, uids):
+            try:
+                headers = email.message_from_bytes(header_bytes)
+                subject = self._decode_header(headers["Subject"])
+                _, sender_email = self._parse_sender(headers["From"])
+                if is_email_filtered(sender_email, subject, headers):
+                    filtered_count += 1
+                    continue
+                message_id = headers["Message-ID"] or f"msg-{uid}"
+            except Exception as e:
+                # Битый заголовок одного письма не останавливает синхронизацию папки
+                print(f"[IMAP] Ошибка разбора заголовков письма UID {uid}: {e}")
+                checkpoint.failed_uids.append(uid)
+                continue
+            candidates.append((uid, message_id))
+            sizes[uid] = size
+        if filtered_count:
+            print(f"[IMAP] Пропущено по заголовкам (фильтр): {filtered_count}")
+        self.filtered_count += filtered_count
+
+        # Дедупликация по Message-ID до скачивания тела
+        known = is_known(list({mid for _, mid in candidates})) if is_known and candidates else set()
+        wanted = [uid for uid, mid in candidates if mid not in known]
+        if len(wanted) < len(candidates):
+            print(f"[IMAP] Уже обработаны (Message-ID): {len(candidates) - len(wanted)}")
+
+        # Фаза 2: полные письма — пакетами по числу и суммарному размеру, крупные — по одному частями
+        for batch in self._size_batches(wanted, sizes):
+            if len(batch) == 1 and sizes.get(batch[0], 0) > self.FETCH_STREAM_BYTES:
+                bodies = self._fetch_body_chunked(mail, batch[0], sizes[batch[0]])
+            else:
+                bodies = self._fetch_bodies(mail, batch)
+            missing = set(batch)
+            for uid, msg in bodies:
+                missing.discard(uid)
+                try:
+                    if msg is None:
+                        raise ValueError("письмо не разобрано")
+                    parsed = self._parse_message(msg, str(uid))
+                    msg = None
+                except Exception as e:
+                    # UID уже за checkpoint.last_uid — без отката позиции письмо потерялось бы
+                    print(f"[IMAP] Ошибка обработки письма UID {uid}: {e}")
+                    checkpoint.failed_uids.append(uid)
+                    continue
+                if parsed is None:
+                    self.filtered_count += 1
+                    continue
+                yield parsed
+            if missing:
+                print(f"[IMAP] Сервер не вернул письма UID {_uid_set(sorted(missing))} — будут запрошены снова")
+                checkpoint.failed_uids.extend(missing)
+
+    def _fetch_bodies(self, mail: imaplib.IMAP4, batch: List[int]) -> Iterator[Tuple[int, Optional[EmailMessage]]]:
+        """Пакет писем одним UID FETCH -> (uid, письмо); None — не разобралось. Literal освобождается после разбора."""
+        status, data = mail.uid("FETCH", _uid_set(batch), "(UID BODY.PEEK[])")
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH: {status}")
+        wanted = set(batch)
+        for meta, literal in _fetch_items(data):
+            m = re.search(rb"UID (\d+)", meta)
+            if not m or int(m.group(1)) not in wanted:
+                continue
+            uid = int(m.group(1))
+            wanted.discard(uid)
+            try:
+                msg = _parse_bytes(literal, self.spool_threshold)
+            except Exception as e:
+                print(f"[IMAP] Ошибка разбора письма UID {uid}: {e}")
+                msg = None
+            literal = None
+            yield uid, msg
+
+    def _fetch_body_chunked(
+        self, mail: imaplib.IMAP4, uid: int, size: int
+    ) -> Iterator[Tuple[int, Optional[EmailMessage]]]:
+        """
+        Крупное письмо частями BODY.PEEK[]<offset.FETCH_CHUNK_BYTES> прямо в _SpoolingParser:
+        в памяти одна часть сырого письма, а не всё письмо (и не пакет соседних); крупные
+        вложения уходят на диск по ходу разбора.
+        size — RFC822.SIZE: дальше него не запрашиваем (сервер, отдавший тело целиком, не зациклит).
+        Сервер не вернул письмо — ничего не отдаётся.
+        """
+        parser = _SpoolingParser(self.spool_threshold)
+        offset = 0
+        msg = None
+        try:
+            while True:
+                status, data = mail.uid("FETCH", str(uid), f"(UID BODY.PEEK[]<{offset}.{self.FETCH_CHUNK_BYTES}>)")
+                if status != "OK":
+                    raise imaplib.IMAP4.error(f"UID FETCH: {status}")
+                chunk = None
+                for meta, literal in _fetch_items(data):
+                    m = re.search(rb"UID (\d+)", meta)
+                    if m and int(m.group(1)) == uid:
+                        chunk = literal
+                if chunk is None and offset == 0:
+                    return
+                if chunk:
+                    parser.feed(chunk)
+                    offset += len(chunk)
+                # Неполная (или пустая) часть / дошли до RFC822.SIZE — конец письма
+                if not chunk or len(chunk) < self.FETCH_CHUNK_BYTES or offset >= size:
+                    break
+                chunk = None
+            msg = parser.close()
+        except (imaplib.IMAP4.error, OSError):
+            raise
+        except Exception as e:
+            print(f"[IMAP] Ошибка разбора письма UID {uid}: {e}")
+        finally:
+            if msg is None:
+                # Временные файлы уже записанных вложений — вместе с неудавшимся разбором
+                parser.abort()
+        yield uid, msg
+
+    # Полная загрузка: не больше писем / байт в одном UID FETCH
+    FETCH_BATCH_MESSAGES = 50
+    FETCH_BATCH_BYTES = 10 * 1024 * 1024
+    # Письмо больше FETCH_STREAM_BYTES — отдельно, частями по FETCH_CHUNK_BYTES (_fetch_body_chunked)
+    FETCH_STREAM_BYTES = 2 * 1024 * 1024
+    FETCH_CHUNK_BYTES = 1024 * 1024
+    HEADER_FIELDS = ("FROM", "SUBJECT", "MESSAGE-ID", "DATE")
+
+    def _header_fields(self) -> str:
+        """Заголовки фазы 1: базовые + те, что проверяют правила фильтра (List-Unsubscribe, ...)."""
+        names = list(self.HEADER_FIELDS)
+        names += [n.upper() for n in get_filter_engine().header_names if n.upper() not in names]
+        return f"BODY.PEEK[HEADER.FIELDS ({' '.join(names)})]"
+
+    def _fetch_headers(self, mail: imaplib.IMAP4, uids: List[int]):
+        """Фаза 1: (uid, RFC822.SIZE, байты заголовков) для всех uids одним запросом."""
+        status, data = mail.uid("FETCH", _uid_set(uids), f"(UID RFC822.SIZE {self._header_fields()})")
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH headers: {status}")
+        wanted = set(uids)
+        for meta, literal in _fetch_items(data):
+            m_uid = re.search(rb"UID (\d+)", meta)
+            if not m_uid or int(m_uid.group(1)) not in wanted:
+                continue
+            m_size = re.search(rb"RFC822\.SIZE (\d+)", meta)
+            yield int(m_uid.group(1)), int(m_size.group(1)) if m_size else 0, literal
+
+    def _size_batches(self, uids: List[int], sizes: dict):
+        batch: List[int] = []
+        batch_bytes = 0
+        for uid in uids:
+            size = sizes.get(uid, 0)
+            if size > self.FETCH_STREAM_BYTES:
+                if batch:
+                    yield batch
+                    batch, batch_bytes = [], 0
+                yield [uid]
+                continue
+            if batch and (len(batch) >= self.FETCH_BATCH_MESSAGES or batch_bytes + size > self.FETCH_BATCH_BYTES):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(uid)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def _uid_search(self, mail: imaplib.IMAP4, *criteria: str) -> List[int]:
+        status, data = mail.uid("SEARCH", None, *criteria)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID SEARCH {' '.join(criteria)}: {status}")
+        return sorted(int(x) for x in (data[0] or b"").split())
+
+    def _status_uidvalidity(self, mail: imaplib.IMAP4) -> Optional[int]:
+        """UIDVALIDITY через STATUS, если сервер не прислал его на SELECT."""
+        status, data = mail.status(self.folder, "(UIDVALIDITY)")
+        m = re.search(rb"UIDVALIDITY (\d+)", data[0] or b"") if status == "OK" and data else None
+        return int(m.group(1)) if m else None
+
+    def _parse_message(self, msg: EmailMessage, uid: Optional[str]) -> Optional[RawEmailMessage]:
+        """Разбирает письмо; None — системное/спам (фильтр). Лишние файлы _SpoolingParser удаляются."""
+        try:
+            return self._build_message(msg, uid)
+        finally:
+            _release_spooled(msg)
+
+    def _build_message(self, msg: EmailMessage, uid: Optional[str]) -> Optional[RawEmailMessage]:
+        # Парсим заголовки
+        subject = self._decode_header(msg["Subject"])
+        sender_name, sender_email = self._parse_sender(msg["From"])
+        message_id = msg["Message-ID"] or f"msg-{uid}"
+
+        # ФИЛЬТРАЦИЯ: пропускаем системные/спам письма (логируем без PII)
+        rule_id = get_filter_engine().check(sender_email, subject, msg)
+        if rule_id is not None:
+            print(f"[IMAP] Пропущено (фильтр): правило {rule_id}")
+            return None
+
+        # Парсим дату
+        received_at = None
+        if msg["Date"]:
+            try:
+                received_at = parsedate_to_datetime(msg["Date"])
+            except:
+                pass
+
+        # Парсим тело письма и вложения (вложения последними: дальше ничего не падает)
+        body = self._get_body(msg)
+        return RawEmailMessage(
+            message_id=message_id,
+            subject=subject,
+            body=body,
+            sender_email=sender_email,
+            sender_name=sender_name,
+            received_at=received_at,
+            uid=uid,
+            in_reply_to=next(iter(parse_message_ids(msg["In-Reply-To"])), None),
+            references=parse_message_ids(msg["References"]),
+            attachments=self._get_attachments(msg),
+        )
 
     def _decode_header(self, header: Optional[str]) -> str:
         """Декодирует заголовок письма (может быть в разных кодировках)."""
@@ -321,6 +896,7 @@ class ImapEmailFetcher(EmailFetcher):
         result: List[EmailAttachment] = []
         if not msg.is_multipart():
             return result
+        spooled = getattr(msg, "spooled_parts", None) or {}
         for part in msg.walk():
             mime_type = (part.get_content_type() or "application/octet-stream").lower()
 
@@ -361,6 +937,15 @@ class ImapEmailFetcher(EmailFetcher):
                 filename = filename.decode("utf-8", errors="replace")
 
             try:
+                # Тело уже на диске (_SpoolingParser): файл переходит во владение вложения
+                key = next((k for k in part.get_all(SPOOLED_HEADER, []) if k in spooled), None)
+                if key is not None:
+                    path, size = spooled.pop(key)
+                    if size > 0:
+                        result.append(EmailAttachment(filename=filename, mime_type=mime_type, path=path, size=size))
+                    else:
+                        _unlink_quiet(path)
+                    continue
                 payload = part.get_payload(decode=True)
                 if payload and len(payload) > 0:
                     result.append(EmailAttachment(filename=filename, mime_type=mime_type, data=payload))
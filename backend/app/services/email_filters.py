@@ -0,0 +1,356 @@
+"""
+Фильтр системных/спам писем: правила компилируются один раз, проверка письма —
+один проход по каждому полю, сколько бы правил ни было.
+
+Правила: встроенные (BLOCKED_SENDERS / BLOCKED_SUBJECTS + DEFAULT_HEADER_RULES — заголовки
+рассылок и автоответов) + JSON-файл EMAIL_FILTERS_FILE:
+    {"replace_defaults": false,
+     "rules": [
+       {"id": "vendor-news", "field": "domain", "pattern": "news.vendor.ru"},
+       {"field": "subject", "match": "regex", "pattern": "^\\\\[jira\\\\]"},
+       {"field": "header", "header": "X-Mailer", "pattern": "mailchimp"},
+       {"field": "header", "header": "List-Id"},
+       {"field": "sender", "match": "equals", "pattern": "alerts@client.ru", "action": "allow"}
+     ]}
+field: sender | domain | subject | header; match: contains (по умолчанию) | equals | regex;
+у header без pattern — достаточно наличия заголовка; action: block (по умолчанию) | allow —
+allow сильнее любого block (клиент, который пишет через систему рассылок).
+
+Компиляция по полю: подстроки — автомат Ахо–Корасик, regex — одно объединённое выражение,
+equals и домены (включая поддомены) — множества. Файл перечитывается при изменении mtime
+(проверка не чаще раза в EMAIL_FILTERS_RELOAD_SECONDS); счётчики срабатываний по id правила
+переживают перезагрузку — GET /api/email/filters.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.config import get_settings
+
+FIELDS = ("sender", "domain", "subject", "header")
+MATCHES = ("contains", "equals", "regex")
+ACTIONS = ("block", "allow")
+
+# Встроенные правила (раньше — BLOCKED_SENDERS / BLOCKED_SUBJECTS в email_adapters)
+BLOCKED_SENDERS = [
+    "noreply@",
+    "no-reply@",
+    "mailer-daemon@",
+    "postmaster@",
+    "donotreply@",
+    "notifications@",
+    "alert@",
+    "alerts@",
+    "security@google",
+    "accounts.google.com",
+    "googlemail.com",
+    "facebookmail.com",
+    "twitter.com",
+    "linkedin.com",
+    "newsletter@",
+    "marketing@",
+    "promo@",
+    "spam@",
+    "bounce@",
+    "daemon@",
+]
+
+BLOCKED_SUBJECTS = [
+    "security alert",
+    "password reset",
+    "verify your email",
+    "confirm your email",
+    "sign-in attempt",
+    "suspicious activity",
+    "unsubscribe",
+    "newsletter",
+    "подтверждение почты",
+    "подтвердите email",
+    "сброс пароля",
+    "оповещение безопасности",
+    "подозрительная активность",
+]
+
+# Рассылки (RFC 2369), автоответы и массовые письма (RFC 3834)
+DEFAULT_HEADER_RULES = [
+    {"id": "header:list-unsubscribe", "field": "header", "header": "List-Unsubscribe"},
+    {"id": "header:auto-submitted", "field": "header", "header": "Auto-Submitted", "match": "regex", "pattern": r"^\s*(?!no\s*$)\S"},
+    {"id": "header:precedence", "field": "header", "header": "Precedence", "match": "regex", "pattern": r"^\s*(bulk|junk|list)\b"},
+]
+
+
+@dataclass(frozen=True)
+class FilterRule:
+    id: str
+    field: str
+    pattern: str = ""
+    match: str = "contains"
+    action: str = "block"
+    header: str = ""  # имя заголовка (field=header), в нижнем регистре
+
+
+def _default_rules() -> List[FilterRule]:
+    rules = [FilterRule(id=f"sender:{p}", field="sender", pattern=p) for p in BLOCKED_SENDERS]
+    rules += [FilterRule(id=f"subject:{p}", field="subject", pattern=p) for p in BLOCKED_SUBJECTS]
+    rules += [_rule_from_dict(r) for r in DEFAULT_HEADER_RULES]
+    return rules
+
+
+def _rule_from_dict(entry: dict) -> FilterRule:
+    field = str(entry.get("field") or "").lower()
+    match = str(entry.get("match") or "contains").lower()
+    action = str(entry.get("action") or "block").lower()
+    pattern = str(entry.get("pattern") or "")
+    header = str(entry.get("header") or "").strip().lower()
+    if field not in FIELDS:
+        raise ValueError(f"field должен быть одним из {FIELDS}")
+    if match not in MATCHES:
+        raise ValueError(f"match должен быть одним из {MATCHES}")
+    if action not in ACTIONS:
+        raise ValueError(f"action должен быть одним из {ACTIONS}")
+    if field == "header" and not header:
+        raise ValueError("для field=header нужен header")
+    if field != "header" and not pattern:
+        raise ValueError("пустой pattern")
+    if match == "regex":
+        re.compile(pattern)
+    else:
+        pattern = pattern.lower()
+    rule_id = str(entry.get("id") or f"{field}:{header + ':' if header else ''}{pattern}")
+    return FilterRule(id=rule_id, field=field, pattern=pattern, match=match, action=action, header=header)
+
+
+class AhoCorasick:
+    """Автомат Ахо–Корасик: все подстроки-правила за один проход по тексту."""
+
+    def __init__(self, patterns: Iterable[Tuple[str, str]]):
+        # Узел: переходы, суффиксная ссылка, id правила самого короткого совпадения в узле
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Optional[str]] = [None]
+        for pattern, rule_id in patterns:
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                    self._goto[node][ch] = nxt
+                node = nxt
+            if self._out[node] is None:
+                self._out[node] = rule_id
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                fallback = self._goto[f].get(ch, 0)
+                self._fail[nxt] = fallback if fallback != nxt else 0
+                if self._out[nxt] is None:
+                    self._out[nxt] = self._out[self._fail[nxt]]
+
+    def __bool__(self) -> bool:
+        return len(self._goto) > 1
+
+    def search(self, text: str) -> Optional[str]:
+        """id правила первой (по позиции конца) найденной подстроки; None — совпадений нет."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node] is not None:
+                return out[node]
+        return None
+
+
+class _FieldMatcher:
+    """Все правила одного поля (и действия): подстроки + равенства + объединённый regex."""
+
+    def __init__(self, rules: List[FilterRule]):
+        self.automaton = AhoCorasick((r.pattern, r.id) for r in rules if r.match == "contains" and r.pattern)
+        self.equals: Dict[str, str] = {}
+        for r in rules:
+            if r.match == "equals":
+                self.equals.setdefault(r.pattern, r.id)
+        regex_rules = [r for r in rules if r.match == "regex"]
+        self._regex_ids = {f"_r{i}": r.id for i, r in enumerate(regex_rules)}
+        self.regex = re.compile(
+            "|".join(f"(?P<_r{i}>(?:{r.pattern}))" for i, r in enumerate(regex_rules)), re.IGNORECASE
+        ) if regex_rules else None
+        self.presence: Optional[str] = next((r.id for r in rules if not r.pattern), None)
+
+    def match(self, value: str) -> Optional[str]:
+        if self.presence is not None:
+            return self.presence
+        lowered = value.lower()
+        rule_id = self.equals.get(lowered.strip())
+        if rule_id is None and self.automaton:
+            rule_id = self.automaton.search(lowered)
+        if rule_id is None and self.regex is not None:
+            m = self.regex.search(value)
+            if m:
+                rule_id = next(self._regex_ids[k] for k, v in m.groupdict().items() if v is not None and k in self._regex_ids)
+        return rule_id
+
+
+class _CompiledRules:
+    """Правила одного действия (block или allow), скомпилированные по полям."""
+
+    def __init__(self, rules: List[FilterRule]):
+        self.sender = _FieldMatcher([r for r in rules if r.field == "sender"])
+        self.subject = _FieldMatcher([r for r in rules if r.field == "subject"])
+        self.domains: Dict[str, str] = {}
+        for r in rules:
+            if r.field == "domain":
+                self.domains.setdefault(r.pattern.lstrip("@.").lower(), r.id)
+        by_header: Dict[str, List[FilterRule]] = {}
+        for r in rules:
+            if r.field == "header":
+                by_header.setdefault(r.header, []).append(r)
+        self.headers = {name: _FieldMatcher(group) for name, group in by_header.items()}
+
+    def match(self, sender_email: str, subject: str, headers) -> Optional[str]:
+        sender_email = sender_email or ""
+        if sender_email:
+            rule_id = self.sender.match(sender_email)
+            if rule_id:
+                return rule_id
+            if self.domains:
+                # "mail.news.vendor.ru" -> проверяем сам домен и все родительские
+                labels = sender_email.rpartition("@")[2].lower().strip(" >").split(".")
+                for i in range(len(labels)):
+                    rule_id = self.domains.get(".".join(labels[i:]))
+                    if rule_id:
+                        return rule_id
+        if subject:
+            rule_id = self.subject.match(subject)
+            if rule_id:
+                return rule_id
+        if headers is not None:
+            for name, matcher in self.headers.items():
+                value = headers.get(name)
+                if value is not None:
+                    rule_id = matcher.match(str(value))
+                    if rule_id:
+                        return rule_id
+        return None
+
+
+class FilterEngine:
+    """Скомпилированный набор правил + счётчики срабатываний."""
+
+    def __init__(self, rules: List[FilterRule], source: str = "defaults"):
+        self.rules = rules
+        self.source = source
+        self._block = _CompiledRules([r for r in rules if r.action == "block"])
+        self._allow = _CompiledRules([r for r in rules if r.action == "allow"])
+        # Заголовки, которые нужны правилам (IMAP-запрос фазы заголовков)
+        self.header_names = sorted({r.header for r in rules if r.field == "header"})
+        self.hits: Dict[str, int] = {}
+        self._hits_lock = threading.Lock()
+
+    def check(self, sender_email: str, subject: str, headers=None) -> Optional[str]:
+        """id сработавшего block-правила; None — письмо пропускается дальше."""
+        if self._allow.match(sender_email, subject, headers):
+            return None
+        rule_id = self._block.match(sender_email, subject, headers)
+        if rule_id is not None:
+            with self._hits_lock:
+                self.hits[rule_id] = self.hits.get(rule_id, 0) + 1
+        return rule_id
+
+    def stats(self) -> List[dict]:
+        with self._hits_lock:
+            hits = dict(self.hits)
+        return [
+            {
+                "id": r.id,
+                "field": r.field,
+                "header": r.header or None,
+                "match": r.match,
+                "pattern": r.pattern,
+                "action": r.action,
+                "hits": hits.get(r.id, 0),
+            }
+            for r in self.rules
+        ]
+
+
+def load_filter_rules(path: str) -> Tuple[List[FilterRule], str]:
+    """Встроенные правила + файл path. Ошибочные правила пропускаются с логом."""
+    if not path:
+        return _default_rules(), "defaults"
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"rules": data}
+    rules = [] if data.get("replace_defaults") else _default_rules()
+    for i, entry in enumerate(data.get("rules") or []):
+        try:
+            rules.append(_rule_from_dict(entry))
+        except (re.error, ValueError, TypeError, AttributeError) as e:
+            print(f"[EmailFilters] {path}: правило #{i} пропущено: {e}", flush=True)
+    return rules, path
+
+
+_engine: Optional[FilterEngine] = None
+_engine_mtime: Optional[float] = None
+_engine_checked = 0.0
+_engine_lock = threading.Lock()
+
+
+def get_filter_engine() -> FilterEngine:
+    """Текущий набор правил; файл EMAIL_FILTERS_FILE перечитывается при изменении."""
+    global _engine, _engine_mtime, _engine_checked
+    settings = get_settings()
+    now = time.monotonic()
+    if _engine is not None and now - _engine_checked < max(0, settings.email_filters_reload_seconds):
+        return _engine
+    with _engine_lock:
+        _engine_checked = now
+        path = (settings.email_filters_file or "").strip()
+        try:
+            mtime = os.stat(path).st_mtime if path else None
+        except OSError as e:
+            if _engine is None:
+                print(f"[EmailFilters] {path}: {e}; только встроенные правила", flush=True)
+                _engine = FilterEngine(_default_rules())
+            return _engine
+        if _engine is not None and mtime == _engine_mtime and _engine.source == (path or "defaults"):
+            return _engine
+        try:
+            rules, source = load_filter_rules(path)
+        except (OSError, ValueError, AttributeError) as e:
+            # Битый файл при горячей перезагрузке — остаёмся на предыдущих правилах
+            print(f"[EmailFilters] {path}: не загружен ({e})", flush=True)
+            if _engine is None:
+                _engine = FilterEngine(_default_rules())
+            return _engine
+        engine = FilterEngine(rules, source)
+        if _engine is not None:
+            known = {r.id for r in rules}
+            engine.hits = {k: v for k, v in _engine.hits.items() if k in known}
+            print(f"[EmailFilters] Правила перезагружены: {len(rules)} ({source})", flush=True)
+        _engine, _engine_mtime = engine, mtime
+        return _engine
+
+
+def reload_filter_engine() -> FilterEngine:
+    """Принудительная перезагрузка (админка)."""
+    global _engine_checked, _engine_mtime
+    with _engine_lock:
+        _engine_checked = 0.0
+        _engine_mtime = None
+    return get_filter_engine()
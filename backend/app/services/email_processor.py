@@ -1,6 +1,6 @@
 """
 Сервис обработки входящих писем.
-Объединяет IMAP fetch + создание тикета + AI анализ.
+Объединяет IMAP fetch + создание тикета + AI анализ (стадии — см. ingest_pipeline).
 """
 import threading
 from typing import List, Optional
@@ -9,36 +9,65 @@ from sqlalchemy.orm import Session
 
 from sqlalchemy.exc import IntegrityError
 
-# Один sync за раз (endpoint + background thread)
-_sync_lock = threading.Lock()
-
-from app.services.email_adapters import ImapEmailFetcher, RawEmailMessage
-from app.services.ai_agent import AIAgent
-from app.services.telegram_service import maybe_send_telegram_alert
-from app.services.attachment_storage import save_attachment
-from app.services.attachment_extract import extract_text_from_attachment
-from app.models import Ticket, TicketAttachment
+from app.services.email_adapters import ImapEmailFetcher, ImapCheckpoint, RawEmailMessage
+from app.services.mailboxes import MailboxConfig, load_mailbox_configs, get_mailbox_rate_limiter
+from app.services.attachment_storage import store_attachment_bytes, store_attachment_file
+from app.services.preview_service import enqueue_previews
+from app.services.ingest_pipeline import (
+    AI_STATUS_EXTRACTING,
+    MessagePrefetcher,
+    get_extraction_pool,
+    queue_ticket_for_ai,
+)
+from app.services.email_threads import register_message_id, resolve_thread
+from app.services.near_duplicates import (
+    compute_simhash,
+    find_near_duplicate,
+    register_fingerprint,
+    share_analysis,
+    to_signed,
+)
+from app.services.ai_queue import JOB_ANALYZE, JOB_FOLLOW_UP
+from app.models import EmailMessageId, Message, Ticket, TicketAttachment, ImapSyncState
 from app.config import get_settings
 
+# Один sync за раз на папку ящика (endpoint + фоновый слушатель)
+_sync_locks = {}
+_sync_locks_guard = threading.Lock()
+
+
+def get_sync_lock(account: str, folder: str) -> threading.Lock:
+    with _sync_locks_guard:
+        return _sync_locks.setdefault((account, folder), threading.Lock())
+
 
 class EmailProcessor:
     """
     Обработчик входящих писем для техподдержки ЭРИС.
 
-    Пайплайн:
-    1. Получение новых писем через IMAP
-    2. Создание тикета для каждого письма
-    3. AI анализ письма (извлечение данных, категоризация, ответ)
-    4. Обновление тикета результатами анализа
+    Пайплайн (стадии с ограниченными очередями, см. ingest_pipeline):
+    1. Получение новых писем через IMAP (поток fetch)
+    2. Создание тикета и сохранение файлов вложений для каждого письма
+    3. Извлечение текста вложений (пул extract, в фоне)
+    4. AI анализ письма через очередь ai_jobs
     """
 
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, mailbox: Optional[MailboxConfig] = None, folder: Optional[str] = None):
         self.db = db
         self.settings = get_settings()
+        if mailbox is None:
+            configs = load_mailbox_configs()
+            mailbox = configs[0] if configs else None
+        self.mailbox = mailbox
+        self.folder = folder or (mailbox.folders[0] if mailbox else "INBOX")
 
-    def process_new_emails(self) -> List[dict]:
+    def process_new_emails(self, mail=None, stop: Optional[threading.Event] = None) -> List[dict]:
         """
-        Обрабатывает все новые письма из почтового ящика.
+        Обрабатывает все новые письма из папки почтового ящика.
+
+        Args:
+            mail: открытое IMAP-соединение долгоживущей сессии (imap_session); None — новое подключение
+            stop: остановка слушателя (прерывает ожидание лимита писем в минуту)
 
         Returns:
             Список результатов обработки [{ticket_id, status, message}]
@@ -46,54 +75,141 @@ class EmailProcessor:
         results = []
 
         # Проверяем настройки IMAP
-        if not all([
-            self.settings.imap_host,
-            self.settings.imap_user,
-            self.settings.imap_pass
-        ]):
+        if self.mailbox is None:
             return [{"status": "error", "message": "IMAP не настроен. Укажите IMAP_HOST, IMAP_USER, IMAP_PASS в .env"}]
 
         try:
             # Получаем новые письма
-            fetcher = ImapEmailFetcher(
-                host=self.settings.imap_host,
-                port=self.settings.imap_port or 993,
-                user=self.settings.imap_user,
-                password=self.settings.imap_pass
+            fetcher = self.mailbox.fetcher(self.folder)
+            state = self._load_sync_state(fetcher)
+            checkpoint = ImapCheckpoint(uidvalidity=state.uidvalidity, last_uid=state.last_uid or 0)
+            # Письма приходят по одному сразу после разбора — тикет создаётся, не дожидаясь всего пакета;
+            # следующие письма скачиваются, пока сохраняется текущее
+            messages = MessagePrefetcher(
+                fetcher.iter_new_messages(mail=mail, checkpoint=checkpoint, is_known=self._known_message_ids),
+                self.settings.ingest_queue_size,
             )
-            messages = fetcher.fetch_new_messages()
 
-            if not messages:
-                return [{"status": "ok", "message": "Новых писем нет"}]
+            # Обрабатываем каждое письмо (не быстрее лимита ящика)
+            limiter = get_mailbox_rate_limiter(self.mailbox)
+            failed_uids = []  # ошибка обработки — попытка засчитывается
+            deferred_uids = []  # остановка — письмо просто заберём снова
+            received = 0
+            try:
+                for msg in messages:
+                    received += 1
+                    try:
+                        if not limiter.acquire(stop):
+                            # Остановка: оставшиеся письма заберём при следующем запуске
+                            if msg.uid:
+                                deferred_uids.append(int(msg.uid))
+                            break
+                        result = self._process_single_email(msg, stop)
+                        results.append(result)
+                    except Exception as e:
+                        self.db.rollback()
+                        if msg.uid:
+                            failed_uids.append(int(msg.uid))
+                        results.append({
+                            "status": "error",
+                            "message_id": msg.message_id,
+                            "error": str(e)[:200],
+                        })
+                    finally:
+                        msg.cleanup()  # временные файлы вложений
+            finally:
+                deferred_uids.extend(messages.close())
+                # Письма, которые fetcher не смог скачать или разобрать
+                failed_uids.extend(checkpoint.failed_uids)
 
-            # Обрабатываем каждое письмо
-            for msg in messages:
-                try:
-                    result = self._process_single_email(msg)
-                    results.append(result)
-                except Exception as e:
-                    results.append({
-                        "status": "error",
-                        "message_id": msg.message_id,
-                        "error": str(e)[:200],
-                    })
+            # Письмо с ошибкой заберём снова (последующие отсечёт дедупликация по external_id)
+            self._apply_retries(state, checkpoint, failed_uids)
+            if deferred_uids:
+                checkpoint.last_uid = min(checkpoint.last_uid, min(deferred_uids) - 1)
+            self._save_sync_state(state, checkpoint)
+
+            if not received:
+                return [{"status": "ok", "message": "Новых писем нет"}]
 
         except Exception as e:
-            return [{"status": "error", "message": f"Ошибка IMAP: {str(e)}"}]
+            # Обрыв посреди пакета: уже созданные тикеты остаются, позиция не сдвигается
+            return results + [{"status": "error", "message": f"Ошибка IMAP: {str(e)}"}]
 
         return results
 
-    def _process_single_email(self, msg: RawEmailMessage) -> dict:
+    def _load_sync_state(self, fetcher: ImapEmailFetcher) -> ImapSyncState:
+        """Позиция UID-синхронизации для ящика/папки (создаётся при первой синхронизации)."""
+        account = f"{fetcher.user}@{fetcher.host}"
+        state = self.db.query(ImapSyncState).filter(
+            ImapSyncState.account == account,
+            ImapSyncState.folder == fetcher.folder,
+        ).first()
+        if state is None:
+            state = ImapSyncState(account=account, folder=fetcher.folder, last_uid=0)
+            self.db.add(state)
+            self.db.commit()
+        return state
+
+    def _known_message_ids(self, message_ids: List[str]) -> set:
+        """
+        Message-ID, по которым тикет уже создан или письмо добавлено в переписку
+        (проверка до скачивания тела письма).
+        Вызывается из потока fetch — своя сессия, self.db занята стадией persist.
+        """
+        known = set()
+        db = Session(bind=self.db.get_bind())
+        try:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                known.update(row[0] for row in db.query(Ticket.external_id).filter(Ticket.external_id.in_(chunk)).all())
+                known.update(row[0] for row in db.query(EmailMessageId.message_id).filter(EmailMessageId.message_id.in_(chunk)).all())
+        finally:
+            db.close()
+        return known
+
+    def _apply_retries(self, state: ImapSyncState, checkpoint: ImapCheckpoint, failed_uids: List[int]) -> None:
         """
-        Обрабатывает одно письмо.
+        Откат позиции перед первым письмом с ошибкой. Письмо, на котором позиция стоит
+        IMAP_MAX_MESSAGE_ATTEMPTS синхронизаций подряд, пропускается — иначе папка
+        перечитывалась бы с него бесконечно.
+        """
+        if state.uidvalidity != checkpoint.uidvalidity:
+            state.retry_uid, state.retry_count = None, 0  # UID прежней папки недействительны
+        failed = sorted(set(failed_uids))
+        max_attempts = max(1, self.settings.imap_max_message_attempts)
+        while failed:
+            uid = failed[0]
+            attempts = (state.retry_count or 0) + 1 if state.retry_uid == uid else 1
+            if attempts < max_attempts:
+                state.retry_uid, state.retry_count = uid, attempts
+                checkpoint.last_uid = min(checkpoint.last_uid, uid - 1)
+                return
+            print(f"[EmailProcessor] ОШИБКА: письмо UID {uid} ({state.account}/{state.folder}) "
+                  f"не обработано за {attempts} попыток — пропущено", flush=True)
+            state.retry_uid, state.retry_count = None, 0
+            failed.pop(0)
+        if state.retry_uid is not None and state.retry_uid <= checkpoint.last_uid:
+            state.retry_uid, state.retry_count = None, 0  # письмо наконец обработано
+
+    def _save_sync_state(self, state: ImapSyncState, checkpoint: ImapCheckpoint) -> None:
+        state.uidvalidity = checkpoint.uidvalidity
+        state.last_uid = checkpoint.last_uid
+        if self.db.is_modified(state):
+            self.db.commit()
+
+    def _process_single_email(self, msg: RawEmailMessage, stop: Optional[threading.Event] = None) -> dict:
+        """
+        Стадия persist для одного письма: тикет + файлы вложений. Текст вложений
+        извлекает пул extract, он же ставит AI в очередь; без вложений — в очередь AI сразу.
 
         Args:
             msg: RawEmailMessage из IMAP
+            stop: остановка слушателя (прерывает ожидание места в очереди extract)
 
         Returns:
             Результат обработки
         """
-        # 1. Проверяем, не обрабатывали ли это письмо ранее
+        # 1. Проверяем, не обрабатывали ли это письмо ранее (тикет или продолжение переписки)
         existing = self.db.query(Ticket).filter(
             Ticket.external_id == msg.message_id
         ).first()
@@ -106,6 +222,26 @@ class EmailProcessor:
                 "message": "Письмо уже обработано"
             }
 
+        threaded = self.db.query(EmailMessageId.ticket_id).filter(
+            EmailMessageId.message_id == msg.message_id
+        ).first()
+        if threaded:
+            return {
+                "status": "skip",
+                "message_id": msg.message_id,
+                "ticket_id": threaded[0],
+                "message": "Письмо уже добавлено в переписку"
+            }
+
+        # 1.5. Ответ в существующей цепочке — сообщение к тикету, а не новый тикет
+        thread_ticket = resolve_thread(self.db, msg)
+        if thread_ticket is not None:
+            return self._append_to_thread(thread_ticket, msg, stop)
+
+        # 1.7. Почти-дубликат недавнего обращения (SimHash темы и текста)
+        fingerprint = compute_simhash(msg.subject, msg.body)
+        duplicate_of_id = find_near_duplicate(self.db, fingerprint)
+
         # 2. Создаём тикет (reply_sent=0 чтобы гарантированно попадал в inbox / view=open)
         ticket = Ticket(
             external_id=msg.message_id,
@@ -116,12 +252,17 @@ class EmailProcessor:
             status="not_completed",
             priority="medium",
             source="email",
+            mailbox=self.mailbox.name if self.mailbox else None,
             reply_sent=0,
             reply_sent_at=None,
             received_at=msg.received_at or datetime.now(timezone.utc),
+            content_simhash=to_signed(fingerprint) if fingerprint is not None else None,
+            duplicate_of_id=duplicate_of_id,
         )
         self.db.add(ticket)
         try:
+            self.db.flush()
+            register_message_id(self.db, ticket.id, msg.message_id)
             self.db.commit()
             self.db.refresh(ticket)
         except IntegrityError:
@@ -133,118 +274,139 @@ class EmailProcessor:
                 "message": "Письмо уже обработано (дубликат)",
             }
 
-        print(f"[EmailProcessor] Создан тикет #{ticket.id} (source=email)")
+        register_fingerprint(ticket)
+        print(f"[EmailProcessor] Создан тикет #{ticket.id} (source=email)"
+              + (f", почти-дубликат #{duplicate_of_id}" if duplicate_of_id else ""))
 
-        # 2.5. Обработка вложений: сохранение, запись в БД, извлечение текста для AI
-        attachments_summary_parts = []
-        extracted_text_parts = []
-        if getattr(msg, "attachments", None) and msg.attachments:
-            for att in msg.attachments:
-                try:
-                    storage_path = save_attachment(ticket.id, att.filename, att.data)
-                    size_bytes = len(att.data)
-                    self.db.add(TicketAttachment(
-                        ticket_id=ticket.id,
-                        filename=att.filename,
-                        mime_type=att.mime_type,
-                        size_bytes=size_bytes,
-                        storage_path=storage_path,
-                    ))
-                    attachments_summary_parts.append(f"{att.filename} ({att.mime_type}, {size_bytes} bytes)")
-                    success, text_or_note = extract_text_from_attachment(att.filename, att.mime_type, att.data)
-                    if success and (text_or_note or "").strip():
-                        extracted_text_parts.append(f"[{att.filename}]:\n{text_or_note.strip()}")
-                    elif not success and text_or_note:
-                        extracted_text_parts.append(f"[{att.filename}]: {text_or_note}")
-                except Exception as e:
-                    print(f"[EmailProcessor] Ошибка обработки вложения {getattr(att, 'filename', '?')}: {e}")
-                    attachments_summary_parts.append(f"{getattr(att, 'filename', 'attachment')} (ошибка сохранения)")
-            self.db.commit()
-        attachments_summary = "; ".join(attachments_summary_parts) if attachments_summary_parts else ""
-        attachments_extracted_text = "\n\n---\n\n".join(extracted_text_parts) if extracted_text_parts else ""
+        # 2.5. Вложения: только сохранение файлов и запись в БД; текст извлекается в фоне
+        saved_attachments = self._save_attachments(ticket, msg)
 
-        # Ticket'a ek metnini ve ai_status kaydet (background'da AI çalışacak)
-        ticket.attachments_text = attachments_extracted_text if attachments_extracted_text else None
-        ticket.ai_status = "pending"
-        ticket.ai_error = None
+        # 3. Тикет — на следующую стадию: с вложениями — пул extract (OCR здесь не ждём), без — очередь AI.
+        # Дубликат не анализируется: результат оригинала (сейчас или когда он будет готов)
+        if duplicate_of_id:
+            share_analysis(self.db, ticket)
+        else:
+            self._dispatch(ticket, saved_attachments, stop)
+
+        result = {
+            "status": "ok",
+            "message_id": msg.message_id,
+            "ticket_id": ticket.id,
+            "subject": msg.subject,
+            "sender": msg.sender_email
+        }
+        if duplicate_of_id:
+            result["duplicate_of"] = duplicate_of_id
+        return result
+
+    def _append_to_thread(self, ticket: Ticket, msg: RawEmailMessage, stop: Optional[threading.Event]) -> dict:
+        """
+        Продолжение переписки: входящее сообщение к тикету, тикет снова открыт,
+        повторный анализ — только новых сообщений (follow_up, без Telegram-алерта).
+        """
+        self.db.add(Message(
+            ticket_id=ticket.id,
+            direction="inbound",
+            channel="email",
+            parsed_text=msg.body or "",
+            subject=msg.subject,
+            sender_email=msg.sender_email,
+            recipient_email=self.mailbox.user if self.mailbox else None,
+        ))
+        register_message_id(self.db, ticket.id, msg.message_id)
+        # Клиент ответил — тикет снова требует внимания (попадает в inbox / view=open)
+        ticket.status = "not_completed"
+        ticket.reply_sent = 0
+        ticket.reply_sent_at = None
+        ticket.completed_at = None
         try:
             self.db.commit()
-            self.db.refresh(ticket)
-        except Exception:
+        except IntegrityError:
             self.db.rollback()
+            return {
+                "status": "skip",
+                "message_id": msg.message_id,
+                "ticket_id": ticket.id,
+                "message": "Письмо уже добавлено в переписку (дубликат)",
+            }
 
-        # 3. AI analizi request thread'inde değil background'da çalıştır (takılmayı önlemek için)
-        if self.settings.openai_api_key:
-            threading.Thread(target=_run_process_ticket_ai, args=(ticket.id,), daemon=True).start()
-            print(f"[EmailProcessor] Тикет #{ticket.id}: AI анализ запущен в фоне")
-        else:
-            ticket.ai_status = "done"
-            try:
-                self.db.commit()
-            except Exception:
-                self.db.rollback()
+        print(f"[EmailProcessor] Тикет #{ticket.id}: продолжение переписки от {msg.sender_email}")
+
+        saved_attachments = self._save_attachments(ticket, msg)
+        self._dispatch(ticket, saved_attachments, stop, kind=JOB_FOLLOW_UP)
 
         return {
             "status": "ok",
+            "follow_up": True,
             "message_id": msg.message_id,
             "ticket_id": ticket.id,
             "subject": msg.subject,
             "sender": msg.sender_email
         }
 
+    def _save_attachments(self, ticket: Ticket, msg: RawEmailMessage) -> int:
+        """Файлы вложений письма -> хранилище + TicketAttachment. Returns: сколько сохранено."""
+        saved_attachments = 0
+        rows: List[TicketAttachment] = []
+        if getattr(msg, "attachments", None) and msg.attachments:
+            for att in msg.attachments:
+                try:
+                    if att.path:
+                        # Крупное вложение уже на диске (spool) — переносим файл, без чтения в память
+                        stored = store_attachment_file(att.path, att.filename)
+                        att.path = None
+                    else:
+                        stored = store_attachment_bytes(att.data, att.filename)
+                    row = TicketAttachment(
+                        ticket_id=ticket.id,
+                        filename=att.filename,
+                        mime_type=att.mime_type,
+                        size_bytes=stored.size,
+                        storage_path=stored.storage_path,
+                        sha256=stored.sha256,
+                    )
+                    self.db.add(row)
+                    rows.append(row)
+                    saved_attachments += 1
+                except Exception as e:
+                    print(f"[EmailProcessor] Ошибка сохранения вложения {getattr(att, 'filename', '?')}: {e}")
+            self.db.commit()
+            enqueue_previews(row.id for row in rows)
+        return saved_attachments
 
-def _run_process_ticket_ai(ticket_id: int) -> None:
-    """
-    Background'da çalışır: ticket için AI analizi yapar, ai_status=done/failed yazar.
-    Takılma olmaması için request thread dışında çalışır; hata olursa ai_status=failed + ai_error.
-    """
-    from app.db import SessionLocal
-    db = SessionLocal()
-    try:
-        ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
-        if not ticket:
-            return
-        if getattr(ticket, "ai_status", None) != "pending":
-            return
-        # attachments_summary: DB'deki eklerden oluştur
-        atts = db.query(TicketAttachment).filter(TicketAttachment.ticket_id == ticket_id).all()
-        attachments_summary = "; ".join(
-            f"{a.filename} ({a.mime_type}, {a.size_bytes or 0} bytes)" for a in atts
-        )
-        attachments_extracted_text = (ticket.attachments_text or "").strip()
-        agent = AIAgent(db)
-        result = agent.process_ticket(
-            ticket,
-            attachments_summary=attachments_summary,
-            attachments_extracted_text=attachments_extracted_text,
-        )
-        agent.update_ticket_with_result(ticket, result)
-        ticket.ai_status = "done"
-        ticket.ai_error = None
-        db.commit()
-        print(f"[EmailProcessor] Тикет #{ticket_id}: AI анализ завершён (ai_status=done)")
-        try:
-            maybe_send_telegram_alert(db, ticket)
-        except Exception as tg_err:
-            print(f"[EmailProcessor] Telegram skip: {tg_err}")
-    except Exception as e:
-        err_msg = str(e)[:500]
-        print(f"[EmailProcessor] Тикет #{ticket_id}: AI анализ ошибка — {err_msg}")
-        try:
-            ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
-            if ticket:
-                ticket.ai_status = "failed"
-                ticket.ai_error = err_msg
-                db.commit()
-        except Exception:
-            db.rollback()
-    finally:
-        db.close()
-    return
+    def _dispatch(self, ticket: Ticket, saved_attachments: int, stop: Optional[threading.Event],
+                  kind: str = JOB_ANALYZE) -> None:
+        """Следующая стадия: с вложениями — пул extract, без — сразу очередь AI."""
+        if saved_attachments:
+            ticket.ai_status = AI_STATUS_EXTRACTING
+            ticket.ai_error = None
+            self.db.commit()
+            # Не удалось поставить (остановка) — тикет останется в extracting и вернётся на старте
+            get_extraction_pool().submit(ticket.id, stop, kind=kind)
+        else:
+            queue_ticket_for_ai(self.db, ticket, kind)
 
 
 def fetch_and_process_emails(db: Session) -> List[dict]:
-    """Удобная функция для вызова из роутера или планировщика. Mutex: только один sync одновременно."""
-    with _sync_lock:
-        processor = EmailProcessor(db)
-        return processor.process_new_emails()
+    """
+    Удобная функция для вызова из роутера или планировщика: все ящики и папки.
+    Mutex: одна синхронизация папки одновременно. Если слушатель папки (IDLE) подключён,
+    проверка идёт через его соединение — без нового TLS-handshake.
+    """
+    from app.services.imap_session import get_imap_listener
+
+    configs = load_mailbox_configs()
+    if not configs:
+        return [{"status": "error", "message": "IMAP не настроен. Укажите IMAP_HOST, IMAP_USER, IMAP_PASS в .env"}]
+    results: List[dict] = []
+    for mailbox in configs:
+        for folder in mailbox.folders:
+            listener = get_imap_listener(mailbox.name, folder)
+            if listener is not None and listener.connected:
+                listener_results = listener.sync_now()
+                if listener_results is not None:
+                    results.extend(listener_results)
+                    continue
+            with get_sync_lock(mailbox.name, folder):
+                results.extend(EmailProcessor(db, mailbox, folder).process_new_emails())
+    return results
@@ -0,0 +1,141 @@
+"""
+Сборка переписки: ответ клиента в существующей цепочке — не новый тикет, а сообщение (Message)
+к тикету + инкрементальный повторный анализ (задача follow_up) без повторного Telegram-алерта.
+
+Тикет для входящего письма ищется:
+1. по In-Reply-To и References (от новых к старым) в индексе email_message_ids — там
+   Message-ID входящих писем (тикеты и продолжения) и наших ответов (send_email ставит Message-ID);
+2. по теме: письмо с префиксом ответа/пересылки (Re:, Fwd:, Ответ:, ...) от того же отправителя,
+   тема без префиксов совпадает с темой его тикета за EMAIL_THREAD_SUBJECT_DAYS дней
+   (почтовые клиенты, теряющие заголовки цепочки).
+"""
+import re
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import AiJobAttempt, EmailMessageId, Message, Ticket
+from app.services.email_adapters import RawEmailMessage
+
+# "Re: ", "RE[2]: ", "Fwd: ", "FW: ", "AW: ", "Ответ: ", "Отв: ", "Пересл: " (в т.ч. повторённые)
+_REPLY_PREFIX_RE = re.compile(
+    r"^\s*(?:(?:re|fwd?|aw|wg|sv|vs|ответ|отв|пересл)\s*(?:\[\d+\]|\(\d+\))?\s*:\s*)+",
+    re.IGNORECASE,
+)
+# Сколько тикетов отправителя сравнивать по теме
+SUBJECT_CANDIDATES = 20
+# Ограничения текста для инкрементального анализа (символов)
+FOLLOW_UP_CONTEXT_CHARS = 1500
+FOLLOW_UP_MESSAGE_CHARS = 4000
+
+
+def normalize_subject(subject: Optional[str]) -> Tuple[str, bool]:
+    """Тема без префиксов ответа/пересылки, в нижнем регистре. Returns: (тема, были ли префиксы)."""
+    subject = subject or ""
+    stripped = _REPLY_PREFIX_RE.sub("", subject)
+    return " ".join(stripped.split()).lower(), stripped != subject
+
+
+def find_ticket_by_message_ids(db: Session, message_ids: List[str]) -> Optional[Ticket]:
+    """Первый (в порядке message_ids) Message-ID, известный индексу -> его тикет."""
+    message_ids = [m for m in message_ids if m]
+    if not message_ids:
+        return None
+    rows = dict(
+        db.query(EmailMessageId.message_id, EmailMessageId.ticket_id)
+        .filter(EmailMessageId.message_id.in_(message_ids))
+        .all()
+    )
+    for message_id in message_ids:
+        if message_id in rows:
+            ticket = db.query(Ticket).filter(Ticket.id == rows[message_id]).first()
+            if ticket is not None:
+                return ticket
+    return None
+
+
+def resolve_thread(db: Session, msg: RawEmailMessage) -> Optional[Ticket]:
+    """Тикет, продолжением которого является письмо; None — новое обращение."""
+    ticket = find_ticket_by_message_ids(db, ([msg.in_reply_to] if msg.in_reply_to else []) + msg.references[::-1])
+    if ticket is not None:
+        return ticket
+
+    subject, is_reply = normalize_subject(msg.subject)
+    if not is_reply or not subject or not msg.sender_email:
+        return None
+    since = datetime.now(timezone.utc) - timedelta(days=max(0, get_settings().email_thread_subject_days))
+    candidates = (
+        db.query(Ticket)
+        .filter(
+            func.lower(Ticket.sender_email) == msg.sender_email.lower(),
+            Ticket.created_at >= since,
+        )
+        .order_by(Ticket.id.desc())
+        .limit(SUBJECT_CANDIDATES)
+        .all()
+    )
+    for candidate in candidates:
+        if normalize_subject(candidate.subject)[0] == subject:
+            return candidate
+    return None
+
+
+def register_message_id(db: Session, ticket_id: int, message_id: Optional[str], direction: str = "inbound") -> None:
+    """Добавляет Message-ID в индекс (без commit). Уже известный — пропускается."""
+    if not message_id:
+        return
+    if db.query(EmailMessageId.id).filter(EmailMessageId.message_id == message_id).first():
+        return
+    db.add(EmailMessageId(message_id=message_id, ticket_id=ticket_id, direction=direction))
+
+
+def thread_headers(db: Session, ticket: Ticket) -> Tuple[Optional[str], List[str]]:
+    """(In-Reply-To, References) для ответа по тикету: последнее входящее письмо и вся цепочка."""
+    ids = [
+        row[0]
+        for row in db.query(EmailMessageId.message_id)
+        .filter(EmailMessageId.ticket_id == ticket.id)
+        .order_by(EmailMessageId.id)
+        .all()
+    ]
+    if ticket.external_id and ticket.external_id not in ids:
+        ids.insert(0, ticket.external_id)
+    inbound = [
+        row[0]
+        for row in db.query(EmailMessageId.message_id)
+        .filter(EmailMessageId.ticket_id == ticket.id, EmailMessageId.direction == "inbound")
+        .order_by(EmailMessageId.id.desc())
+        .limit(1)
+        .all()
+    ]
+    return (inbound[0] if inbound else ticket.external_id), ids
+
+
+def build_follow_up_body(db: Session, ticket: Ticket) -> str:
+    """
+    Текст для инкрементального анализа: краткое содержание обращения и прошлый ответ
+    + только сообщения клиента с начала последнего завершённого AI-анализа (пришедшие,
+    пока он выполнялся, в него не попали).
+    """
+    last_done = (
+        db.query(func.max(AiJobAttempt.started_at))
+        .filter(AiJobAttempt.ticket_id == ticket.id, AiJobAttempt.status == "done")
+        .scalar()
+    )
+    q = db.query(Message).filter(Message.ticket_id == ticket.id, Message.direction == "inbound")
+    new_messages = q.filter(Message.created_at >= last_done).order_by(Message.id).all() if last_done else []
+    if not new_messages:
+        new_messages = q.order_by(Message.id.desc()).limit(1).all()
+
+    context = (ticket.issue_summary or ticket.body or "").strip()[:FOLLOW_UP_CONTEXT_CHARS]
+    parts = [f"Краткое содержание обращения (предыдущий анализ):\n{context}"]
+    previous_reply = (ticket.sent_reply or ticket.ai_reply or "").strip()
+    if previous_reply:
+        parts.append(f"Предыдущий ответ поддержки:\n{previous_reply[:FOLLOW_UP_CONTEXT_CHARS]}")
+    parts.append("Новые сообщения клиента в этой переписке:")
+    for m in new_messages:
+        parts.append((m.parsed_text or "").strip()[:FOLLOW_UP_MESSAGE_CHARS])
+    return "\n\n".join(parts)
@@ -0,0 +1,129 @@
+"""
+Кэш извлечённого текста вложений по SHA-256 содержимого файла (таблица attachment_text_cache).
+
+Повторный анализ тикета после загрузки вложений (задача attachments) разбирал заново все его
+файлы, одна и та же инструкция в PDF от разных клиентов проходила OCR каждый раз. Теперь
+ключ — (sha256, тип экстрактора): запись с текущей версией экстрактора (EXTRACTOR_VERSIONS)
+возвращается без разбора, устаревшая перезаписывается. Прерванный разбор (таймаут, память,
+сбой процесса) в кэш не попадает. Хэш считается один раз и хранится в ticket_attachments.sha256.
+"""
+import hashlib
+import os
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from app.models import AttachmentTextCache
+from app.services.attachment_extract import attachment_kind, extractor_version
+from app.services.extraction_service import ExtractionJob, ExtractionResult
+
+# Файл хэшируется блоками (большие сканы не читаются в память целиком)
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_sha256(path: str) -> Optional[str]:
+    """hex SHA-256 файла; None — файл не читается."""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def cache_key(job: ExtractionJob) -> Tuple[str, str]:
+    """(sha256, тип экстрактора); без хэша — путь (такой job не кэшируется и не склеивается с другими)."""
+    return job.sha256 or f"path:{job.path}", attachment_kind(job.filename, job.mime_type)
+
+
+def lookup(jobs: List[ExtractionJob]) -> List[Optional[ExtractionResult]]:
+    """
+    Заполняет job.sha256 и возвращает результаты из кэша в порядке jobs (None — нет в кэше
+    или версия экстрактора устарела). Ошибка БД — как пустой кэш.
+    """
+    from app.db import SessionLocal
+
+    for job in jobs:
+        if not job.sha256:
+            job.sha256 = file_sha256(job.path)
+    results: List[Optional[ExtractionResult]] = [None] * len(jobs)
+    hashes = {job.sha256 for job in jobs if job.sha256}
+    if not hashes:
+        return results
+
+    db = SessionLocal()
+    try:
+        rows = {
+            (row.sha256, row.kind): row
+            for row in db.query(AttachmentTextCache).filter(AttachmentTextCache.sha256.in_(hashes)).all()
+        }
+        now = datetime.now(timezone.utc)
+        for i, job in enumerate(jobs):
+            key = cache_key(job)
+            row = rows.get(key)
+            if row is None or row.extractor_version != extractor_version(key[1]):
+                continue
+            results[i] = ExtractionResult(
+                bool(row.success),
+                row.text or "",
+                row.extract_ms or 0,
+                page_count=row.page_count,
+                ocr_used=bool(row.ocr_used),
+                cached=True,
+            )
+            row.hits = (row.hits or 0) + 1
+            row.last_hit_at = now
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[Extract] Кэш недоступен: {e}", flush=True)
+    finally:
+        db.close()
+    return results
+
+
+def store(jobs: List[ExtractionJob], results: List[Optional[ExtractionResult]]) -> int:
+    """Сохраняет новые результаты (кроме прерванных и отменённых). Returns: сколько записано."""
+    from app.db import SessionLocal
+
+    stored = 0
+    db = SessionLocal()
+    try:
+        for job, result in zip(jobs, results):
+            if result is None or not result.cacheable or result.cached or not job.sha256:
+                continue
+            sha256, kind = cache_key(job)
+            version = extractor_version(kind)
+            row = (
+                db.query(AttachmentTextCache)
+                .filter(AttachmentTextCache.sha256 == sha256, AttachmentTextCache.kind == kind)
+                .first()
+            )
+            if row is None:
+                row = AttachmentTextCache(sha256=sha256, kind=kind, hits=0)
+                db.add(row)
+            row.extractor_version = version
+            row.success = result.success
+            row.text = result.text
+            row.extract_ms = result.duration_ms
+            row.page_count = result.page_count
+            row.ocr_used = result.ocr_used
+            try:
+                row.size_bytes = os.path.getsize(job.path)
+            except OSError:
+                row.size_bytes = None
+            try:
+                db.commit()
+                stored += 1
+            except IntegrityError:
+                # Тот же файл параллельно разобрал другой воркер — его запись не хуже
+                db.rollback()
+    except Exception as e:
+        db.rollback()
+        print(f"[Extract] Не удалось сохранить кэш: {e}", flush=True)
+    finally:
+        db.close()
+    return stored
@@ -0,0 +1,294 @@
+"""
+Извлечение текста вложений в отдельных процессах (ProcessPoolExecutor).
+
+pypdf / OCR держат GIL и запускают тяжёлые подпроцессы: в потоке приёма писем или AI-воркера
+они задерживали всё остальное, а битый PDF мог подвесить обработку. Теперь:
+- вложения тикета разбираются параллельно в EXTRACT_PROCESSES процессах (по ядрам);
+- каждое — с лимитом времени EXTRACT_TIMEOUT_SECONDS (таймер внутри процесса)
+  и памяти EXTRACT_MEMORY_MB (RLIMIT_AS процесса, наследуется tesseract/pdftoppm);
+- процесс, не ответивший и после двойного лимита (завис в C-коде), убивается вместе с пулом,
+  пул пересоздаётся, задачи других тикетов из убитого пула повторяются один раз;
+- stop (остановка слушателя/сервера) отменяет ещё не начатые задачи.
+Файл передаётся процессу путём, а не байтами. EXTRACT_PROCESSES=-1 — разбор в текущем потоке.
+Перед пулом — кэш по SHA-256 содержимого (extraction_cache): уже разобранный файл в процесс не уходит.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from app.config import get_settings
+
+# Процесс пула обрабатывает столько файлов и пересоздаётся (утечки памяти OCR-библиотек)
+MAX_TASKS_PER_CHILD = 50
+# Шаг проверки stop при ожидании результатов
+WAIT_TICK_SEC = 0.5
+# Во сколько раз дольше лимита ждём процесс, прежде чем убить пул
+HARD_TIMEOUT_FACTOR = 2
+HARD_TIMEOUT_GRACE_SEC = 5
+
+
+@dataclass
+class ExtractionJob:
+    """Одно вложение: путь к файлу в хранилище + данные для выбора экстрактора."""
+    path: str
+    filename: str
+    mime_type: str
+    sha256: Optional[str] = None  # известный хэш содержимого (ticket_attachments.sha256); иначе считается
+
+
+@dataclass
+class ExtractionResult:
+    """Результат разбора одного вложения."""
+    success: bool
+    text: str  # текст или заметка для AI (success=False)
+    duration_ms: int = 0
+    page_count: Optional[int] = None
+    ocr_used: bool = False
+    # False — разбор прерван (таймаут, память, сбой процесса): в кэш не попадает, повторится в следующий раз
+    cacheable: bool = True
+    cached: bool = False  # взят из кэша без разбора
+
+
+class ExtractionTimeout(BaseException):
+    """BaseException: не перехватывается `except Exception` внутри экстракторов."""
+
+
+def _on_alarm(signum, frame):
+    raise ExtractionTimeout()
+
+
+def _init_worker(memory_mb: int) -> None:
+    if memory_mb > 0:
+        try:
+            import resource
+
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+    signal.signal(signal.SIGALRM, _on_alarm)
+
+
+def _timeout_note(filename: str, timeout_sec: float) -> str:
+    return f"Не удалось обработать вложение {filename} за {timeout_sec:.0f} с; оператор проверит его вручную."
+
+
+def _memory_note(filename: str) -> str:
+    return f"Вложение {filename} слишком большое для автоматической обработки; оператор проверит его вручную."
+
+
+def _failed(note: str) -> ExtractionResult:
+    return ExtractionResult(False, note, cacheable=False)
+
+
+def run_extraction(job: ExtractionJob, timeout_sec: float = 0) -> ExtractionResult:
+    """Выполняется в процессе пула (или в текущем потоке): чтение файла + extract_text_from_attachment."""
+    from app.services.attachment_extract import extract_text_from_attachment
+
+    in_worker = timeout_sec > 0 and threading.current_thread() is threading.main_thread()
+    if in_worker:
+        signal.setitimer(signal.ITIMER_REAL, timeout_sec)
+    started = time.monotonic()
+    try:
+        with open(job.path, "rb") as f:
+            data = f.read()
+        info: dict = {}
+        success, text = extract_text_from_attachment(job.filename, job.mime_type, data, info)
+        return ExtractionResult(
+            success,
+            text,
+            int((time.monotonic() - started) * 1000),
+            page_count=info.get("page_count"),
+            ocr_used=bool(info.get("ocr")),
+        )
+    except ExtractionTimeout:
+        return _failed(_timeout_note(job.filename, timeout_sec))
+    except MemoryError:
+        return _failed(_memory_note(job.filename))
+    finally:
+        if in_worker:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class ExtractionService:
+    """Пул процессов извлечения; общий для конвейера приёма, AI-воркеров и API."""
+
+    def __init__(self, processes: int, timeout_sec: float, memory_mb: int):
+        self.processes = processes
+        self.timeout_sec = max(1.0, float(timeout_sec))
+        self.memory_mb = max(0, memory_mb)
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._generation = 0  # номер пула: задача из убитого пула повторяется в новом
+
+    @property
+    def inline(self) -> bool:
+        return self.processes < 0
+
+    def _get_executor(self) -> Tuple[ProcessPoolExecutor, int]:
+        with self._lock:
+            if self._executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                # fork из многопоточного сервера небезопасен
+                ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes or max(1, min(4, os.cpu_count() or 1)),
+                    mp_context=ctx,
+                    initializer=_init_worker,
+                    initargs=(self.memory_mb,),
+                    max_tasks_per_child=MAX_TASKS_PER_CHILD,
+                )
+                self._generation += 1
+            return self._executor, self._generation
+
+    def _discard(self, generation: int, kill: bool = False) -> None:
+        """
+        Пул generation больше не используется (сломан или kill — завис экстрактор);
+        следующий вызов создаст новый.
+        """
+        with self._lock:
+            if self._executor is None or generation != self._generation:
+                return
+            executor, self._executor = self._executor, None
+        if kill:
+            for proc in list((getattr(executor, "_processes", None) or {}).values()):
+                try:
+                    proc.kill()
+                except Exception:
+                    pass
+            print("[Extract] Процесс извлечения завис — пул перезапущен", flush=True)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, job: ExtractionJob) -> Tuple[Future, int]:
+        executor, generation = self._get_executor()
+        try:
+            return executor.submit(run_extraction, job, self.timeout_sec), generation
+        except (BrokenProcessPool, RuntimeError):
+            # Процесс пула упал (например, по лимиту памяти) или пул закрыт — новый пул
+            self._discard(generation)
+            executor, generation = self._get_executor()
+            return executor.submit(run_extraction, job, self.timeout_sec), generation
+
+    def extract_many(
+        self, jobs: List[ExtractionJob], stop: Optional[threading.Event] = None
+    ) -> List[Optional[ExtractionResult]]:
+        """
+        Параллельно разбирает вложения; результаты в порядке jobs.
+        None — задача отменена остановкой (stop).
+        """
+        if not jobs:
+            return []
+        if self.inline:
+            return [run_extraction(job) if not (stop and stop.is_set()) else None for job in jobs]
+
+        results: List[Optional[ExtractionResult]] = [None] * len(jobs)
+        # Future -> [индекс, поколение пула, был ли повтор, когда начал выполняться]
+        pending = {}
+        for i, job in enumerate(jobs):
+            fut, generation = self._submit(job)
+            pending[fut] = [i, generation, False, None]
+        # running() выставляется уже при передаче в очередь процесса — отсюда запас
+        hard_timeout = self.timeout_sec * HARD_TIMEOUT_FACTOR + HARD_TIMEOUT_GRACE_SEC
+
+        while pending:
+            if stop is not None and stop.is_set():
+                for fut in pending:
+                    fut.cancel()
+                break
+            done, _ = wait(list(pending), timeout=WAIT_TICK_SEC, return_when=FIRST_COMPLETED)
+            for fut in done:
+                i, generation, retried, _ = pending.pop(fut)
+                try:
+                    results[i] = fut.result()
+                except BrokenProcessPool:
+                    # Пул убит из-за чужого зависшего файла (или процесс упал по памяти) — один повтор
+                    self._discard(generation)
+                    if retried:
+                        results[i] = _failed(_memory_note(jobs[i].filename))
+                    else:
+                        new_fut, new_generation = self._submit(jobs[i])
+                        pending[new_fut] = [i, new_generation, True, None]
+                except Exception as e:
+                    print(f"[Extract] {jobs[i].filename}: {e}", flush=True)
+                    results[i] = _failed(f"Не удалось обработать вложение {jobs[i].filename}.")
+            now = time.monotonic()
+            for fut, state in list(pending.items()):
+                if state[3] is None:
+                    if fut.running():
+                        state[3] = now
+                elif now - state[3] > hard_timeout:
+                    # Таймер внутри процесса не сработал (завис в C-коде) — убиваем пул;
+                    # остальные задачи пула получат BrokenProcessPool и повторятся
+                    pending.pop(fut)
+                    results[state[0]] = _failed(_timeout_note(jobs[state[0]].filename, self.timeout_sec))
+                    self._discard(state[1], kill=True)
+        return results
+
+
+_service: Optional[ExtractionService] = None
+_service_lock = threading.Lock()
+
+
+def get_extraction_service() -> ExtractionService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            settings = get_settings()
+            _service = ExtractionService(
+                settings.extract_processes, settings.extract_timeout_seconds, settings.extract_memory_mb
+            )
+        return _service
+
+
+def extract_attachments(
+    jobs: List[ExtractionJob], stop: Optional[threading.Event] = None
+) -> List[Optional[ExtractionResult]]:
+    """
+    Текст вложений: из кэша по SHA-256 содержимого, остальные — через общий пул процессов
+    (см. ExtractionService.extract_many); новые результаты сохраняются в кэш.
+    После вызова job.sha256 заполнен (для ticket_attachments.sha256).
+    """
+    if not jobs:
+        return []
+    service = get_extraction_service()
+    if not get_settings().extract_cache_enabled:
+        return service.extract_many(jobs, stop)
+    from app.services import extraction_cache
+
+    results: List[Optional[ExtractionResult]] = extraction_cache.lookup(jobs)
+    # Один и тот же файл дважды в пакете (одно вложение в двух тикетах) — разбирается один раз
+    todo: dict = {}
+    for i, (job, result) in enumerate(zip(jobs, results)):
+        if result is None:
+            todo.setdefault(extraction_cache.cache_key(job), []).append(i)
+    if todo:
+        first = [indexes[0] for indexes in todo.values()]
+        extracted = service.extract_many([jobs[i] for i in first], stop)
+        for indexes, result in zip(todo.values(), extracted):
+            for i in indexes:
+                results[i] = result
+        extraction_cache.store([jobs[i] for i in first], extracted)
+    hits = sum(1 for r in results if r is not None and r.cached)
+    if hits:
+        print(f"[Extract] Из кэша: {hits} из {len(jobs)} вложений", flush=True)
+    return results
+
+
+def stop_extraction_service() -> None:
+    global _service
+    with _service_lock:
+        service, _service = _service, None
+    if service is not None:
+        service.shutdown()
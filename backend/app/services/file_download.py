@@ -0,0 +1,140 @@
+"""
+Отдача файла вложения: условные запросы (ETag / If-None-Match), Range (докачка, перемотка видео,
+постраничный просмотр PDF) и долгий кэш.
+
+Содержимое по storage_path не меняется (blob по SHA-256, старые пути — с uuid), поэтому ETag —
+хэш содержимого, а кэш — immutable на год (private: доступ проверяется по тикету). Полный файл
+отдаётся FileResponse: ASGI-сервер с расширением http.response.pathsend передаёт его без
+копирования через процесс; за nginx можно включить X-Accel-Redirect (ATTACHMENT_ACCEL_REDIRECT_PREFIX) —
+тогда файл (и Range) отдаёт nginx через sendfile.
+"""
+import os
+import re
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+CACHE_CONTROL_IMMUTABLE = "private, max-age=31536000, immutable"
+RANGE_CHUNK_BYTES = 256 * 1024
+# Открываются в браузере; остальное (html, svg, ...) — только скачиванием, чтобы не исполнялось на нашем домене
+INLINE_MIME_RE = re.compile(r"^(application/pdf|image/(jpeg|png|gif|webp)|text/plain|text/csv|video/[\w.+-]+|audio/[\w.+-]+)$")
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def content_disposition(filename: str, mime_type: str, download: bool = False) -> str:
+    kind = "inline" if not download and INLINE_MIME_RE.match(mime_type or "") else "attachment"
+    ascii_name = (filename or "file").encode("ascii", "ignore").decode().replace('"', "") or "file"
+    return f"{kind}; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename or 'file')}"
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Сравнение слабое (If-None-Match): W/"x" == "x"
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Один диапазон "bytes=a-b" / "bytes=a-" / "bytes=-n" -> (start, end) включительно.
+    None — заголовка нет или он не разбирается (отдаётся весь файл). Raises: ValueError — диапазон вне файла (416).
+    Несколько диапазонов не поддерживаются — весь файл (RFC 9110 это допускает).
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.group(1), match.group(2)
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        length = int(last)
+        if length == 0:
+            raise ValueError("пустой диапазон")
+        start, end = max(0, size - length), size - 1
+    if start >= size:
+        raise ValueError("диапазон за концом файла")
+    return start, end
+
+
+class FileRangeResponse(Response):
+    """206 Partial Content: байты [start, end] файла, читаются блоками."""
+
+    def __init__(self, path: Path, start: int, end: int, size: int, headers: dict, media_type: str):
+        super().__init__(status_code=206, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(RANGE_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def file_download_response(
+    request: Request,
+    path: Path,
+    *,
+    etag: str,
+    media_type: str,
+    filename: str,
+    download: bool = False,
+    accel_redirect: Optional[str] = None,
+) -> Response:
+    """
+    Ответ на GET/HEAD файла: 304 по If-None-Match, 206 по Range (с учётом If-Range), 416, иначе 200.
+    etag — в кавычках ("sha256"). accel_redirect — внутренний URI nginx (X-Accel-Redirect): Range и
+    sendfile тогда выполняет nginx, backend отдаёт только заголовки.
+    """
+    headers = {
+        "etag": etag,
+        "cache-control": CACHE_CONTROL_IMMUTABLE,
+        "content-disposition": content_disposition(filename, media_type, download),
+        "x-content-type-options": "nosniff",
+        "accept-ranges": "bytes",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={k: headers[k] for k in ("etag", "cache-control")})
+    if accel_redirect:
+        headers["x-accel-redirect"] = accel_redirect
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    size = os.stat(path).st_size
+    if_range = request.headers.get("if-range")
+    range_header = request.headers.get("range")
+    if if_range and if_range.strip() != etag:
+        range_header = None  # файл «изменился» относительно копии клиента — весь файл
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+    if byte_range is not None and byte_range != (0, size - 1):
+        return FileRangeResponse(path, byte_range[0], byte_range[1], size, headers, media_type)
+    # FileResponse сам выставит content-length / last-modified; ETag — наш (хэш содержимого)
+    return FileResponse(path, headers=headers, media_type=media_type)
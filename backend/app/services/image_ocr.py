@@ -0,0 +1,260 @@
+"""
+OCR фотографий и изображений: предобработка + адаптивный выбор режима tesseract.
+
+Телефонное фото шильдика (4000×3000, повёрнуто, неравномерный свет) раньше целиком уходило
+в tesseract: медленно и с ошибками в серийных номерах. Теперь (только Pillow):
+1. EXIF-поворот, оттенки серого, масштаб к IMAGE_OCR_TARGET_DPI (длинная сторона
+   в пределах IMAGE_OCR_MIN_SIDE..IMAGE_OCR_MAX_SIDE);
+2. OSD tesseract (на уменьшенной копии): поворот на 90/180/270 и письменность —
+   латиница распознаётся только eng (быстрее, точнее для серийных номеров), иначе rus+eng;
+3. выравнивание наклона (±DESKEW_MAX_ANGLE°) по дисперсии горизонтальной проекции;
+4. быстрый путь: бинаризация по локальному фону (порог Оцу), поиск строк текста по
+   проекциям, OCR только вырезанных блоков (--psm 6); фон фото в tesseract не попадает;
+5. если быстрый путь дал мало символов — всё изображение: --psm 3 для документа/скриншота,
+   --psm 11 (разреженный текст) для фото; берётся более полный результат.
+"""
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+IMAGE_OCR_TARGET_DPI = 300
+# Длинная сторона после масштабирования (px): больше — дольше без прироста качества, меньше — мелкий текст теряется
+IMAGE_OCR_MAX_SIDE = 2200
+IMAGE_OCR_MIN_SIDE = 1000
+# Копия для анализа (OSD, наклон, поиск строк)
+ANALYSIS_SIDE = 800
+DESKEW_MAX_ANGLE = 10
+# Быстрый путь — если блоков не больше (иначе это документ); принимается, если распознано столько букв/цифр
+IMAGE_OCR_MAX_REGIONS = 6
+FAST_PATH_MIN_ALNUM = 12
+# Блоки покрывают больше этой доли изображения — вырезать нечего, сразу полный проход
+REGIONS_MAX_COVERAGE = 0.7
+# Строка пикселей — текст, если переходов чернила/фон на пиксель не меньше (и в 2.5 раза больше медианы)
+ROW_TRANSITIONS_MIN = 0.025
+DEFAULT_LANG = "rus+eng"
+OSD_SCRIPT_LANGS = {"Latin": "eng", "Cyrillic": "rus+eng"}
+
+Box = Tuple[int, int, int, int]
+
+
+def load_for_ocr(data: bytes) -> Image.Image:
+    """Открывает изображение: EXIF-поворот, оттенки серого, масштаб к целевому DPI."""
+    img = Image.open(BytesIO(data))
+    dpi = img.info.get("dpi")
+    target = float(max(img.size))
+    if dpi and dpi[0] and dpi[0] > IMAGE_OCR_TARGET_DPI:
+        target *= IMAGE_OCR_TARGET_DPI / float(dpi[0])
+    target = min(max(target, IMAGE_OCR_MIN_SIDE), IMAGE_OCR_MAX_SIDE)
+    if img.format == "JPEG" and target < max(img.size):
+        # libjpeg декодирует сразу в 1/2, 1/4, 1/8 — фото 4000×3000 не распаковывается целиком
+        ratio = target / max(img.size)
+        img.draft("L", (round(img.width * ratio), round(img.height * ratio)))
+    img = ImageOps.exif_transpose(img).convert("L")
+    scale = target / max(img.size)
+    if abs(scale - 1.0) > 0.05:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    return img
+
+
+def _shrink(img: Image.Image, side: int) -> Tuple[Image.Image, float]:
+    """Копия с длинной стороной не больше side; Returns: (копия, во сколько раз уменьшена)."""
+    factor = max(img.size) / float(side)
+    if factor <= 1:
+        return img, 1.0
+    return img.resize((max(1, round(img.width / factor)), max(1, round(img.height / factor))), Image.BILINEAR), factor
+
+
+def _otsu_threshold(img: Image.Image) -> int:
+    hist = img.histogram()[:256]
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    sum_bg = weight_bg = 0
+    best, threshold = -1.0, 128
+    for t in range(256):
+        weight_bg += hist[t]
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * hist[t]
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, t
+    return threshold
+
+
+def ink_mask(gray: Image.Image) -> Image.Image:
+    """
+    «Чернила» = 255, фон = 0: отличие от локального фона (размытие) по порогу Оцу.
+    Не зависит от неравномерного освещения и полярности (тёмный текст на светлом и наоборот).
+    """
+    background = gray.filter(ImageFilter.BoxBlur(max(4, max(gray.size) // 40)))
+    contrast = ImageOps.autocontrast(ImageChops.difference(gray, background), cutoff=1)
+    threshold = max(_otsu_threshold(contrast), 32)
+    return contrast.point(lambda p: 255 if p > threshold else 0)
+
+
+def binarize(gray: Image.Image) -> Image.Image:
+    """Чёрный текст на белом — вход tesseract для быстрого пути."""
+    return ImageOps.invert(ink_mask(gray))
+
+
+def _row_profile(ink: Image.Image) -> List[float]:
+    # Ресайз до ширины 1 с BOX — среднее по строке (доля чернил), без numpy
+    return [v / 255.0 for v in ink.resize((1, ink.height), Image.BOX).getdata()]
+
+
+def _column_profile(ink: Image.Image) -> List[float]:
+    return [v / 255.0 for v in ink.resize((ink.width, 1), Image.BOX).getdata()]
+
+
+def _profile_score(ink: Image.Image, angle: float) -> float:
+    rows = _row_profile(ink.rotate(angle, resample=Image.BILINEAR, fillcolor=0) if angle else ink)
+    mean = sum(rows) / len(rows)
+    return sum((r - mean) ** 2 for r in rows)
+
+
+def estimate_skew(ink: Image.Image) -> float:
+    """Угол (°, против часовой), при котором строки текста горизонтальны: максимум дисперсии проекции."""
+    # Грубо — с шагом 1° на вдвое уменьшенной маске, точно — ±0.75° с шагом 0.25°
+    coarse = ink.reduce(2)
+    best = max(range(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + 1), key=lambda a: _profile_score(coarse, a))
+    fine = [best + step / 4.0 for step in range(-3, 4)]
+    return max(fine, key=lambda a: _profile_score(ink, a))
+
+
+def _runs(values: List[float], low: float, high: float, max_gap: int) -> List[Tuple[int, int]]:
+    """Отрезки [start, end) индексов со значением в [low, high], разрывы до max_gap склеиваются."""
+    runs: List[Tuple[int, int]] = []
+    start = last = None
+    for i, v in enumerate(values):
+        if low <= v <= high:
+            if start is None:
+                start = i
+            elif i - last > max_gap + 1:
+                runs.append((start, last + 1))
+                start = i
+            last = i
+    if start is not None:
+        runs.append((start, last + 1))
+    return runs
+
+
+def _transitions(ink: Image.Image, horizontal: bool) -> Image.Image:
+    """255 там, где чернила сменяются фоном по горизонтали (или вертикали)."""
+    shifted = ImageChops.offset(ink, 1, 0) if horizontal else ImageChops.offset(ink, 0, 1)
+    return ImageChops.difference(ink, shifted)
+
+
+def text_regions(ink: Image.Image) -> List[Box]:
+    """
+    Блоки текста на маске чернил. Строка текста — много переходов чернила/фон вдоль строки пикселей
+    (рамки, края фото и заливки дают единицы); границы строки — по столбцам с вертикальными
+    переходами; близкие строки склеиваются в блоки. Координаты — в системе ink.
+    """
+    width, height = ink.size
+    rows = _row_profile(_transitions(ink, horizontal=True))
+    threshold = max(ROW_TRANSITIONS_MIN, 2.5 * sorted(rows)[len(rows) // 2])
+    vertical = _transitions(ink, horizontal=False)
+    lines: List[Box] = []
+    for top, bottom in _runs(rows, threshold, 1.0, max_gap=1):
+        line_height = bottom - top
+        if line_height < 4 or line_height > height // 3:
+            continue  # шум или крупная графика
+        columns = _column_profile(vertical.crop((0, top, width, bottom)))
+        for left, right in _runs(columns, 1.5 / line_height, 1.0, max_gap=line_height * 2):
+            if right - left >= 1.5 * line_height:  # хотя бы пара символов
+                lines.append((left, top, right, bottom))
+
+    blocks: List[Box] = []
+    for box in sorted(lines, key=lambda b: (b[1], b[0])):
+        for i, block in enumerate(blocks):
+            gap = box[1] - block[3]
+            overlap = min(box[2], block[2]) - max(box[0], block[0])
+            if gap <= 2 * (box[3] - box[1]) and overlap > 0:  # межстрочный интервал
+                blocks[i] = (min(block[0], box[0]), block[1], max(block[2], box[2]), max(block[3], box[3]))
+                break
+        else:
+            blocks.append(box)
+    return sorted(blocks, key=lambda b: (b[1], b[0]))
+
+
+def _scale_box(box: Box, factor: float, size: Tuple[int, int], pad: int) -> Box:
+    left, top, right, bottom = box
+    return (
+        max(0, int(left * factor) - pad),
+        max(0, int(top * factor) - pad),
+        min(size[0], int(right * factor) + pad),
+        min(size[1], int(bottom * factor) + pad),
+    )
+
+
+def _alnum(text: str) -> int:
+    return sum(1 for c in text if c.isalnum())
+
+
+def _tesseract(img: Image.Image, lang: str, psm: int) -> str:
+    import pytesseract
+
+    config = f"--psm {psm} --dpi {IMAGE_OCR_TARGET_DPI} -c preserve_interword_spaces=1"
+    return (pytesseract.image_to_string(img, lang=lang, config=config) or "").strip()
+
+
+def detect_orientation(gray: Image.Image) -> Tuple[int, Optional[str]]:
+    """OSD: (поворот по часовой для исправления, язык по письменности); мало текста — (0, None)."""
+    try:
+        import pytesseract
+
+        osd = pytesseract.image_to_osd(gray, output_type=pytesseract.Output.DICT)
+        return int(osd.get("rotate") or 0), OSD_SCRIPT_LANGS.get(osd.get("script"))
+    except Exception:
+        return 0, None
+
+
+def ocr_image(data: bytes, info: Optional[dict] = None) -> str:
+    """Текст изображения (см. описание модуля). info дополняется ocr, ocr_regions."""
+    if info is None:
+        info = {}
+    info["ocr"] = True
+    gray = load_for_ocr(data)
+
+    small, _ = _shrink(gray, ANALYSIS_SIDE)
+    rotate, lang = detect_orientation(small)
+    lang = lang or DEFAULT_LANG
+    if rotate % 360:
+        gray = gray.rotate(-rotate, expand=True, fillcolor=255)
+        small, _ = _shrink(gray, ANALYSIS_SIDE)
+
+    ink = ink_mask(small)
+    angle = estimate_skew(ink)
+    if abs(angle) >= 0.5:
+        gray = gray.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=255)
+        small, _ = _shrink(gray, ANALYSIS_SIDE)
+        ink = ink_mask(small)
+    factor = gray.width / float(small.width)
+
+    regions = text_regions(ink)
+    coverage = sum((b[2] - b[0]) * (b[3] - b[1]) for b in regions) / float(ink.width * ink.height)
+    fast_text = ""
+    if regions and len(regions) <= IMAGE_OCR_MAX_REGIONS and coverage <= REGIONS_MAX_COVERAGE:
+        info["ocr_regions"] = len(regions)
+        binary = binarize(gray)
+        parts = []
+        for box in regions:
+            crop = binary.crop(_scale_box(box, factor, gray.size, pad=int(8 * factor)))
+            text = _tesseract(crop, lang, psm=6)
+            if text:
+                parts.append(text)
+        fast_text = "\n".join(parts)
+        if _alnum(fast_text) >= FAST_PATH_MIN_ALNUM:
+            return fast_text
+
+    # Документ/скриншот (строки на большей части высоты) — авторазметка, фото — разреженный текст
+    text_rows = sum(b[3] - b[1] for b in regions)
+    psm = 3 if text_rows > 0.4 * ink.height else 11
+    full_text = _tesseract(gray, lang, psm=psm)
+    return full_text if _alnum(full_text) >= _alnum(fast_text) else fast_text
@@ -0,0 +1,298 @@
+"""
+Долгоживущая IMAP-сессия с IDLE (RFC 2177) вместо переподключения каждые 30 с.
+
+Один поток держит соединение (TLS + LOGIN + SELECT один раз) и ждёт push от сервера:
+- IDLE: сервер сообщает `* N EXISTS` — письмо становится тикетом за 1–2 с;
+  IDLE переоткрывается каждые IMAP_IDLE_RENEW_SECONDS (NAT/серверные таймауты), затем NOOP;
+- сервер без IDLE (или IMAP_IDLE=false): NOOP + проверка каждые IMAP_POLL_INTERVAL_SECONDS
+  на том же соединении;
+- обрыв: переподключение с экспоненциальным backoff (до IMAP_RECONNECT_MAX_SECONDS).
+Ручная синхронизация (админка, cron) идёт через это же соединение: sync_now() прерывает IDLE.
+Слушатель — на каждую пару (ящик, папка) из IMAP_MAILBOXES / IMAP_* (см. mailboxes).
+"""
+import imaplib
+import re
+import select
+import ssl
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.services.email_adapters import ImapEmailFetcher
+from app.services.mailboxes import MailboxConfig, load_mailbox_configs
+
+# Таймаут сокета на обычные команды (FETCH/STORE); IDLE ждёт через select, без таймаута
+COMMAND_TIMEOUT_SEC = 60
+# Шаг опроса флагов stop/wake во время IDLE
+IDLE_TICK_SEC = 1.0
+# Задержка перед первым подключением после старта сервера
+STARTUP_DELAY_SEC = 5
+# Сколько sync_now ждёт цикла слушателя
+SYNC_WAIT_SEC = 60
+
+_NEW_MAIL_RE = re.compile(rb"^\* \d+ (EXISTS|RECENT)", re.IGNORECASE)
+
+
+class ImapSessionError(Exception):
+    """Соединение потеряно или сервер ответил не по протоколу — нужен reconnect."""
+
+
+def _has_buffered_data(mail) -> bool:
+    """
+    Есть ли непрочитанные данные в буфере mail.file (imaplib читает сокет блоками): строка
+    `* N EXISTS`, пришедшая одним сегментом с `+ idling`, лежит там, а select() её не видит.
+    peek() без блокировки — сокет на время проверки переводится в non-blocking.
+    """
+    sock = mail.sock
+    prev_timeout = sock.gettimeout()
+    sock.settimeout(0.0)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(prev_timeout)
+
+
+class ImapSession:
+    """Одно постоянное соединение с папкой: connect / idle / noop / close."""
+
+    def __init__(self, fetcher: ImapEmailFetcher):
+        self.fetcher = fetcher
+        self.mail: Optional[imaplib.IMAP4] = None
+        self._capabilities: set = set()
+
+    @property
+    def idle_supported(self) -> bool:
+        return self.mail is not None and "IDLE" in self._capabilities
+
+    def connect(self) -> None:
+        self.close()
+        self.mail = self.fetcher.connect(timeout=COMMAND_TIMEOUT_SEC)
+        # Часть серверов объявляет IDLE только после LOGIN
+        self._capabilities = set(self.mail.capabilities)
+        typ, data = self.mail.capability()
+        if typ == "OK" and data and data[-1]:
+            self._capabilities |= set(data[-1].decode(errors="replace").upper().split())
+
+    def close(self) -> None:
+        if self.mail is None:
+            return
+        try:
+            self.mail.logout()
+        except Exception:
+            pass
+        self.mail = None
+
+    def noop(self) -> None:
+        """Keepalive + получение накопившихся untagged-ответов."""
+        status, _ = self.mail.noop()
+        if status != "OK":
+            raise ImapSessionError(f"NOOP: {status}")
+
+    def idle(self, timeout: float, interrupted) -> bool:
+        """
+        IDLE до нового письма, timeout или interrupted() == True.
+        Returns: True — сервер сообщил о новых письмах.
+        """
+        mail = self.mail
+        tag = mail._new_tag()
+        mail.send(tag + b" IDLE\r\n")
+        line = mail.readline()
+        if not line.startswith(b"+"):
+            mail.tagged_commands.pop(tag, None)
+            raise ImapSessionError(f"IDLE отклонён: {line[:100]!r}")
+
+        new_mail = False
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not interrupted():
+            if not _has_buffered_data(mail):
+                # Ждём данные без таймаута на сокете (иначе makefile() становится невалидным)
+                readable, _, _ = select.select([mail.sock], [], [], IDLE_TICK_SEC)
+                pending = getattr(mail.sock, "pending", None)  # SSL: данные уже расшифрованы в буфере
+                if not readable and not (pending and pending()):
+                    continue
+            line = mail.readline()
+            if not line:
+                raise ImapSessionError("Сервер закрыл соединение во время IDLE")
+            if line.startswith(b"* BYE"):
+                raise ImapSessionError(f"Сервер завершил сессию: {line[:100]!r}")
+            if _NEW_MAIL_RE.match(line):
+                new_mail = True
+                break
+
+        mail.send(b"DONE\r\n")
+        while True:
+            line = mail.readline()
+            if not line:
+                raise ImapSessionError("Сервер закрыл соединение после IDLE")
+            if line.startswith(tag):
+                break
+            if _NEW_MAIL_RE.match(line):
+                new_mail = True
+        mail.tagged_commands.pop(tag, None)
+        if line[len(tag):].split()[:1] != [b"OK"]:
+            raise ImapSessionError(f"IDLE завершён с ошибкой: {line[:100]!r}")
+        return new_mail
+
+
+class ImapIdleListener:
+    """Фоновый поток на одну папку ящика: постоянная сессия + обработка новых писем (EmailProcessor)."""
+
+    def __init__(self, mailbox: MailboxConfig, folder: str):
+        self.mailbox = mailbox
+        self.folder = folder
+        self.label = f"{mailbox.name}/{folder}"
+        self.session = ImapSession(mailbox.fetcher(folder))
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._cond = threading.Condition()
+        self._cycles = 0
+        self._busy = False  # идёт _process (его результат не отвечает на новый sync_now)
+        self._last_results: Optional[List[dict]] = None
+        self.connected = False
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True, name=f"imap-idle-{self.label}")
+        self._thread.start()
+
+    def request_stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self.request_stop()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def sync_now(self, timeout: float = SYNC_WAIT_SEC) -> Optional[List[dict]]:
+        """Прерывает IDLE и ждёт результат проверки. None — слушатель не ответил (проверить напрямую)."""
+        with self._cond:
+            target = self._cycles + (2 if self._busy else 1)
+            self._wake.set()
+            if not self._cond.wait_for(lambda: self._cycles >= target or not self.connected, timeout):
+                return None
+            return self._last_results if self._cycles >= target else None
+
+    def _process(self) -> List[dict]:
+        """Одна проверка почты на текущем соединении."""
+        from app.db import SessionLocal
+        from app.services.email_processor import EmailProcessor, get_sync_lock
+
+        with self._cond:
+            self._busy = True
+            self._wake.clear()
+        db = SessionLocal()
+        try:
+            with get_sync_lock(self.mailbox.name, self.folder):
+                results = EmailProcessor(db, self.mailbox, self.folder).process_new_emails(
+                    mail=self.session.mail, stop=self._stop
+                )
+        finally:
+            db.close()
+            with self._cond:
+                self._busy = False
+        for r in results:
+            if r.get("status") == "ok" and r.get("ticket_id"):
+                action = "продолжение переписки в тикете" if r.get("follow_up") else "создан тикет"
+                print(f"[IMAP IDLE] {self.label}: {action} #{r['ticket_id']}", flush=True)
+        with self._cond:
+            self._cycles += 1
+            self._last_results = results
+            self._cond.notify_all()
+        # process_new_emails не пробрасывает исключения — обрыв соединения видно по результату
+        failed = [r for r in results if r.get("status") == "error" and str(r.get("message", "")).startswith("Ошибка IMAP")]
+        if failed:
+            raise ImapSessionError(failed[0]["message"])
+        return results
+
+    def _set_connected(self, value: bool) -> None:
+        with self._cond:
+            self.connected = value
+            self._cond.notify_all()
+
+    def _loop(self) -> None:
+        settings = get_settings()
+        use_idle = settings.imap_idle
+        renew = max(30, settings.imap_idle_renew_seconds)
+        poll = max(5, settings.imap_poll_interval_seconds)
+        max_backoff = max(5, settings.imap_reconnect_max_seconds)
+        backoff = 1.0
+        consecutive_errors = 0
+
+        self._stop.wait(STARTUP_DELAY_SEC)
+        while not self._stop.is_set():
+            try:
+                if not self.connected:
+                    self.session.connect()
+                    self._set_connected(True)
+                    mode = "IDLE" if use_idle and self.session.idle_supported else f"NOOP каждые {poll}с"
+                    print(f"[IMAP IDLE] {self.label}: подключено к {self.session.fetcher.host} ({mode})", flush=True)
+                    backoff = 1.0
+                    consecutive_errors = 0
+                    self._process()  # письма, пришедшие пока не было соединения
+
+                if use_idle and self.session.idle_supported:
+                    new_mail = self.session.idle(renew, lambda: self._stop.is_set() or self._wake.is_set())
+                    if self._stop.is_set():
+                        break
+                    if new_mail or self._wake.is_set():
+                        self._process()
+                    else:
+                        self.session.noop()
+                else:
+                    self._wake.wait(poll)
+                    if self._stop.is_set():
+                        break
+                    self.session.noop()
+                    self._process()
+            except Exception as e:
+                self._set_connected(False)
+                self.session.close()
+                # Логируем первую ошибку и каждую 10-ю
+                if consecutive_errors == 0 or consecutive_errors % 10 == 0:
+                    print(f"[IMAP IDLE] {self.label}: ошибка ({consecutive_errors + 1}): {e}; переподключение через {backoff:.0f}с", flush=True)
+                consecutive_errors += 1
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, max_backoff)
+
+        self._set_connected(False)
+        self.session.close()
+        print(f"[IMAP IDLE] {self.label}: поток остановлен", flush=True)
+
+
+_listeners: Dict[Tuple[str, str], ImapIdleListener] = {}
+
+
+def get_imap_listener(mailbox_name: str, folder: str) -> Optional[ImapIdleListener]:
+    return _listeners.get((mailbox_name, folder))
+
+
+def start_imap_listeners() -> List[ImapIdleListener]:
+    """Запускает по слушателю на каждую папку каждого настроенного ящика (один раз на процесс)."""
+    configs = load_mailbox_configs()
+    if not configs:
+        print("[IMAP IDLE] IMAP не настроен, слушатели не запущены", flush=True)
+        return []
+    for mailbox in configs:
+        for folder in mailbox.folders:
+            key = (mailbox.name, folder)
+            if key not in _listeners:
+                _listeners[key] = ImapIdleListener(mailbox, folder)
+                _listeners[key].start()
+    print(f"[IMAP IDLE] Слушателей: {len(_listeners)} ({', '.join(l.label for l in _listeners.values())})", flush=True)
+    return list(_listeners.values())
+
+
+def stop_imap_listeners() -> None:
+    listeners = list(_listeners.values())
+    _listeners.clear()
+    for listener in listeners:
+        listener.request_stop()  # сначала сигнал всем, потом ждём каждого
+    for listener in listeners:
+        listener.stop()
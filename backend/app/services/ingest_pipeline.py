@@ -0,0 +1,256 @@
+"""
+Конвейер приёма писем: fetch → тикет → извлечение текста вложений → очередь AI.
+
+Стадии разделены ограниченными очередями, медленная стадия не держит быструю:
+1. fetch — поток MessagePrefetcher читает и разбирает письма из IMAP
+   (очередь до INGEST_QUEUE_SIZE писем);
+2. persist — поток синхронизации папки (EmailProcessor): тикет + файлы вложений,
+   тикет с вложениями получает ai_status=extracting;
+3. extract — общий на процесс пул INGEST_EXTRACT_WORKERS потоков: текст вложений
+   (PDF/OCR, в пуле процессов extraction_service — параллельно, с лимитами времени и памяти)
+   → attachments_text (очередь до INGEST_EXTRACT_QUEUE_SIZE тикетов);
+4. enqueue — задача analyze (продолжение переписки — follow_up) в ai_jobs, дальше AI-воркеры.
+Письма без вложений из persist сразу попадают в очередь AI. Лок папки держится только
+на fetch + persist: OCR большого скана не задерживает тикеты следующих писем.
+Тикеты, оставшиеся в extracting после рестарта, возвращаются в пул на старте; ошибка извлечения
+или зависший тикет (ai_sweeper) — в очередь AI с текстом уже разобранных вложений.
+"""
+import queue
+import threading
+from typing import Iterator, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import Message, Ticket, TicketAttachment
+from app.services.ai_queue import enqueue_ai_job, JOB_ANALYZE, JOB_FOLLOW_UP, PRIORITY_NORMAL
+from app.services.attachment_text import assemble_attachments_text, extract_pending_attachments
+from app.services.email_adapters import RawEmailMessage
+from app.services.extraction_service import stop_extraction_service
+
+# ai_status тикета, ждущего извлечения текста вложений (до постановки в ai_jobs)
+AI_STATUS_EXTRACTING = "extracting"
+# Шаг проверки отмены при ожидании места в очереди (сек)
+QUEUE_POLL_SEC = 0.5
+
+_DONE = object()
+
+
+class MessagePrefetcher:
+    """
+    Стадия fetch: отдельный поток забирает письма из генератора (iter_new_messages),
+    пока предыдущие сохраняются. Итерируется в потоке persist; ошибка IMAP пробрасывается там же.
+    """
+
+    def __init__(self, messages: Iterator[RawEmailMessage], maxsize: int):
+        self._messages = messages
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+        self._cancel = threading.Event()
+        self._error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ingest-fetch")
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._cancel.is_set():
+            try:
+                self._queue.put(item, timeout=QUEUE_POLL_SEC)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        try:
+            for msg in self._messages:
+                if not self._put(msg):
+                    msg.cleanup()
+                    break
+        except Exception as e:
+            self._error = e
+        finally:
+            # Генератор закрывается в своём потоке (logout собственного соединения)
+            self._messages.close()
+            self._put(_DONE)
+
+    def __iter__(self) -> Iterator[RawEmailMessage]:
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield item
+
+    def close(self) -> List[int]:
+        """Останавливает fetch. Returns: UID писем, скачанных, но не обработанных (для отката позиции)."""
+        self._cancel.set()
+        self._thread.join()
+        dropped = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _DONE:
+                if item.uid:
+                    dropped.append(int(item.uid))
+                item.cleanup()
+        return dropped
+
+
+def queue_ticket_for_ai(db: Session, ticket: Ticket, kind: str = JOB_ANALYZE) -> None:
+    """Последняя стадия: ai_status=pending + задача kind (без ключа OpenAI — сразу done)."""
+    ticket.ai_status = "pending"
+    ticket.ai_error = None
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+
+    # AI analizi kalıcı kuyruğa (ai_jobs) — sabit worker havuzu işler, restart'ta kaybolmaz
+    if get_settings().openai_api_key:
+        enqueue_ai_job(db, ticket.id, kind=kind, priority=PRIORITY_NORMAL)
+        print(f"[Ingest] Тикет #{ticket.id}: AI анализ ({kind}) поставлен в очередь")
+    else:
+        ticket.ai_status = "done"
+        try:
+            db.commit()
+        except Exception:
+            db.rollback()
+
+
+def queue_with_available_text(db: Session, ticket: Ticket, kind: str = JOB_ANALYZE) -> None:
+    """Извлечение не завершилось (ошибка, зависло): AI-анализ с текстом уже разобранных вложений."""
+    atts = db.query(TicketAttachment).filter(TicketAttachment.ticket_id == ticket.id).all()
+    ticket.attachments_text = assemble_attachments_text(atts)
+    queue_ticket_for_ai(db, ticket, kind)
+
+
+def follow_up_ticket_ids(db: Session, ticket_ids: List[int]) -> Set[int]:
+    """Тикеты с продолжениями переписки (входящие сообщения) — для них анализ инкрементальный (follow_up)."""
+    if not ticket_ids:
+        return set()
+    return {row[0] for row in db.query(Message.ticket_id).filter(
+        Message.ticket_id.in_(ticket_ids), Message.direction == "inbound").distinct().all()}
+
+
+def extract_ticket_attachments(ticket_id: int, kind: str = JOB_ANALYZE, stop: Optional[threading.Event] = None) -> None:
+    """Стадия extract для одного тикета: текст вложений (параллельно, в процессах) → строки вложений и attachments_text → очередь AI."""
+    from app.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+        if ticket is None or ticket.ai_status != AI_STATUS_EXTRACTING:
+            return  # уже обработан (повтор после рестарта)
+        atts = db.query(TicketAttachment).filter(TicketAttachment.ticket_id == ticket_id).order_by(TicketAttachment.id).all()
+        if extract_pending_attachments(atts, stop) is None:
+            # Остановка: разобранные вложения сохраняются, тикет остаётся в extracting и вернётся в пул на старте
+            db.commit()
+            return
+        ticket.attachments_text = assemble_attachments_text(atts)
+        queue_ticket_for_ai(db, ticket, kind)
+    except Exception as e:
+        db.rollback()
+        print(f"[Ingest] Тикет #{ticket_id}: ошибка стадии извлечения: {e}")
+        # Тикет не остаётся в extracting без задачи AI — анализ с тем, что успели разобрать
+        try:
+            ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
+            if ticket is not None and ticket.ai_status == AI_STATUS_EXTRACTING:
+                queue_with_available_text(db, ticket, kind)
+        except Exception as e2:
+            db.rollback()
+            print(f"[Ingest] Тикет #{ticket_id}: не удалось поставить в очередь AI: {e2}")
+    finally:
+        db.close()
+
+
+class ExtractionPool:
+    """Фиксированный пул потоков стадии extract с ограниченной очередью тикетов."""
+
+    def __init__(self, size: int, queue_size: int):
+        self.size = max(1, size)
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.size):
+            t = threading.Thread(target=self._loop, daemon=True, name=f"ingest-extract-{i}")
+            t.start()
+            self._threads.append(t)
+        print(f"[Ingest] Потоков извлечения вложений: {self.size}", flush=True)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        # Тикеты из очереди останутся в extracting и вернутся в пул при следующем старте
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads = []
+
+    def submit(self, ticket_id: int, stop: Optional[threading.Event] = None, kind: str = JOB_ANALYZE) -> bool:
+        """Блокирует, пока очередь полна (backpressure на persist). False — остановка."""
+        while not self._stop.is_set() and not (stop is not None and stop.is_set()):
+            try:
+                self._queue.put((ticket_id, kind), timeout=QUEUE_POLL_SEC)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                ticket_id, kind = self._queue.get(timeout=QUEUE_POLL_SEC)
+            except queue.Empty:
+                continue
+            extract_ticket_attachments(ticket_id, kind, self._stop)
+
+
+_pool: Optional[ExtractionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_extraction_pool() -> ExtractionPool:
+    """Пул стадии extract (запускается при первом обращении)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            settings = get_settings()
+            _pool = ExtractionPool(settings.ingest_extract_workers, settings.ingest_extract_queue_size)
+            _pool.start()
+        return _pool
+
+
+def _resume_extractions() -> None:
+    from app.db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        ids = [row[0] for row in db.query(Ticket.id).filter(Ticket.ai_status == AI_STATUS_EXTRACTING).order_by(Ticket.id).all()]
+        threaded = follow_up_ticket_ids(db, ids)
+    finally:
+        db.close()
+    if ids:
+        print(f"[Ingest] Возобновлено извлечение вложений: {len(ids)} тикетов", flush=True)
+    pool = get_extraction_pool()
+    for ticket_id in ids:
+        if not pool.submit(ticket_id, kind=JOB_FOLLOW_UP if ticket_id in threaded else JOB_ANALYZE):
+            break
+
+
+def start_ingest_pipeline() -> None:
+    """Старт пула extract + тикеты, застрявшие в extracting (процесс упал посреди OCR)."""
+    get_extraction_pool()
+    threading.Thread(target=_resume_extractions, daemon=True, name="ingest-resume").start()
+
+
+def stop_ingest_pipeline() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.stop()
+            _pool = None
+    stop_extraction_service()
@@ -64,6 +64,12 @@ class KBSearchService:
 
     def __init__(self, db: Session):
         self.db = db
+        self._articles = None  # кэш статей после preload() (массовая обработка)
+
+    def preload(self) -> None:
+        """Загружает статьи один раз — для batch-анализа тысяч тикетов без повторных запросов."""
+        from app.models import KbArticle
+        self._articles = self.db.query(KbArticle).filter(KbArticle.content.isnot(None)).all()
 
     def search(self, query: str, top_k: int = 3) -> List[KBSearchResult]:
         """
@@ -79,9 +85,12 @@ class KBSearchService:
         from app.models import KbArticle
 
         # Получаем все статьи
-        articles = self.db.query(KbArticle).filter(
-            KbArticle.content.isnot(None)
-        ).all()
+        if self._articles is not None:
+            articles = self._articles
+        else:
+            articles = self.db.query(KbArticle).filter(
+                KbArticle.content.isnot(None)
+            ).all()
 
         if not articles:
             return []
@@ -126,8 +135,10 @@ class KBSearchService:
         Returns:
             Форматированный текст для вставки в промпт
         """
-        results = self.search(query, top_k)
+        return self.format_context_for_llm(self.search(query, top_k))
 
+    def format_context_for_llm(self, results: List[KBSearchResult]) -> str:
+        """Форматирует уже найденные статьи в контекст для LLM."""
         if not results:
             return ""
 
@@ -254,6 +265,25 @@ class HistorySearchService:
     def __init__(self, db: Session):
         self.db = db
         self.kb_service = KBSearchService(db)
+        self._tickets = None  # кэш истории после preload() (без фильтра категории)
+
+    def preload(self) -> None:
+        """Загружает последние отвеченные тикеты один раз — для batch-анализа."""
+        from app.models import Ticket
+        self._tickets = self._history_query(None).order_by(Ticket.id.desc()).limit(500).all()
+
+    def _history_query(self, category: Optional[str]):
+        from app.models import Ticket
+
+        # Ищем только завершённые тикеты с хорошими ответами
+        q = self.db.query(Ticket).filter(
+            Ticket.reply_sent == 1,  # Ответ был отправлен
+            Ticket.ai_reply.isnot(None),  # Есть AI ответ
+            Ticket.ai_reply != "",
+        )
+        if category:
+            q = q.filter(Ticket.request_category == category)
+        return q
 
     def search_similar_tickets(
         self,
@@ -274,20 +304,11 @@ class HistorySearchService:
         """
         from app.models import Ticket
 
-        # Ищем только завершённые тикеты с хорошими ответами
-        tickets_query = self.db.query(Ticket).filter(
-            Ticket.reply_sent == 1,  # Ответ был отправлен
-            Ticket.ai_reply.isnot(None),  # Есть AI ответ
-            Ticket.ai_reply != "",
-        )
-
-        if category:
-            tickets_query = tickets_query.filter(
-                Ticket.request_category == category
-            )
-
         # Берём последние 500 для эффективности
-        tickets = tickets_query.order_by(Ticket.id.desc()).limit(500).all()
+        if self._tickets is not None and not category:
+            tickets = self._tickets
+        else:
+            tickets = self._history_query(category).order_by(Ticket.id.desc()).limit(500).all()
 
         if not tickets:
             return []
@@ -357,8 +378,10 @@ class HistorySearchService:
         """
         Формирует контекст из истории обращений для LLM.
         """
-        results = self.search_similar_tickets(query, category, top_k)
+        return self.format_history_context_for_llm(self.search_similar_tickets(query, category, top_k))
 
+    def format_history_context_for_llm(self, results: List[HistorySearchResult]) -> str:
+        """Форматирует уже найденные похожие обращения в контекст для LLM."""
         if not results:
             return ""
 
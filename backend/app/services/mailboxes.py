@@ -0,0 +1,122 @@
+"""
+Конфигурация почтовых ящиков для приёма писем (несколько региональных адресов в одном backend).
+
+IMAP_MAILBOXES — JSON-список ящиков:
+    [{"name": "msk", "host": "imap.yandex.ru", "user": "msk@eris.ru", "pass": "...",
+      "folders": ["INBOX", "Support"], "rate_per_minute": 60}]
+port (993), folders (["INBOX"]) и rate_per_minute (IMAP_RATE_PER_MINUTE) необязательны.
+Одиночный ящик из IMAP_HOST/IMAP_USER/IMAP_PASS (+ IMAP_FOLDERS) добавляется, если задан.
+На каждую пару (ящик, папка) — свой IMAP-слушатель, позиция синхронизации и backoff;
+лимит писем в минуту — общий на ящик (все его папки).
+"""
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from app.config import get_settings
+from app.services.email_adapters import ImapEmailFetcher
+from app.services.rate_limiter import TokenBucket
+
+
+@dataclass
+class MailboxConfig:
+    name: str
+    host: str
+    user: str
+    password: str
+    port: int = 993
+    folders: List[str] = field(default_factory=lambda: ["INBOX"])
+    rate_per_minute: int = 0  # 0 — без ограничения
+
+    def fetcher(self, folder: str) -> ImapEmailFetcher:
+        return ImapEmailFetcher(host=self.host, port=self.port, user=self.user, password=self.password, folder=folder)
+
+
+def _split_folders(value) -> List[str]:
+    if isinstance(value, str):
+        value = value.split(",")
+    folders = [str(f).strip() for f in (value or []) if str(f).strip()]
+    return folders or ["INBOX"]
+
+
+def load_mailbox_configs() -> List[MailboxConfig]:
+    """Все настроенные ящики (IMAP_MAILBOXES + одиночный IMAP_*). Ошибочные записи пропускаются с логом."""
+    settings = get_settings()
+    default_rate = max(0, settings.imap_rate_per_minute)
+    configs: List[MailboxConfig] = []
+
+    if settings.imap_host and settings.imap_user and settings.imap_pass:
+        configs.append(MailboxConfig(
+            name=settings.imap_user,
+            host=settings.imap_host,
+            port=settings.imap_port or 993,
+            user=settings.imap_user,
+            password=settings.imap_pass,
+            folders=_split_folders(settings.imap_folders),
+            rate_per_minute=default_rate,
+        ))
+
+    raw = (settings.imap_mailboxes or "").strip()
+    if raw:
+        try:
+            entries = json.loads(raw)
+        except json.JSONDecodeError as e:
+            print(f"[Mailboxes] IMAP_MAILBOXES: некорректный JSON — {e}", flush=True)
+            entries = []
+        for i, entry in enumerate(entries if isinstance(entries, list) else []):
+            try:
+                configs.append(MailboxConfig(
+                    name=str(entry.get("name") or entry["user"]),
+                    host=entry["host"],
+                    port=int(entry.get("port") or 993),
+                    user=entry["user"],
+                    password=entry.get("pass") or entry.get("password") or "",
+                    folders=_split_folders(entry.get("folders")),
+                    rate_per_minute=int(entry.get("rate_per_minute", default_rate) or 0),
+                ))
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                print(f"[Mailboxes] IMAP_MAILBOXES[{i}] пропущен: {e}", flush=True)
+
+    # Один и тот же ящик дважды (IMAP_* и в списке) — оставляем первый
+    unique: Dict[tuple, MailboxConfig] = {}
+    for cfg in configs:
+        unique.setdefault((cfg.user.lower(), cfg.host.lower()), cfg)
+    return list(unique.values())
+
+
+class MailboxRateLimiter:
+    """Писем в минуту на ящик: блокирует поток слушателя, другие ящики не ждут."""
+
+    def __init__(self, per_minute: int):
+        self.bucket = TokenBucket(per_minute, per_minute / 60.0) if per_minute > 0 else None
+        self._lock = threading.Lock()
+
+    def acquire(self, stop: Optional[threading.Event] = None) -> bool:
+        """False — остановка во время ожидания."""
+        if self.bucket is None:
+            return True
+        while True:
+            with self._lock:
+                wait = self.bucket.wait_time(1, time.monotonic())
+                if wait <= 0:
+                    self.bucket.take(1)
+                    return True
+            if stop is not None:
+                if stop.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+_limiters: Dict[str, MailboxRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_mailbox_rate_limiter(mailbox: MailboxConfig) -> MailboxRateLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(mailbox.name)
+        if limiter is None:
+            limiter = _limiters[mailbox.name] = MailboxRateLimiter(mailbox.rate_per_minute)
+        return limiter
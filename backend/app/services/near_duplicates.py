@@ -0,0 +1,225 @@
+"""
+Почти-дубликаты входящих обращений: одна и та же жалоба на несколько адресов поддержки
+или повторная отправка через несколько минут.
+
+Отпечаток — 64-битный SimHash темы (без Re:/Fwd:) и текста письма по словам и словесным
+2-/3-граммам; письма, отличающиеся подписью, пересылкой или парой слов, дают отпечатки
+на расстоянии Хэмминга 4–5 бит, разные обращения — от ~15. Поиск — LSH: 64 бита делятся
+на DUPLICATE_BANDS полос по 8 бит, при расстоянии < числа полос хотя бы одна полоса
+совпадает точно (корзины в памяти), кандидаты проверяются точным расстоянием.
+
+Индекс в памяти хранит только тикеты за DUPLICATE_WINDOW_MINUTES; источник истины —
+колонка tickets.content_simhash: индекс догружает из БД тикеты новее последнего известного id
+(в т.ч. созданные другим процессом). Дубликат связывается с оригиналом (duplicate_of_id)
+и не проходит LLM-анализ и Telegram-алерт: результаты анализа копируются с оригинала.
+"""
+import hashlib
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models import Ticket
+
+SIMHASH_BITS = 64
+DUPLICATE_BANDS = 8
+_BAND_BITS = SIMHASH_BITS // DUPLICATE_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+# Короче — отпечаток не строится ("Спасибо!" не должен склеивать разные тикеты)
+MIN_TOKENS = 8
+# Признаки — n-граммы слов длиной 1..SHINGLE_SIZE
+SHINGLE_SIZE = 3
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Поля анализа, которые дубликат получает от оригинала
+_SHARED_AI_FIELDS = (
+    "ai_category", "ai_reply", "serial_numbers", "device_type", "sentiment",
+    "issue_summary", "request_category", "operator_required", "operator_reason",
+)
+# Поля об отправителе — только если дубликат от того же адреса
+_SENDER_AI_FIELDS = ("sender_full_name", "object_name", "sender_phone")
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def compute_simhash(subject: Optional[str], body: Optional[str]) -> Optional[int]:
+    """SimHash (беззнаковый, 64 бита) темы + текста; None — текст слишком короткий."""
+    from app.services.email_threads import normalize_subject
+
+    tokens = _TOKEN_RE.findall(f"{normalize_subject(subject)[0]}\n{(body or '').lower()}")
+    if len(tokens) < MIN_TOKENS:
+        return None
+    weights: Dict[str, int] = {}
+    for n in range(1, SHINGLE_SIZE + 1):
+        for i in range(len(tokens) - n + 1):
+            shingle = " ".join(tokens[i:i + n])
+            weights[shingle] = weights.get(shingle, 0) + 1
+
+    vector = [0] * SIMHASH_BITS
+    for feature, weight in weights.items():
+        h = _feature_hash(feature)
+        for bit in range(SIMHASH_BITS):
+            vector[bit] += weight if (h >> bit) & 1 else -weight
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if vector[bit] > 0)
+
+
+def to_signed(fingerprint: int) -> int:
+    """Беззнаковый отпечаток -> значение для BIGINT."""
+    return fingerprint - (1 << SIMHASH_BITS) if fingerprint >= 1 << (SIMHASH_BITS - 1) else fingerprint
+
+
+def to_unsigned(value: int) -> int:
+    return value & ((1 << SIMHASH_BITS) - 1)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(fingerprint: int) -> List[int]:
+    return [(fingerprint >> (i * _BAND_BITS)) & _BAND_MASK for i in range(DUPLICATE_BANDS)]
+
+
+class NearDuplicateIndex:
+    """LSH-корзины отпечатков тикетов за окно. Потокобезопасен (слушатели разных папок)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # ticket_id -> (отпечаток, время создания, id оригинала цепочки)
+        self._entries: Dict[int, Tuple[int, datetime, int]] = {}
+        self._buckets: List[Dict[int, Set[int]]] = [{} for _ in range(DUPLICATE_BANDS)]
+        self._max_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _add(self, ticket_id: int, fingerprint: int, created_at: datetime, root_id: int) -> None:
+        if ticket_id in self._entries:
+            return
+        self._entries[ticket_id] = (fingerprint, created_at, root_id)
+        for i, band in enumerate(_bands(fingerprint)):
+            self._buckets[i].setdefault(band, set()).add(ticket_id)
+        self._max_id = max(self._max_id, ticket_id)
+
+    def _prune(self, since: datetime) -> None:
+        for ticket_id in [t for t, (_, created_at, _) in self._entries.items() if created_at < since]:
+            fingerprint = self._entries.pop(ticket_id)[0]
+            for i, band in enumerate(_bands(fingerprint)):
+                bucket = self._buckets[i].get(band)
+                if bucket is not None:
+                    bucket.discard(ticket_id)
+                    if not bucket:
+                        del self._buckets[i][band]
+
+    def _catch_up(self, db: Session, since: datetime) -> None:
+        """Догружает из БД отпечатки тикетов новее последнего известного id."""
+        rows = (
+            db.query(Ticket.id, Ticket.content_simhash, Ticket.created_at, Ticket.duplicate_of_id)
+            .filter(Ticket.id > self._max_id, Ticket.content_simhash.isnot(None), Ticket.created_at >= since)
+            .order_by(Ticket.id)
+            .all()
+        )
+        for ticket_id, value, created_at, duplicate_of_id in rows:
+            self._add(ticket_id, to_unsigned(value), _aware(created_at), duplicate_of_id or ticket_id)
+
+    def find(self, db: Session, fingerprint: int, window_minutes: int, max_distance: int) -> Optional[int]:
+        """Оригинал (корень цепочки дубликатов) ближайшего отпечатка за окно; None — не найден."""
+        since = datetime.now(timezone.utc) - timedelta(minutes=window_minutes)
+        with self._lock:
+            self._prune(since)
+            self._catch_up(db, since)
+            best: Optional[Tuple[int, int]] = None
+            candidates: Set[int] = set()
+            for i, band in enumerate(_bands(fingerprint)):
+                candidates |= self._buckets[i].get(band, set())
+            for ticket_id in candidates:
+                other, _, root_id = self._entries[ticket_id]
+                distance = hamming_distance(fingerprint, other)
+                if distance <= max_distance and (best is None or (distance, root_id) < best):
+                    best = (distance, root_id)
+            return best[1] if best else None
+
+    def add(self, ticket: Ticket) -> None:
+        if ticket.content_simhash is None:
+            return
+        with self._lock:
+            self._add(
+                ticket.id,
+                to_unsigned(ticket.content_simhash),
+                _aware(ticket.created_at) if ticket.created_at else datetime.now(timezone.utc),
+                ticket.duplicate_of_id or ticket.id,
+            )
+
+
+def _aware(value: datetime) -> datetime:
+    # SQLite возвращает naive datetime (UTC)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+_index = NearDuplicateIndex()
+
+
+def find_near_duplicate(db: Session, fingerprint: Optional[int]) -> Optional[int]:
+    """id тикета-оригинала для письма с таким отпечатком (DUPLICATE_WINDOW_MINUTES=0 — выключено)."""
+    settings = get_settings()
+    if fingerprint is None or settings.duplicate_window_minutes <= 0:
+        return None
+    # Расстояние < числа полос — иначе LSH может пропустить пару
+    max_distance = max(0, min(settings.duplicate_max_distance, DUPLICATE_BANDS - 1))
+    return _index.find(db, fingerprint, settings.duplicate_window_minutes, max_distance)
+
+
+def register_fingerprint(ticket: Ticket) -> None:
+    """Тикет сохранён — отпечаток в индекс процесса (остальные процессы догрузят из БД)."""
+    _index.add(ticket)
+
+
+def copy_analysis(original: Ticket, duplicate: Ticket) -> None:
+    """Результаты анализа оригинала -> дубликат (без commit), ai_status=done."""
+    for field in _SHARED_AI_FIELDS:
+        setattr(duplicate, field, getattr(original, field))
+    if (original.sender_email or "").lower() == (duplicate.sender_email or "").lower():
+        for field in _SENDER_AI_FIELDS:
+            if not (getattr(duplicate, field) or "").strip():
+                setattr(duplicate, field, getattr(original, field))
+    duplicate.category_id = original.category_id
+    duplicate.ai_status = "done"
+    duplicate.ai_error = None
+
+
+def share_analysis(db: Session, ticket: Ticket) -> bool:
+    """
+    Дубликат: анализ оригинала, если он уже готов. Иначе тикет ждёт в pending —
+    propagate_to_duplicates скопирует результат, когда оригинал будет проанализирован
+    (оригинал так и не дождался — sweeper поставит обычный анализ). Returns: скопировано ли.
+    """
+    original = db.query(Ticket).filter(Ticket.id == ticket.duplicate_of_id).first()
+    if original is None or original.ai_status != "done":
+        ticket.ai_status = "pending"
+        ticket.ai_error = None
+        db.commit()
+        return False
+    copy_analysis(original, ticket)
+    db.commit()
+    return True
+
+
+def propagate_to_duplicates(db: Session, ticket: Ticket) -> int:
+    """Оригинал проанализирован: его результаты — ждущим дубликатам (с commit). Returns: сколько."""
+    waiting = (
+        db.query(Ticket)
+        .filter(Ticket.duplicate_of_id == ticket.id, Ticket.ai_status == "pending")
+        .all()
+    )
+    for duplicate in waiting:
+        copy_analysis(ticket, duplicate)
+    if waiting:
+        db.commit()
+        print(f"[Duplicates] Тикет #{ticket.id}: анализ скопирован в дубликаты {[d.id for d in waiting]}", flush=True)
+    return len(waiting)
@@ -5,6 +5,7 @@ from typing import Tuple, Dict, Any, Optional, List
 from dataclasses import dataclass
 import json
 from app.config import get_settings
+from app.services.rate_limiter import AiRateLimited, get_llm_rate_limiter, estimate_tokens
 
 
 @dataclass
@@ -103,38 +104,13 @@ def analyze_with_openai(subject: str, body: str, kb_context: str = "") -> Tuple[
     return result.category, result.reply
 
 
-def analyze_eris_email(
-    subject: str,
-    body: str,
-    sender_email: str = "",
-    kb_context: str = "",
-    attachments_summary: str = "",
-    attachments_extracted_text: str = "",
-) -> ErisAnalysisResult:
-    """
-    Полный анализ письма для кейса ЭРИС (газоанализаторы).
-
-    Извлекает:
-    - ФИО отправителя
-    - Название предприятия/объекта
-    - Контактный телефон
-    - Заводские номера приборов
-    - Тип/модель приборов
-    - Эмоциональный окрас
-    - Категорию запроса
-    - Краткое описание проблемы
-    - Ответ на основе базы знаний
-    """
-    settings = get_settings()
-    if not (settings.openai_api_key and settings.openai_api_key.strip()):
-        raise ValueError(
-            "OPENAI_API_KEY bulunamadı. Proje kökündeki .env dosyasını oluşturun; .env.example dosyasından kopyalayıp anahtarınızı yazın."
-        )
+# Параметры генерации (одинаковые для онлайн-вызова и batch)
+ERIS_MAX_TOKENS = 1000
+ERIS_TEMPERATURE = 0.3  # Низкая температура для более точного извлечения
 
-    from openai import OpenAI
-    client = OpenAI(api_key=settings.openai_api_key.strip(), timeout=60.0)
+ERIS_FALLBACK_REPLY = "Благодарим за обращение в службу поддержки ЭРИС. Ваш запрос получен и будет обработан специалистом. Мы свяжемся с вами в ближайшее время."
 
-    system_prompt = """Ты — AI-агент техподдержки компании ООО «ЭРИС» (производитель газоанализаторов и газосигнализаторов).
+ERIS_SYSTEM_PROMPT_TEMPLATE = """Ты — AI-агент техподдержки компании ООО «ЭРИС» (производитель газоанализаторов и газосигнализаторов).
 
 ═══════════════════════════════════════════════════════════════════
 РАЗДЕЛ 1: ЗНАНИЯ ЭРИС
@@ -243,7 +219,7 @@ def analyze_eris_email(
 1. ФИО: ищи в подписи, приветствии ("С уважением, ...", "Иванов И.И.")
 2. Организация: название предприятия, завода, объекта
 3. Телефон: любой номер в тексте (+7, 8-..., и т.д.)
-4. Заводские номера: формат "ЗН: 12345", "№12345", "s/n", могут быть несколько
+4. Заводские номера: формат "ЗН: 12345", "№12345", "s/n", могут быть несколько; из таблиц во вложениях — строка "Заводские номера из таблицы"
 5. Тип прибора: модель (ЭРИС-210, ДГС-ЭРИС-230, IR-G20 и т.д.)
 
 ЭМОЦИОНАЛЬНЫЙ ОКРАС:
@@ -307,6 +283,16 @@ E) Срочность + экзамен/пересдача/сертификат 
 
 operator_required = false: простой информационный вопрос без срочности и рисков"""
 
+
+def build_eris_messages(
+    subject: str,
+    body: str,
+    sender_email: str = "",
+    kb_context: str = "",
+    attachments_summary: str = "",
+    attachments_extracted_text: str = "",
+) -> List[Dict[str, str]]:
+    """Собирает messages (system + user) для chat.completions — общий код для онлайн и batch."""
     # Добавляем контекст из базы знаний если есть
     kb_section = ""
     if kb_context:
@@ -316,16 +302,16 @@ operator_required = false: простой информационный вопр
 
 Используй информацию из базы знаний для формирования ответа."""
 
-    system_prompt = system_prompt.format(kb_section=kb_section)
+    system_prompt = ERIS_SYSTEM_PROMPT_TEMPLATE.format(kb_section=kb_section)
 
     attachment_block = ""
-    if attachments_summary.strip():
+    if (attachments_summary or "").strip():
         attachment_block = f"""
 Список вложений к письму: {attachments_summary}
 """
-        if attachments_extracted_text.strip():
+        if (attachments_extracted_text or "").strip():
             attachment_block += f"""
-Извлечённый текст из вложений (PDF/изображения):
+Извлечённый текст из вложений (PDF/изображения/таблицы):
 {attachments_extracted_text}
 """
         else:
@@ -344,70 +330,28 @@ operator_required = false: простой информационный вопр
 {attachment_block}
 Извлеки все данные и сформируй ответ. Ответь строго в JSON формате."""
 
-    try:
-        resp = client.chat.completions.create(
-            model=settings.openai_model or "gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.3,  # Низкая температура для более точного извлечения
-        )
-        text = (resp.choices[0].message.content or "").strip()
-
-        # Убираем возможные markdown обёртки
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
 
-        # Парсим JSON
-        data = json.loads(text)
-
-        # Валидация категории по whitelist
-        raw = (data.get("category") or "другое").strip().lower().replace("_", " ")
-        category = raw if raw in ALLOWED_CATEGORIES else "другое"
-
-        # Валидация sentiment
-        sentiment = data.get("sentiment", "neutral").lower()
-        if sentiment not in ("positive", "neutral", "negative"):
-            sentiment = "neutral"
 
-        # Оператор требуется
-        op_req = data.get("operator_required") in (True, "true", 1, "1")
-        op_reason = data.get("operator_reason")
-        if isinstance(op_reason, str):
-            op_reason = op_reason.strip() or None
-        else:
-            op_reason = None
-
-        # Формируем результат
-        result = ErisAnalysisResult(
-            sender_full_name=data.get("full_name"),
-            object_name=data.get("object_name"),
-            sender_phone=data.get("phone"),
-            serial_numbers=data.get("serial_numbers") or [],
-            device_type=data.get("device_type"),
-            sentiment=sentiment,
-            request_category=category,
-            issue_summary=data.get("issue_summary"),
-            reply=data.get("reply", ""),
-            category=_map_to_legacy_category(category),
-            operator_required=op_req,
-            operator_reason=op_reason,
-        )
-        _apply_operator_heuristic(subject, body, result)
-
-        print(f"[AI ЭРИС] Категория: {category}, Тональность: {sentiment}")
-        print(f"[AI ЭРИС] ФИО: {result.sender_full_name}, Организация: {result.object_name}")
-        print(f"[AI ЭРИС] Серийные номера: {result.serial_numbers}, Тип прибора: {result.device_type}")
+def parse_eris_response(text: str, subject: str, body: str) -> ErisAnalysisResult:
+    """Разбирает JSON-ответ модели в ErisAnalysisResult (валидация + fallback при битом JSON)."""
+    text = (text or "").strip()
 
-        return result
+    # Убираем возможные markdown обёртки
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    text = text.strip()
 
+    try:
+        # Парсим JSON
+        data = json.loads(text)
     except json.JSONDecodeError as e:
         print(f"[AI ЭРИС] Ошибка парсинга JSON: {e}")
         print(f"[AI ЭРИС] Сырой ответ: {text[:500]}")
@@ -415,15 +359,181 @@ operator_required = false: простой информационный вопр
             sentiment="neutral",
             request_category="другое",
             category="other",
-            reply="Благодарим за обращение в службу поддержки ЭРИС. Ваш запрос получен и будет обработан специалистом. Мы свяжемся с вами в ближайшее время.",
+            reply=ERIS_FALLBACK_REPLY,
             operator_required=False,
             operator_reason=None,
         )
         _apply_operator_heuristic(subject, body, fallback)
         return fallback
+
+    # Валидация категории по whitelist
+    raw = (data.get("category") or "другое").strip().lower().replace("_", " ")
+    category = raw if raw in ALLOWED_CATEGORIES else "другое"
+
+    # Валидация sentiment
+    sentiment = (data.get("sentiment") or "neutral").lower()
+    if sentiment not in ("positive", "neutral", "negative"):
+        sentiment = "neutral"
+
+    # Оператор требуется
+    op_req = data.get("operator_required") in (True, "true", 1, "1")
+    op_reason = data.get("operator_reason")
+    if isinstance(op_reason, str):
+        op_reason = op_reason.strip() or None
+    else:
+        op_reason = None
+
+    # Формируем результат
+    result = ErisAnalysisResult(
+        sender_full_name=data.get("full_name"),
+        object_name=data.get("object_name"),
+        sender_phone=data.get("phone"),
+        serial_numbers=data.get("serial_numbers") or [],
+        device_type=data.get("device_type"),
+        sentiment=sentiment,
+        request_category=category,
+        issue_summary=data.get("issue_summary"),
+        reply=data.get("reply", ""),
+        category=_map_to_legacy_category(category),
+        operator_required=op_req,
+        operator_reason=op_reason,
+    )
+    _apply_operator_heuristic(subject, body, result)
+    return result
+
+
+def _retry_after(e) -> Optional[float]:
+    """retry-after из ответа 429 (секунды), если провайдер его прислал."""
+    try:
+        return float(e.response.headers.get("retry-after"))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def analyze_eris_email(
+    subject: str,
+    body: str,
+    sender_email: str = "",
+    kb_context: str = "",
+    attachments_summary: str = "",
+    attachments_extracted_text: str = "",
+) -> ErisAnalysisResult:
+    """
+    Полный анализ письма для кейса ЭРИС (газоанализаторы).
+
+    Извлекает:
+    - ФИО отправителя
+    - Название предприятия/объекта
+    - Контактный телефон
+    - Заводские номера приборов
+    - Тип/модель приборов
+    - Эмоциональный окрас
+    - Категорию запроса
+    - Краткое описание проблемы
+    - Ответ на основе базы знаний
+    """
+    settings = get_settings()
+    if not (settings.openai_api_key and settings.openai_api_key.strip()):
+        raise ValueError(
+            "OPENAI_API_KEY bulunamadı. Proje kökündeki .env dosyasını oluşturun; .env.example dosyasından kopyalayıp anahtarınızı yazın."
+        )
+
+    from openai import OpenAI, RateLimitError
+    client = OpenAI(api_key=settings.openai_api_key.strip(), timeout=60.0)
+
+    messages = build_eris_messages(
+        subject, body, sender_email, kb_context, attachments_summary, attachments_extracted_text
+    )
+
+    # Квота провайдера: ждём бюджет RPM/TPM, иначе — backpressure (тикет остаётся pending)
+    limiter = get_llm_rate_limiter()
+    est_tokens = estimate_tokens(*(m["content"] for m in messages), max_output_tokens=ERIS_MAX_TOKENS)
+    if not limiter.acquire(est_tokens, timeout=settings.ai_rate_limit_wait_seconds):
+        raise AiRateLimited("Локальный лимит LLM (RPM/TPM) исчерпан")
+
+    try:
+        resp = client.chat.completions.create(
+            model=settings.openai_model or "gpt-4o-mini",
+            messages=messages,
+            max_tokens=ERIS_MAX_TOKENS,
+            temperature=ERIS_TEMPERATURE,
+        )
+        limiter.settle(est_tokens, getattr(resp.usage, "total_tokens", None))
+        result = parse_eris_response(resp.choices[0].message.content or "", subject, body)
+
+        print(f"[AI ЭРИС] Категория: {result.request_category}, Тональность: {result.sentiment}")
+        print(f"[AI ЭРИС] ФИО: {result.sender_full_name}, Организация: {result.object_name}")
+        print(f"[AI ЭРИС] Серийные номера: {result.serial_numbers}, Тип прибора: {result.device_type}")
+
+        return result
+
+    except RateLimitError as e:
+        retry_after = _retry_after(e)
+        print(f"[AI ЭРИС] 429 от провайдера, повтор позже (retry-after: {retry_after})")
+        raise AiRateLimited(str(e)[:200], retry_after=retry_after)
+    except Exception as e:
+        print(f"[AI ЭРИС] Ошибка: {e}")
+        raise
+
+
+async def analyze_eris_email_async(
+    subject: str,
+    body: str,
+    sender_email: str = "",
+    kb_context: str = "",
+    attachments_summary: str = "",
+    attachments_extracted_text: str = "",
+    client=None,
+) -> ErisAnalysisResult:
+    """
+    Асинхронный вариант analyze_eris_email (AsyncOpenAI): поток не блокируется на время
+    ответа LLM, на одном event loop — сотни анализов одновременно.
+    client — общий AsyncOpenAI (пул соединений); если не передан, создаётся на один вызов.
+    """
+    settings = get_settings()
+    if not (settings.openai_api_key and settings.openai_api_key.strip()):
+        raise ValueError(
+            "OPENAI_API_KEY bulunamadı. Proje kökündeki .env dosyasını oluşturun; .env.example dosyasından kopyalayıp anahtarınızı yazın."
+        )
+
+    from openai import AsyncOpenAI, RateLimitError
+    own_client = client is None
+    if own_client:
+        client = AsyncOpenAI(api_key=settings.openai_api_key.strip(), timeout=60.0)
+
+    messages = build_eris_messages(
+        subject, body, sender_email, kb_context, attachments_summary, attachments_extracted_text
+    )
+
+    limiter = get_llm_rate_limiter()
+    est_tokens = estimate_tokens(*(m["content"] for m in messages), max_output_tokens=ERIS_MAX_TOKENS)
+    try:
+        if not await limiter.acquire_async(est_tokens, timeout=settings.ai_rate_limit_wait_seconds):
+            raise AiRateLimited("Локальный лимит LLM (RPM/TPM) исчерпан")
+
+        resp = await client.chat.completions.create(
+            model=settings.openai_model or "gpt-4o-mini",
+            messages=messages,
+            max_tokens=ERIS_MAX_TOKENS,
+            temperature=ERIS_TEMPERATURE,
+        )
+        limiter.settle(est_tokens, getattr(resp.usage, "total_tokens", None))
+        result = parse_eris_response(resp.choices[0].message.content or "", subject, body)
+        print(f"[AI ЭРИС] Категория: {result.request_category}, Тональность: {result.sentiment}")
+        return result
+
+    except RateLimitError as e:
+        retry_after = _retry_after(e)
+        print(f"[AI ЭРИС] 429 от провайдера, повтор позже (retry-after: {retry_after})")
+        raise AiRateLimited(str(e)[:200], retry_after=retry_after)
+    except AiRateLimited:
+        raise
     except Exception as e:
         print(f"[AI ЭРИС] Ошибка: {e}")
         raise
+    finally:
+        if own_client:
+            await client.close()
 
 
 def _map_to_legacy_category(eris_category: str) -> str:
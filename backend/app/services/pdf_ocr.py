@@ -0,0 +1,152 @@
+"""
+Постраничный OCR PDF: растеризация по одной странице, параллельное распознавание, ранняя остановка.
+
+Раньше convert_from_bytes растеризовал в память весь документ (100 страниц скана — гигабайты),
+а ограничение числа страниц применялось уже после; страницы распознавались по очереди.
+Теперь:
+- страница растеризуется только перед своим OCR (pdftoppm -f N -l N), в памяти — не больше
+  PDF_OCR_WORKERS изображений;
+- PDF_OCR_WORKERS страниц распознаются одновременно: каждый поток ждёт свой процесс
+  pdftoppm/tesseract, GIL не держит (процессы tesseract — однопоточные, OMP_THREAD_LIMIT=1);
+- страницы собираются по порядку, как только текст достиг EXTRACTED_TEXT_MAX_CHARS,
+  оставшиеся страницы не растеризуются;
+- смешанный PDF: страницы с текстовым слоем берутся как есть, OCR — только страницы без него.
+Выполняется внутри процесса extraction_service: таймаут и лимит памяти — его.
+"""
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional
+
+from app.config import get_settings
+
+# Страница с текстовым слоем короче — считается сканом и распознаётся
+PAGE_TEXT_MIN_CHARS = 20
+PDF_OCR_DPI = 150
+PDF_OCR_LANG = "rus+eng"
+
+
+def _rasterize_page(pdf_path: str, page: int, dpi: int):
+    """Одна страница (нумерация с 1) -> PIL.Image; None — страницы нет."""
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page, last_page=page, grayscale=True)
+    return images[0] if images else None
+
+
+def _ocr_image(image) -> str:
+    import pytesseract
+
+    return pytesseract.image_to_string(image, lang=PDF_OCR_LANG) or ""
+
+
+def _ocr_page(pdf_path: str, page: int, dpi: int) -> str:
+    image = _rasterize_page(pdf_path, page, dpi)
+    if image is None:
+        return ""
+    try:
+        return _ocr_image(image).strip()
+    finally:
+        image.close()
+
+
+def _page_count(pdf_path: str) -> int:
+    try:
+        from pdf2image import pdfinfo_from_path
+
+        return int(pdfinfo_from_path(pdf_path).get("Pages") or 0)
+    except Exception:
+        return 0
+
+
+def needs_ocr(page_text: Optional[str]) -> bool:
+    return len((page_text or "").strip()) < PAGE_TEXT_MIN_CHARS
+
+
+def extract_pdf_pages(
+    data: bytes, page_texts: Optional[List[str]], max_chars: int, info: Optional[dict] = None
+) -> str:
+    """
+    Текст PDF по страницам: текстовый слой, а страницы без него — OCR.
+    page_texts — текст каждой страницы из pypdf; None — pypdf документ не прочитал (OCR всех страниц).
+    Останавливается, когда набрано max_chars символов. info дополняется page_count и ocr.
+    """
+    if info is None:
+        info = {}
+    settings = get_settings()
+    workers = max(1, settings.pdf_ocr_workers)
+    max_ocr_pages = max(0, settings.pdf_ocr_max_pages)
+
+    if page_texts is not None and not any(needs_ocr(t) for t in page_texts):
+        return _join_until(page_texts, max_chars)
+
+    with tempfile.TemporaryDirectory(prefix="pdf-ocr-") as tmp:
+        pdf_path = os.path.join(tmp, "document.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(data)
+        if page_texts is None:
+            page_texts = [""] * _page_count(pdf_path)
+            info["page_count"] = len(page_texts)
+        ocr_pages = [i for i, t in enumerate(page_texts) if needs_ocr(t)][:max_ocr_pages]
+        if not ocr_pages:
+            return _join_until(page_texts, max_chars)
+        info["ocr"] = True
+        if workers > 1:
+            # Несколько tesseract одновременно: каждому — одно ядро
+            os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-ocr")
+        ahead: Deque[int] = deque(ocr_pages)
+        futures: Dict[int, Future] = {}
+
+        def schedule() -> None:
+            # Вперёд — не больше workers страниц (в работе или готовых, но ещё не собранных)
+            while ahead and len(futures) < workers:
+                page = ahead.popleft()
+                futures[page] = executor.submit(_ocr_page, pdf_path, page + 1, PDF_OCR_DPI)
+
+        parts: List[str] = []
+        total = 0
+        try:
+            ocr_set = set(ocr_pages)
+            for i, page_text in enumerate(page_texts):
+                if i in ocr_set:
+                    schedule()
+                    future = futures.pop(i, None)
+                    page_text = ""
+                    if future is not None:
+                        try:
+                            page_text = future.result()
+                        except Exception as e:
+                            # Нет tesseract/poppler или pdftoppm не читает файл — остальные страницы не распознаются
+                            print(f"[OCR] Страница {i + 1}: {e}; OCR остальных страниц пропущен", flush=True)
+                            ahead.clear()
+                            for other in futures.values():
+                                other.cancel()
+                            futures.clear()
+                elif needs_ocr(page_text):
+                    continue  # сверх pdf_ocr_max_pages
+                page_text = (page_text or "").strip()
+                if page_text:
+                    parts.append(page_text)
+                    total += len(page_text)
+                if total >= max_chars:
+                    break
+        finally:
+            # Ранняя остановка / таймаут: не начатые страницы не растеризуются
+            executor.shutdown(wait=False, cancel_futures=True)
+        return "\n\n".join(parts)
+
+
+def _join_until(page_texts: List[str], max_chars: int) -> str:
+    parts: List[str] = []
+    total = 0
+    for text in page_texts:
+        text = (text or "").strip()
+        if text:
+            parts.append(text)
+            total += len(text)
+            if total >= max_chars:
+                break
+    return "\n\n".join(parts)
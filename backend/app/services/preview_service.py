@@ -0,0 +1,315 @@
+"""
+Превью вложений для карточки тикета: WebP до PREVIEW_MAX_PX по большей стороне — уменьшенное
+изображение или первая страница PDF.
+
+Карточка тикета показывала вложения ссылками, и чтобы увидеть фото шильдика, оператор открывал
+оригинал (несколько МБ). Теперь превью строится в фоне: после загрузки / сохранения вложений письма
+id ставятся в очередь, поток раздаёт файлы пулу процессов (PREVIEW_WORKERS — декодирование JPEG и
+растеризация PDF нагружают CPU), результат кладётся в хранилище рядом с оригиналом
+({storage_path}.thumb.webp). Blob хранится по содержимому, поэтому у одинаковых файлов и превью одно.
+При старте в очередь попадают вложения без превью (сохранённые до этого / пока сервер был остановлен);
+запрос ещё не построенного превью ставит его в очередь (request_preview) и не ждёт построения.
+"""
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+from io import BytesIO
+from typing import Iterable, List, Optional, Set, Tuple
+
+from app.config import get_settings
+from app.models import TicketAttachment
+from app.services.attachment_extract import attachment_kind
+from app.services.attachment_storage import get_storage, store_derived_bytes
+
+# preview_status вложения (None — ещё не строилось)
+PREVIEW_DONE = "done"
+PREVIEW_UNSUPPORTED = "unsupported"
+PREVIEW_FAILED = "failed"
+
+PREVIEW_SUFFIX = ".thumb.webp"
+PREVIEW_MEDIA_TYPE = "image/webp"
+PREVIEW_QUALITY = 80
+# Меняется при смене формата превью: входит в ETag
+PREVIEW_VERSION = 1
+# Растеризация страницы PDF (pdftoppm) и ожидание результата из пула
+PREVIEW_TIMEOUT_SEC = 60
+# Через сколько повторить запрос ещё не построенного превью (Retry-After ответа 202)
+PREVIEW_RETRY_AFTER_SEC = 2
+# Вложений за один проход потока и максимум вложений без превью, поднимаемых при старте
+BATCH_SIZE = 16
+BACKLOG_LIMIT = 1000
+MAX_TASKS_PER_CHILD = 100
+
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+
+
+def preview_kind(filename: str, mime_type: str) -> Optional[str]:
+    """"image" / "pdf" — превью строится; None — нет (документы, видео, svg)."""
+    kind = attachment_kind(filename, mime_type)
+    if kind in ("image", "pdf"):
+        return kind
+    mime = (mime_type or "").lower()
+    if (mime.startswith("image/") and "svg" not in mime) or (filename or "").lower().endswith(_IMAGE_EXTENSIONS):
+        return "image"
+    return None
+
+
+def preview_key(storage_path: str) -> str:
+    return storage_path + PREVIEW_SUFFIX
+
+
+def render_preview(path: str, kind: str, max_px: int) -> bytes:
+    """Выполняется в процессе пула: файл -> WebP не больше max_px по большей стороне."""
+    from PIL import Image, ImageOps
+
+    if kind == "pdf":
+        from pdf2image import convert_from_path
+
+        pages = convert_from_path(path, first_page=1, last_page=1, size=max_px, timeout=PREVIEW_TIMEOUT_SEC)
+        if not pages:
+            raise ValueError("в PDF нет страниц")
+        image = pages[0]
+    else:
+        image = Image.open(path)
+        if image.format == "JPEG":
+            # Декодирование сразу в уменьшенном масштабе (DCT 1/2..1/8): фото 12 Мп — в разы быстрее
+            image.draft("RGB", (max_px * 2, max_px * 2))
+        image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_px, max_px), Image.Resampling.LANCZOS)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = image.mode in ("LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    out = BytesIO()
+    image.save(out, "WEBP", quality=PREVIEW_QUALITY, method=4)
+    return out.getvalue()
+
+
+def _build_preview(att: TicketAttachment, kind: str, storage, render) -> None:
+    """Строит и сохраняет превью одного вложения; render(path) -> bytes. Выставляет preview_status."""
+    key = preview_key(att.storage_path)
+    if storage.exists(key):
+        att.preview_status = PREVIEW_DONE  # тот же файл у другого вложения
+        return
+    with storage.local_copy(att.storage_path) as path:
+        if path is None:
+            att.preview_status = PREVIEW_FAILED
+            return
+        store_derived_bytes(key, render(path), PREVIEW_MEDIA_TYPE)
+    att.preview_status = PREVIEW_DONE
+
+
+def request_preview(att: TicketAttachment) -> Optional[bool]:
+    """
+    Превью для запроса, без построения в нём: True — готово; False — превью нет (формат, ошибка построения);
+    None — ещё не построено, вложение в очереди PreviewService. preview_status обновляется, commit — вызывающего.
+    """
+    if att.preview_status is not None:
+        return att.preview_status == PREVIEW_DONE
+    if preview_kind(att.filename, att.mime_type) is None:
+        att.preview_status = PREVIEW_UNSUPPORTED
+        return False
+    if get_storage().exists(preview_key(att.storage_path)):
+        att.preview_status = PREVIEW_DONE  # тот же файл у другого вложения
+        return True
+    start_preview_service().enqueue([att.id])
+    return None
+
+
+class PreviewService:
+    """Очередь id вложений + поток, раздающий построение превью пулу процессов."""
+
+    def __init__(self, workers: int, max_px: int):
+        self.workers = workers
+        self.max_px = max(32, max_px)
+        self.queue: "queue.Queue[int]" = queue.Queue()
+        # id в очереди / в работе: повторные запросы превью не ставят вложение в очередь ещё раз
+        self._pending: Set[int] = set()
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="preview-worker")
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def enqueue(self, attachment_ids: Iterable[int]) -> None:
+        with self._pending_lock:
+            for attachment_id in attachment_ids:
+                if attachment_id not in self._pending:
+                    self._pending.add(attachment_id)
+                    self.queue.put(attachment_id)
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None  # в потоке очереди
+        if self._executor is None:
+            methods = multiprocessing.get_all_start_methods()
+            # fork из многопоточного сервера небезопасен
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=ctx, max_tasks_per_child=MAX_TASKS_PER_CHILD
+            )
+        return self._executor
+
+    def _enqueue_backlog(self) -> None:
+        from app.db import SessionLocal
+
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(TicketAttachment.id)
+                .filter(TicketAttachment.preview_status.is_(None))
+                .order_by(TicketAttachment.id.desc())
+                .limit(BACKLOG_LIMIT)
+                .all()
+            )
+            self.enqueue(row[0] for row in rows)
+            if rows:
+                print(f"[Preview] В очереди вложений без превью: {len(rows)}", flush=True)
+        except Exception as e:
+            print(f"[Preview] Не удалось прочитать вложения без превью: {e}", flush=True)
+        finally:
+            db.close()
+
+    def _next_batch(self) -> List[int]:
+        try:
+            batch = [self.queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        self._enqueue_backlog()
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self.process(batch)
+            except Exception as e:
+                print(f"[Preview] Ошибка: {e}", flush=True)
+            finally:
+                with self._pending_lock:
+                    self._pending.difference_update(batch)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _store_result(self, att: TicketAttachment, key: str, future: Future, executor: ProcessPoolExecutor) -> bool:
+        """
+        Результат пула -> хранилище. True — превью построено; False — ошибка (PREVIEW_FAILED) или
+        упал процесс пула (статус не меняется, пул пересоздаётся).
+        """
+        try:
+            store_derived_bytes(key, future.result(timeout=PREVIEW_TIMEOUT_SEC * 2), PREVIEW_MEDIA_TYPE)
+            att.preview_status = PREVIEW_DONE
+            return True
+        except BrokenProcessPool:
+            if self._executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+        except Exception as e:
+            print(f"[Preview] {att.filename}: {e}", flush=True)
+            att.preview_status = PREVIEW_FAILED
+        return False
+
+    def process(self, attachment_ids: List[int]) -> int:
+        """Строит превью вложений без него. Returns: сколько построено."""
+        from app.db import SessionLocal
+
+        storage = get_storage()
+        executor = self._get_executor()
+        built = 0
+        db = SessionLocal()
+        try:
+            atts = (
+                db.query(TicketAttachment)
+                .filter(TicketAttachment.id.in_(attachment_ids), TicketAttachment.preview_status.is_(None))
+                .all()
+            )
+            jobs: List[Tuple[TicketAttachment, str, str, str, Future]] = []
+            # Файлы нужны на диске, пока пул их читает (S3 — временные копии)
+            with ExitStack() as files:
+                for att in atts:
+                    kind = preview_kind(att.filename, att.mime_type)
+                    key = preview_key(att.storage_path)
+                    if kind is None:
+                        att.preview_status = PREVIEW_UNSUPPORTED
+                    elif storage.exists(key):
+                        att.preview_status = PREVIEW_DONE
+                    elif executor is None:
+                        try:
+                            _build_preview(att, kind, storage, lambda path: render_preview(path, kind, self.max_px))
+                            built += att.preview_status == PREVIEW_DONE
+                        except Exception as e:
+                            print(f"[Preview] {att.filename}: {e}", flush=True)
+                            att.preview_status = PREVIEW_FAILED
+                    else:
+                        path = files.enter_context(storage.local_copy(att.storage_path))
+                        if path is None:
+                            att.preview_status = PREVIEW_FAILED
+                            continue
+                        jobs.append((att, key, path, kind, executor.submit(render_preview, path, kind, self.max_px)))
+                # Процесс пула упал (битый файл, память) — сломаны все задачи пула, не только его
+                broken = []
+                for att, key, path, kind, future in jobs:
+                    if self._store_result(att, key, future, executor):
+                        built += 1
+                    elif att.preview_status is None:
+                        broken.append((att, key, path, kind))
+                if len(broken) == 1:
+                    print(f"[Preview] {broken[0][0].filename}: процесс превью упал", flush=True)
+                    broken[0][0].preview_status = PREVIEW_FAILED
+                else:
+                    # Какой файл уронил процесс, неизвестно — каждый заново, по одному в новом пуле
+                    for att, key, path, kind in broken:
+                        executor = self._get_executor()
+                        if self._store_result(att, key, executor.submit(render_preview, path, kind, self.max_px), executor):
+                            built += 1
+                        elif att.preview_status is None:
+                            print(f"[Preview] {att.filename}: процесс превью упал", flush=True)
+                            att.preview_status = PREVIEW_FAILED
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return built
+
+
+_service: Optional[PreviewService] = None
+
+
+def start_preview_service() -> PreviewService:
+    global _service
+    if _service is None:
+        settings = get_settings()
+        _service = PreviewService(settings.preview_workers, settings.preview_max_px)
+        _service.start()
+    return _service
+
+
+def stop_preview_service() -> None:
+    global _service
+    if _service is not None:
+        _service.stop()
+        _service = None
+
+
+def enqueue_previews(attachment_ids: Iterable[int]) -> None:
+    """Новые вложения -> очередь превью (сервис не запущен — вложение встанет в очередь при первом запросе)."""
+    if _service is not None:
+        _service.enqueue(attachment_ids)
@@ -0,0 +1,121 @@
+"""
+Глобальный (на процесс) лимитер запросов к LLM: token bucket по RPM и TPM.
+Лимиты берутся из квоты провайдера (OPENAI_RPM / OPENAI_TPM). Если бюджет не
+освобождается за AI_RATE_LIMIT_WAIT_SECONDS — AiRateLimited: задача возвращается
+в очередь, тикет остаётся ai_status=pending (backpressure вместо шквала 429).
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+
+from app.config import get_settings
+
+
+class AiRateLimited(Exception):
+    """LLM-квота исчерпана (локальный лимитер или 429 от провайдера); повторить позже."""
+
+    def __init__(self, message: str = "LLM rate limit", retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Классический token bucket: capacity токенов, пополнение rate_per_sec."""
+
+    def __init__(self, capacity: float, rate_per_sec: float):
+        self.capacity = float(capacity)
+        self.rate = float(rate_per_sec)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Сколько секунд ждать до наличия amount токенов (0 — доступно сейчас)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self._tokens >= amount:
+            return 0.0
+        return (amount - self._tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float) -> None:
+        self._tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class LlmRateLimiter:
+    """Два bucket'а (запросы и токены в минуту); acquire резервирует оба атомарно."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(max(1, rpm), max(1, rpm) / 60.0)
+        self.tokens = TokenBucket(max(1, tpm), max(1, tpm) / 60.0)
+        self._cond = threading.Condition()
+
+    def acquire(self, est_tokens: int, timeout: float) -> bool:
+        """Блокирует до получения 1 запроса + est_tokens токенов или до timeout. False — не дождались."""
+        deadline = time.monotonic() + max(0.0, timeout)
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(est_tokens, now))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(est_tokens)
+                    return True
+                remaining = deadline - now
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(wait, remaining))
+
+    async def acquire_async(self, est_tokens: int, timeout: float) -> bool:
+        """acquire() для event loop: ожидание через asyncio.sleep, lock держится только на расчёт."""
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(est_tokens, now))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(est_tokens)
+                    return True
+            remaining = deadline - now
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(wait, remaining))
+
+    def settle(self, est_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Корректирует TPM по фактическому usage из ответа провайдера."""
+        if actual_tokens is None:
+            return
+        with self._cond:
+            diff = est_tokens - actual_tokens
+            if diff > 0:
+                self.tokens.give_back(diff)
+                self._cond.notify_all()
+            elif diff < 0:
+                self.tokens.take(-diff)
+
+
+def estimate_tokens(*texts: str, max_output_tokens: int = 0) -> int:
+    """Грубая оценка без tokenizer'а: ~3 символа на токен для смеси кириллицы и латиницы."""
+    chars = sum(len(t or "") for t in texts)
+    return chars // 3 + max_output_tokens
+
+
+_limiter: Optional[LlmRateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_llm_rate_limiter() -> LlmRateLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                s = get_settings()
+                _limiter = LlmRateLimiter(s.openai_rpm, s.openai_tpm)
+    return _limiter
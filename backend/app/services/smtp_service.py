@@ -2,14 +2,37 @@
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Tuple, Optional
+from email.utils import make_msgid
+from typing import List, Tuple, Optional
 import httpx
 from app.config import get_settings
 
 
-def send_email(to: str, subject: str, body_plain: str) -> Tuple[bool, Optional[str], Optional[str]]:
+def _thread_headers(message_id: str, in_reply_to: Optional[str], references: Optional[List[str]]) -> dict:
+    """Message-ID + заголовки цепочки: ответ клиента вернётся в тот же тикет (email_threads)."""
+    headers = {"Message-ID": message_id}
+    if in_reply_to:
+        headers["In-Reply-To"] = in_reply_to
+    if references:
+        headers["References"] = " ".join(references)
+    return headers
+
+
+def _sender_domain(from_addr: str) -> Optional[str]:
+    domain = from_addr.rpartition("@")[2].strip(" >")
+    return domain or None
+
+
+def send_email(
+    to: str,
+    subject: str,
+    body_plain: str,
+    in_reply_to: Optional[str] = None,
+    references: Optional[List[str]] = None,
+) -> Tuple[bool, Optional[str], Optional[str]]:
     """
     Отправляет письмо. Возвращает (success, message_id_or_none, error_message).
+    message_id — Message-ID письма (ставится здесь), in_reply_to/references — заголовки цепочки.
     """
     s = get_settings()
     # Prefer HTTP email provider on platforms where SMTP is blocked (e.g., Railway)
@@ -17,6 +40,7 @@ def send_email(to: str, subject: str, body_plain: str) -> Tuple[bool, Optional[s
         from_addr = (getattr(s, "resend_from", "") or s.smtp_from or s.smtp_user or "").strip()
         if not from_addr:
             return False, None, "Не указан адрес отправителя (RESEND_FROM или SMTP_FROM/SMTP_USER)."
+        message_id = make_msgid(domain=_sender_domain(from_addr))
         try:
             resp = httpx.post(
                 "https://api.resend.com/emails",
@@ -29,15 +53,12 @@ def send_email(to: str, subject: str, body_plain: str) -> Tuple[bool, Optional[s
                     "to": [to],
                     "subject": subject,
                     "text": body_plain,
+                    "headers": _thread_headers(message_id, in_reply_to, references),
                 },
                 timeout=30.0,
             )
             if 200 <= resp.status_code < 300:
-                try:
-                    data = resp.json()
-                    return True, data.get("id"), None
-                except Exception:
-                    return True, None, None
+                return True, message_id, None
             # normalize error text
             err_text = ""
             try:
@@ -58,6 +79,8 @@ def send_email(to: str, subject: str, body_plain: str) -> Tuple[bool, Optional[s
     msg["Subject"] = subject
     msg["From"] = from_addr
     msg["To"] = to
+    for name, value in _thread_headers(make_msgid(domain=_sender_domain(from_addr)), in_reply_to, references).items():
+        msg[name] = value
     msg.attach(MIMEText(body_plain, "plain", "utf-8"))
     try:
         port = s.smtp_port or 587
@@ -0,0 +1,163 @@
+"""
+Текст таблиц (XLSX/XLSM через openpyxl, XLS через xlrd) для AI.
+
+Клиенты присылают списки приборов с заводскими номерами таблицами. Книга не загружается
+в память целиком: openpyxl read_only читает лист потоком по строкам, xlrd (on_demand) —
+лист за листом. В текст попадают строки до SHEET_MAX_ROWS и лимита символов; столбцы
+заводских номеров (по заголовку: «Зав. №», «Серийный номер», «S/N», ...) дочитываются до
+SHEET_SCAN_MAX_ROWS строк, и номера выносятся отдельной строкой в начало — для AI они
+не теряются за обрезкой длинного листа.
+"""
+import re
+from datetime import date, datetime, time
+from io import BytesIO
+from typing import Any, Iterator, List, Tuple
+
+# Строк в тексте (на всю книгу), столбцов на строку, символов в ячейке, листов
+SHEET_MAX_ROWS = 2000
+SHEET_MAX_COLS = 30
+CELL_MAX_CHARS = 200
+SHEETS_MAX = 10
+# Столько строк просматривается в поисках заводских номеров (после лимита текста)
+SHEET_SCAN_MAX_ROWS = 20_000
+SERIALS_MAX = 300
+# Заголовок столбца с заводскими / серийными номерами
+SERIAL_HEADER_RE = re.compile(
+    r"(зав(од|\.|\s)|серийн|s\s*/\s*n\b|\bsn\b|serial|\bзн\b|№\s*(прибора|изделия|датчика))",
+    re.IGNORECASE,
+)
+# Сколько первых непустых строк листа проверяется на заголовок
+HEADER_SCAN_ROWS = 5
+
+XLS_MAGIC = b"\xd0\xcf\x11\xe0"  # OLE2 (Excel 97-2003)
+XLSX_MAGIC = b"PK"  # zip (Office Open XML)
+
+Row = Tuple[Any, ...]
+
+
+def _cell_text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "да" if value else "нет"
+    if isinstance(value, float):
+        # 123456.0 — заводской номер, записанный числом
+        return str(int(value)) if value.is_integer() else f"{value:g}"
+    if isinstance(value, datetime):
+        return value.strftime("%d.%m.%Y %H:%M") if (value.hour or value.minute) else value.strftime("%d.%m.%Y")
+    if isinstance(value, (date, time)):
+        return value.strftime("%d.%m.%Y") if isinstance(value, date) else value.strftime("%H:%M")
+    text = " ".join(str(value).split())
+    return text[:CELL_MAX_CHARS]
+
+
+def _iter_xlsx(data: bytes) -> Iterator[Tuple[str, Iterator[Row]]]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets[:SHEETS_MAX]:
+            if getattr(ws, "sheet_state", "visible") != "visible":
+                continue
+            yield ws.title, ws.iter_rows(values_only=True, max_col=SHEET_MAX_COLS)
+    finally:
+        wb.close()
+
+
+def _iter_xls(data: bytes) -> Iterator[Tuple[str, Iterator[Row]]]:
+    import xlrd
+
+    book = xlrd.open_workbook(file_contents=data, on_demand=True)
+    try:
+        for index in range(min(book.nsheets, SHEETS_MAX)):
+            sheet = book.sheet_by_index(index)
+
+            def rows(sheet=sheet) -> Iterator[Row]:
+                for r in range(sheet.nrows):
+                    values = []
+                    for c in range(min(sheet.ncols, SHEET_MAX_COLS)):
+                        cell = sheet.cell(r, c)
+                        if cell.ctype == xlrd.XL_CELL_DATE:
+                            try:
+                                values.append(xlrd.xldate.xldate_as_datetime(cell.value, book.datemode))
+                                continue
+                            except Exception:
+                                pass
+                        values.append(cell.value if cell.ctype != xlrd.XL_CELL_EMPTY else None)
+                    yield tuple(values)
+
+            yield sheet.name, rows()
+            book.unload_sheet(index)
+    finally:
+        book.release_resources()
+
+
+def _serial_columns(header: List[str]) -> List[int]:
+    return [i for i, title in enumerate(header) if title and SERIAL_HEADER_RE.search(title)]
+
+
+def extract_spreadsheet(data: bytes, max_chars: int) -> str:
+    """Текст книги: по листам, строки "ячейка | ячейка"; заводские номера — строкой в начале."""
+    if data[:4] == XLS_MAGIC:
+        sheets = _iter_xls(data)
+    elif data[:2] == XLSX_MAGIC:
+        sheets = _iter_xlsx(data)
+    else:
+        raise ValueError("не XLS/XLSX")
+
+    parts: List[str] = []
+    serial_lines: List[str] = []
+    chars = 0
+    text_rows = 0
+    truncated = False
+    serials_total = 0
+    try:
+        for title, rows in sheets:
+            header: List[str] = []
+            serial_cols: List[int] = []
+            serials: List[str] = []
+            seen = set()
+            sheet_lines: List[str] = []
+            non_empty = 0
+            for scanned, row in enumerate(rows):
+                if scanned >= SHEET_SCAN_MAX_ROWS:
+                    break
+                cells = [_cell_text(v) for v in row]
+                if not any(cells):
+                    continue
+                non_empty += 1
+                if not serial_cols and non_empty <= HEADER_SCAN_ROWS:
+                    # Заголовок — среди первых строк (выше может быть название таблицы)
+                    header, serial_cols = cells, _serial_columns(cells)
+                elif serial_cols:
+                    for col in serial_cols:
+                        value = cells[col] if col < len(cells) else ""
+                        if value and value not in seen and serials_total + len(serials) < SERIALS_MAX:
+                            seen.add(value)
+                            serials.append(value)
+
+                if text_rows < SHEET_MAX_ROWS and chars < max_chars:
+                    line = " | ".join(c for c in cells if c)
+                    sheet_lines.append(line)
+                    chars += len(line) + 1
+                    text_rows += 1
+                else:
+                    truncated = True
+                    if serial_cols and serials_total + len(serials) < SERIALS_MAX:
+                        continue
+                    if serial_cols or non_empty > HEADER_SCAN_ROWS:
+                        break  # номеров на листе нет или их уже достаточно — дальше читать незачем
+            if sheet_lines:
+                parts.append(f"Лист «{title}»:\n" + "\n".join(sheet_lines))
+            if serials:
+                columns = ", ".join(f"«{header[c]}»" for c in serial_cols)
+                serial_lines.append(
+                    f"Заводские номера из таблицы (лист «{title}», столбец {columns}): " + ", ".join(serials)
+                )
+                serials_total += len(serials)
+    finally:
+        sheets.close()
+
+    if truncated:
+        serial_lines.append(f"[Таблица большая: ниже первые {text_rows} строк]")
+    return "\n\n".join(serial_lines + parts)
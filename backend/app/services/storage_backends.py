@@ -0,0 +1,204 @@
+"""
+Хранилища файлов вложений: локальный диск и S3-совместимое (AWS S3, MinIO, ...).
+
+Ключ — storage_path вложения (blobs/{sha256[:2]}/{sha256}{.ext}). Запись — перенос готового
+временного файла (хэш уже посчитан), чтение — потоком; для разбора текста файл нужен на диске
+(local_copy: у локального хранилища — сам файл, у S3 — временная копия). S3 отдаёт файлы клиенту
+по presigned-ссылке напрямую, минуя backend; несколько реплик backend видят одни и те же вложения.
+"""
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+from urllib.parse import quote
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class AttachmentStorage(ABC):
+    """Хранилище файлов вложений по ключу storage_path."""
+
+    name = ""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def put_file(self, local_path: str, key: str, content_type: Optional[str] = None) -> None:
+        """Кладёт локальный файл под ключ; файл забирается (переносится или удаляется после загрузки)."""
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Поток чтения (read(n), close()). Raises: FileNotFoundError."""
+
+    @abstractmethod
+    def size(self, key: str) -> Optional[int]:
+        """Размер в байтах; None — файла нет."""
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Путь на диске этого процесса (только локальное хранилище)."""
+        return None
+
+    def presigned_url(
+        self, key: str, filename: Optional[str] = None, content_type: Optional[str] = None
+    ) -> Optional[str]:
+        """Временная ссылка на скачивание напрямую из хранилища; None — отдаёт backend."""
+        return None
+
+    @contextmanager
+    def local_copy(self, key: str) -> Iterator[Optional[str]]:
+        """Файл на диске на время блока (временная копия удаляется); None — файла нет."""
+        try:
+            src = self.open(key)
+        except FileNotFoundError:
+            yield None
+            return
+        fd, tmp_path = tempfile.mkstemp(prefix="attachment-", suffix=Path(key).suffix)
+        try:
+            with os.fdopen(fd, "wb") as out, src:
+                shutil.copyfileobj(src, out, COPY_CHUNK_BYTES)
+            yield tmp_path
+        finally:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+
+
+class LocalStorage(AttachmentStorage):
+    """Каталог на диске (backend/uploads); файлы отдаются backend'ом."""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"ключ вне хранилища: {key}")
+        return path
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def put_file(self, local_path: str, key: str, content_type: Optional[str] = None) -> None:
+        dest = self._path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # Атомарно; одновременная загрузка того же файла перезапишет его тем же содержимым
+        os.replace(local_path, dest)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self._path(key).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self._path(key)
+
+    @contextmanager
+    def local_copy(self, key: str) -> Iterator[Optional[str]]:
+        path = self._path(key)
+        yield str(path) if path.is_file() else None
+
+
+class S3Storage(AttachmentStorage):
+    """
+    Бакет S3-совместимого хранилища (boto3). endpoint_url — MinIO и т.п. (адресация path-style);
+    public_endpoint_url — адрес для presigned-ссылок, если клиенты видят хранилище по другому адресу.
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        public_endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        presign_expire_seconds: int = 3600,
+    ):
+        import boto3
+        from botocore.config import Config
+
+        if not bucket:
+            raise ValueError("S3_BUCKET не задан")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.presign_expire_seconds = presign_expire_seconds
+        config = Config(
+            signature_version="s3v4",
+            s3={"addressing_style": "path" if endpoint_url else "auto"},
+            retries={"max_attempts": 3, "mode": "standard"},
+        )
+        session = boto3.session.Session(
+            aws_access_key_id=access_key or None,
+            aws_secret_access_key=secret_key or None,
+            region_name=region or None,
+        )
+        self.client = session.client("s3", endpoint_url=endpoint_url or None, config=config)
+        if public_endpoint_url and public_endpoint_url != endpoint_url:
+            self.presign_client = session.client("s3", endpoint_url=public_endpoint_url, config=config)
+        else:
+            self.presign_client = self.client
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    @staticmethod
+    def _is_not_found(error: Exception) -> bool:
+        code = str(getattr(error, "response", {}).get("Error", {}).get("Code", ""))
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def exists(self, key: str) -> bool:
+        return self.size(key) is not None
+
+    def put_file(self, local_path: str, key: str, content_type: Optional[str] = None) -> None:
+        # upload_file — потоком с диска, крупные файлы частями (multipart)
+        extra = {"ContentType": content_type} if content_type else None
+        self.client.upload_file(local_path, self.bucket, self._key(key), ExtraArgs=extra)
+        os.unlink(local_path)
+
+    def open(self, key: str) -> BinaryIO:
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+        except ClientError as e:
+            if self._is_not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+
+        try:
+            return int(self.client.head_object(Bucket=self.bucket, Key=self._key(key))["ContentLength"])
+        except ClientError as e:
+            if self._is_not_found(e):
+                return None
+            raise
+
+    def presigned_url(
+        self, key: str, filename: Optional[str] = None, content_type: Optional[str] = None
+    ) -> Optional[str]:
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if filename:
+            # Имя файла при сохранении (кириллица — по RFC 5987)
+            params["ResponseContentDisposition"] = f"inline; filename*=UTF-8''{quote(filename)}"
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return self.presign_client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=self.presign_expire_seconds
+        )
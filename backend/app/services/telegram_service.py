@@ -160,6 +160,14 @@ def maybe_send_telegram_alert(db: "Session", ticket) -> bool:
         getattr(ticket, "telegram_notified_at", None),
     ):
         return False
+    # Почти-дубликат: об оригинале уже сообщили — второй алерт не нужен
+    duplicate_of_id = getattr(ticket, "duplicate_of_id", None)
+    if duplicate_of_id:
+        from app.models import Ticket
+
+        original = db.query(Ticket).filter(Ticket.id == duplicate_of_id).first()
+        if original is not None and original.telegram_notified_at is not None:
+            return False
 
     settings = get_settings()
     base_url = (getattr(settings, "telegram_app_url", None) or "").rstrip("/") or "http://localhost:3000"
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон приёма писем: стенды IMAP/SMTP/LLM (scripts/mail_standin.py) + настоящий
+путь ImapEmailFetcher -> EmailProcessor -> конвейер вложений -> ai_jobs -> AI-воркеры.
+
+Режимы:
+  live    — IMAP-слушатель с IDLE, письма отправляются через SMTP-стенд с темпом --rate
+            (время до тикета считается от отправки);
+  backlog — в ящике заранее --messages писем, одна синхронизация fetch_and_process_emails
+            (время до тикета считается от начала синхронизации).
+Итог: писем/с, перцентили времени до тикета и до ai_status=done; --replies N дополнительно
+меряет отправку ответов smtp_service.send_email.
+
+Usage (из backend, БД по умолчанию — временный SQLite):
+  python -m scripts.bench_ingest --messages 500 --rate 50 --llm-latency 0.8
+  python -m scripts.bench_ingest --mode backlog --messages 2000 --attachments 0.7 --large-kb 2048
+  DATABASE_URL=postgresql://... python -m scripts.bench_ingest --messages 1000 --json
+"""
+import argparse
+import json
+import os
+import random
+import smtplib
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.mail_standin import (  # noqa: E402
+    StandinImapServer,
+    StandinLlmServer,
+    StandinMailbox,
+    StandinSmtpServer,
+    generate_eris_mail,
+    make_server_tls_context,
+)
+
+MAILBOX_ADDRESS = "support@eris.example"
+MAILBOX_PASSWORD = "bench-pass"
+# Шаг опроса БД наблюдателем (сек) — точность замеров
+OBSERVE_STEP_SEC = 0.05
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank перцентиль; None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+class Observer(threading.Thread):
+    """Опрашивает tickets: момент появления тикета и перехода ai_status в done/failed по Message-ID."""
+
+    def __init__(self, session_factory, expected: set):
+        super().__init__(daemon=True, name="bench-observer")
+        self.session_factory = session_factory
+        self.expected = set(expected)
+        self.ticket_at: Dict[str, float] = {}
+        self.done_at: Dict[str, float] = {}
+        self.failed: set = set()
+        self._halt = threading.Event()
+
+    def stop(self) -> None:
+        self._halt.set()
+        self.join()
+
+    @property
+    def finished(self) -> bool:
+        return len(self.done_at) + len(self.failed) >= len(self.expected)
+
+    def run(self) -> None:
+        from app.models import Ticket
+
+        while not self._halt.is_set():
+            db = self.session_factory()
+            try:
+                now = time.monotonic()
+                pending = [mid for mid in self.expected if mid not in self.done_at and mid not in self.failed]
+                for i in range(0, len(pending), 500):
+                    rows = db.query(Ticket.external_id, Ticket.ai_status).filter(
+                        Ticket.external_id.in_(pending[i:i + 500])
+                    ).all()
+                    for mid, ai_status in rows:
+                        self.ticket_at.setdefault(mid, now)
+                        if ai_status == "done":
+                            self.done_at[mid] = now
+                        elif ai_status == "failed":
+                            self.failed.add(mid)
+            finally:
+                db.close()
+            self._halt.wait(OBSERVE_STEP_SEC)
+
+
+def configure_env(args, imap: StandinImapServer, smtp: StandinSmtpServer, llm: Optional[StandinLlmServer], workdir: Path) -> None:
+    """Настройки backend указывают на стенды; вызывать до импорта app.*."""
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir / 'bench.db'}")
+    os.environ.update(
+        IMAP_HOST="127.0.0.1", IMAP_PORT=str(imap.port), IMAP_USER=MAILBOX_ADDRESS, IMAP_PASS=MAILBOX_PASSWORD,
+        IMAP_FOLDERS="INBOX", IMAP_MAILBOXES="", IMAP_IDLE="true",
+        SMTP_HOST="127.0.0.1", SMTP_PORT=str(smtp.port), SMTP_USER=MAILBOX_ADDRESS, SMTP_PASS=MAILBOX_PASSWORD,
+        SMTP_FROM=MAILBOX_ADDRESS, RESEND_API_KEY="", TELEGRAM_BOT_TOKEN="",
+    )
+    if llm is not None:
+        os.environ.update(OPENAI_API_KEY="bench", OPENAI_BASE_URL=llm.base_url)
+    else:
+        os.environ["OPENAI_API_KEY"] = ""
+
+
+def send_via_smtp(smtp_port: int, mails: List[bytes], rate: float, sent_at: Dict[str, float], ids: List[str]) -> None:
+    """Отправляет письма на ящик через SMTP-стенд с темпом rate писем/с (0 — без паузы)."""
+    client = smtplib.SMTP("127.0.0.1", smtp_port, timeout=30)
+    client.ehlo()
+    client.starttls()
+    client.ehlo()
+    client.login(MAILBOX_ADDRESS, MAILBOX_PASSWORD)
+    start = time.monotonic()
+    for n, (raw, mid) in enumerate(zip(mails, ids)):
+        if rate > 0:
+            delay = start + n / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        sent_at[mid] = time.monotonic()
+        client.sendmail("client@client.example", [MAILBOX_ADDRESS], raw)
+    client.quit()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон приёма писем на стендах IMAP/SMTP/LLM")
+    parser.add_argument("--mode", choices=("live", "backlog"), default="live")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20.0, help="live: писем в секунду через SMTP (0 — максимально)")
+    parser.add_argument("--attachments", type=float, default=0.5, help="доля писем с вложениями")
+    parser.add_argument("--spam", type=float, default=0.1, help="доля рассылок (должны отсекаться фильтром)")
+    parser.add_argument("--large-kb", type=int, default=0, help="размер дополнительного бинарного вложения, КБ")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="задержка стенда LLM, сек")
+    parser.add_argument("--no-ai", action="store_true", help="без LLM: ai_status=done сразу после тикета")
+    parser.add_argument("--replies", type=int, default=0, help="после прогона отправить N ответов через smtp_service")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="результат одной JSON-строкой")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="eris-bench-"))
+    tls = make_server_tls_context()
+    mailbox = StandinMailbox()
+    imap = StandinImapServer(mailbox, MAILBOX_ADDRESS, MAILBOX_PASSWORD, tls_context=tls).start()
+    smtp = StandinSmtpServer(mailbox, MAILBOX_ADDRESS, tls_context=tls).start()
+    llm = None if args.no_ai else StandinLlmServer(latency=args.llm_latency).start()
+    configure_env(args, imap, smtp, llm, workdir)
+
+    # Импорт backend — только после настройки окружения
+    from app import db as app_db
+    from app.services import attachment_storage, imap_session
+    from app.services.ai_queue import start_ai_workers, stop_ai_workers
+    from app.services.email_processor import fetch_and_process_emails
+    from app.services.ingest_pipeline import start_ingest_pipeline, stop_ingest_pipeline
+
+    attachment_storage.UPLOADS_DIR = workdir / "uploads"
+    imap_session.STARTUP_DELAY_SEC = 0
+    app_db.Base.metadata.create_all(app_db.engine)
+    app_db.ensure_db_fallback()
+
+    rng = random.Random(args.seed)
+    mails, ids, expected = [], [], set()
+    for i in range(args.messages):
+        raw, mid, is_spam = generate_eris_mail(i, MAILBOX_ADDRESS, rng, args.attachments, args.spam, args.large_kb)
+        mails.append(raw)
+        ids.append(mid)
+        if not is_spam:
+            expected.add(mid)
+    total_bytes = sum(len(m) for m in mails)
+
+    start_ai_workers()
+    start_ingest_pipeline()
+    observer = Observer(app_db.SessionLocal, expected)
+    sent_at: Dict[str, float] = {}
+
+    if args.mode == "backlog":
+        for raw in mails:
+            mailbox.append(raw)
+        observer.start()
+        t0 = time.monotonic()
+        sent_at = {mid: t0 for mid in ids}
+        db = app_db.SessionLocal()
+        try:
+            fetch_and_process_emails(db)
+        finally:
+            db.close()
+    else:
+        listeners = imap_session.start_imap_listeners()
+        deadline = time.monotonic() + 30
+        while not all(l.connected for l in listeners) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        observer.start()
+        t0 = time.monotonic()
+        send_via_smtp(smtp.port, mails, args.rate, sent_at, ids)
+
+    deadline = t0 + args.timeout
+    while not observer.finished and time.monotonic() < deadline:
+        time.sleep(0.2)
+    observer.stop()
+    imap_session.stop_imap_listeners()
+
+    reply_stats = None
+    if args.replies:
+        from app.services.smtp_service import send_email
+        r0 = time.monotonic()
+        ok = sum(1 for n in range(args.replies) if send_email(f"client{n}@client.example", "Re: обращение", "Ответ техподдержки ЭРИС")[0])
+        elapsed = time.monotonic() - r0
+        reply_stats = {"sent": ok, "seconds": round(elapsed, 3), "per_sec": round(ok / elapsed, 2) if elapsed else None}
+
+    stop_ingest_pipeline()
+    stop_ai_workers()
+    for server in (imap, smtp, llm):
+        if server is not None:
+            server.stop()
+
+    to_ticket = [observer.ticket_at[m] - sent_at[m] for m in observer.ticket_at if m in sent_at]
+    to_done = [observer.done_at[m] - sent_at[m] for m in observer.done_at if m in sent_at]
+    ticket_span = (max(observer.ticket_at.values()) - t0) if observer.ticket_at else 0.0
+    done_span = (max(observer.done_at.values()) - t0) if observer.done_at else 0.0
+    report = {
+        "mode": args.mode,
+        "messages": args.messages,
+        "expected_tickets": len(expected),
+        "mailbox_mb": round(total_bytes / 1024 / 1024, 2),
+        "tickets": len(observer.ticket_at),
+        "ai_done": len(observer.done_at),
+        "ai_failed": len(observer.failed),
+        "ingest_msgs_per_sec": round(len(observer.ticket_at) / ticket_span, 2) if ticket_span else None,
+        "ai_done_per_sec": round(len(observer.done_at) / done_span, 2) if done_span else None,
+        "time_to_ticket": summarize(to_ticket),
+        "time_to_ai_done": summarize(to_done),
+        "llm_requests": llm.requests if llm else 0,
+        "replies": reply_stats,
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        def fmt(stats):
+            return "  ".join(f"{k}={v:.3f}s" if isinstance(v, float) else f"{k}={v}" for k, v in stats.items())
+        print()
+        print(f"Режим: {args.mode}, писем: {args.messages} ({report['mailbox_mb']} МБ), ожидается тикетов: {len(expected)}")
+        print(f"Тикетов: {report['tickets']}, AI done: {report['ai_done']}, AI failed: {report['ai_failed']}, запросов к LLM: {report['llm_requests']}")
+        print(f"Приём: {report['ingest_msgs_per_sec']} писем/с, AI: {report['ai_done_per_sec']} тикетов/с")
+        print(f"time-to-ticket   {fmt(report['time_to_ticket'])}")
+        print(f"time-to-AI-done  {fmt(report['time_to_ai_done'])}")
+        if reply_stats:
+            print(f"SMTP-ответы: {reply_stats['sent']} за {reply_stats['seconds']}с ({reply_stats['per_sec']}/с)")
+    return 0 if len(observer.ticket_at) == len(expected) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
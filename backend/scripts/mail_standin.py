@@ -0,0 +1,625 @@
+#!/usr/bin/env python3
+"""
+Локальные заменители почтовых серверов и LLM для нагрузочных прогонов приёма писем.
+
+- StandinImapServer — IMAP4rev1 поверх TLS (самоподписанный сертификат): LOGIN, SELECT,
+  STATUS, UID SEARCH/FETCH (заголовки, RFC822.SIZE, BODY.PEEK[]), SEARCH/FETCH/STORE
+  по номерам, NOOP, IDLE (push `* N EXISTS` при новом письме). Ровно то, что использует
+  ImapEmailFetcher / ImapSession.
+- StandinSmtpServer — SMTP с STARTTLS и AUTH PLAIN/LOGIN (как у smtp_service.send_email).
+  Письмо на адрес ящика попадает в StandinMailbox (SMTP -> IMAP), остальные — в sent.
+- StandinLlmServer — POST /v1/chat/completions с настраиваемой задержкой и JSON-ответом
+  в формате ЭРИС (OPENAI_BASE_URL=http://127.0.0.1:<port>/v1).
+- generate_eris_mail — реалистичные письма клиентов ЭРИС (газоанализаторы, заводские номера,
+  PDF/фото/журналы во вложениях) и рассылки для фильтра.
+
+Серверы работают в потоках текущего процесса; порт 0 — свободный порт ОС.
+Пример: см. scripts/bench_ingest.py.
+"""
+import io
+import json
+import random
+import re
+import select
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser
+from email.utils import format_datetime, make_msgid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+# ─── TLS ──────────────────────────────────────────────────────────────
+
+
+def make_server_tls_context() -> ssl.SSLContext:
+    """Самоподписанный сертификат на localhost (openssl в PATH), только для стендов."""
+    tmp = Path(tempfile.mkdtemp(prefix="eris-standin-"))
+    cert, key = tmp / "cert.pem", tmp / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+         "-subj", "/CN=localhost", "-keyout", str(key), "-out", str(cert)],
+        check=True, capture_output=True,
+    )
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    return ctx
+
+
+# ─── Почтовый ящик ────────────────────────────────────────────────────
+
+
+class StandinMailbox:
+    """Одна папка: письма с UID и флагами; ожидание новых писем (для IDLE)."""
+
+    def __init__(self, uidvalidity: Optional[int] = None):
+        self.uidvalidity = uidvalidity or int(time.time())
+        self._messages: List[Tuple[int, bytes, set]] = []
+        self._next_uid = 1
+        self._cond = threading.Condition()
+        self.on_append: Optional[Callable[[bytes], None]] = None
+
+    def append(self, raw: bytes, seen: bool = False) -> int:
+        with self._cond:
+            uid = self._next_uid
+            self._next_uid += 1
+            self._messages.append((uid, raw, {"\\Seen"} if seen else set()))
+            self._cond.notify_all()
+        if self.on_append:
+            self.on_append(raw)
+        return uid
+
+    def snapshot(self) -> List[Tuple[int, bytes, set]]:
+        with self._cond:
+            return list(self._messages)
+
+    def count(self) -> int:
+        with self._cond:
+            return len(self._messages)
+
+    @property
+    def uidnext(self) -> int:
+        with self._cond:
+            return self._next_uid
+
+    def wait_new(self, known: int, timeout: float) -> int:
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._messages) > known, timeout)
+            return len(self._messages)
+
+
+# ─── IMAP ─────────────────────────────────────────────────────────────
+
+_TOKEN_RE = re.compile(rb'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+
+def _tokens(data: bytes) -> List[str]:
+    out = []
+    for quoted, atom in _TOKEN_RE.findall(data):
+        out.append((quoted.replace(b'\\"', b'"').replace(b"\\\\", b"\\") if quoted or not atom else atom).decode("utf-8", "replace"))
+    return out
+
+
+def _parse_set(spec: str, maximum: int) -> List[Tuple[int, int]]:
+    """"1:3,7,9:*" -> диапазоны; "*" — максимальный номер, n:* при n > max — только max (RFC 3501)."""
+    ranges = []
+    for part in spec.split(","):
+        lo, _, hi = part.partition(":")
+        a = maximum if lo == "*" else int(lo)
+        b = a if not hi else (maximum if hi == "*" else int(hi))
+        ranges.append((min(a, b), max(a, b)))
+    return ranges
+
+
+def _in_set(n: int, ranges: List[Tuple[int, int]]) -> bool:
+    return any(lo <= n <= hi for lo, hi in ranges)
+
+
+class _ImapHandler(socketserver.StreamRequestHandler):
+    server: "StandinImapServer"
+
+    def handle(self) -> None:
+        self.mailbox = self.server.mailbox
+        self.selected = False
+        self.known = 0
+        self.send(b"* OK [CAPABILITY IMAP4rev1 IDLE] ERIS stand-in IMAP ready")
+        while True:
+            try:
+                line = self.rfile.readline()
+            except (OSError, ValueError):
+                return
+            if not line:
+                return
+            tag, _, rest = line.rstrip(b"\r\n").partition(b" ")
+            cmd, _, args = rest.partition(b" ")
+            try:
+                if not self.dispatch(tag, cmd.decode().upper(), args):
+                    return
+            except (BrokenPipeError, ConnectionError, ssl.SSLError):
+                return
+            except Exception as e:
+                self.send(tag + f" BAD {e}".encode())
+
+    def send(self, data: bytes) -> None:
+        self.wfile.write(data + b"\r\n")
+        self.wfile.flush()
+
+    def dispatch(self, tag: bytes, cmd: str, args: bytes) -> bool:
+        if cmd == "CAPABILITY":
+            self.send(b"* CAPABILITY IMAP4rev1 IDLE")
+        elif cmd == "LOGIN":
+            user, password = _tokens(args)[:2]
+            if (user, password) != (self.server.user, self.server.password):
+                self.send(tag + b" NO [AUTHENTICATIONFAILED] Invalid credentials")
+                return True
+        elif cmd in ("SELECT", "EXAMINE"):
+            self.selected = True
+            self.known = self.mailbox.count()
+            self.send(f"* {self.known} EXISTS".encode())
+            self.send(b"* 0 RECENT")
+            self.send(b"* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)")
+            self.send(f"* OK [UIDVALIDITY {self.mailbox.uidvalidity}] UIDs valid".encode())
+            self.send(f"* OK [UIDNEXT {self.mailbox.uidnext}] Predicted next UID".encode())
+            self.send(tag + b" OK [READ-WRITE] SELECT completed")
+            return True
+        elif cmd == "STATUS":
+            folder = _tokens(args)[0]
+            self.send(f'* STATUS "{folder}" (UIDVALIDITY {self.mailbox.uidvalidity} MESSAGES {self.mailbox.count()})'.encode())
+        elif cmd == "NOOP":
+            self.report_exists()
+        elif cmd == "IDLE":
+            return self.idle(tag)
+        elif cmd == "LOGOUT":
+            self.send(b"* BYE logging out")
+            self.send(tag + b" OK LOGOUT completed")
+            return False
+        elif cmd == "UID":
+            sub, _, rest = args.partition(b" ")
+            self.command(tag, sub.decode().upper(), rest.decode("utf-8", "replace"), by_uid=True)
+            return True
+        elif cmd in ("SEARCH", "FETCH", "STORE"):
+            self.command(tag, cmd, args.decode("utf-8", "replace"), by_uid=False)
+            return True
+        else:
+            self.send(tag + b" BAD unknown command")
+            return True
+        self.send(tag + f" OK {cmd} completed".encode())
+        return True
+
+    def report_exists(self) -> None:
+        count = self.mailbox.count()
+        if count != self.known:
+            self.known = count
+            self.send(f"* {count} EXISTS".encode())
+
+    def idle(self, tag: bytes) -> bool:
+        self.send(b"+ idling")
+        sock = self.connection
+        while True:
+            readable, _, _ = select.select([sock], [], [], 0.1)
+            pending = getattr(sock, "pending", None)
+            if readable or (pending and pending()):
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip().upper() == b"DONE":
+                    self.send(tag + b" OK IDLE terminated")
+                    return True
+                continue
+            if self.mailbox.wait_new(self.known, 0.1) > self.known:
+                self.report_exists()
+
+    def command(self, tag: bytes, cmd: str, args: str, by_uid: bool) -> None:
+        messages = self.mailbox.snapshot()
+        if cmd == "SEARCH":
+            hits = self.search(messages, args.split(), by_uid)
+            self.send(("* SEARCH " + " ".join(map(str, hits))).rstrip().encode())
+        elif cmd == "FETCH":
+            spec, _, items = args.partition(" ")
+            self.fetch(messages, spec, items.upper(), by_uid)
+        elif cmd == "STORE":
+            spec, _, rest = args.partition(" ")
+            maximum = messages[-1][0] if by_uid and messages else len(messages)
+            ranges = _parse_set(spec, maximum)
+            for seq, (uid, _, flags) in enumerate(messages, 1):
+                if _in_set(uid if by_uid else seq, ranges) and "\\SEEN" in rest.upper():
+                    flags.add("\\Seen")
+        else:
+            self.send(tag + b" BAD unknown UID command")
+            return
+        self.send(tag + f" OK {'UID ' if by_uid else ''}{cmd} completed".encode())
+
+    def search(self, messages, criteria: List[str], by_uid: bool) -> List[int]:
+        max_uid = messages[-1][0] if messages else 0
+        hits = []
+        for seq, (uid, _, flags) in enumerate(messages, 1):
+            ok = True
+            i = 0
+            while i < len(criteria):
+                c = criteria[i].upper()
+                if c == "UNSEEN":
+                    ok &= "\\Seen" not in flags
+                elif c == "SEEN":
+                    ok &= "\\Seen" in flags
+                elif c == "UID":
+                    i += 1
+                    ok &= _in_set(uid, _parse_set(criteria[i], max_uid))
+                elif c != "ALL":
+                    ok &= _in_set(seq, _parse_set(c, len(messages)))
+                i += 1
+            if ok:
+                hits.append(uid if by_uid else seq)
+        return hits
+
+    def fetch(self, messages, spec: str, items: str, by_uid: bool) -> None:
+        maximum = messages[-1][0] if by_uid and messages else len(messages)
+        ranges = _parse_set(spec, maximum)
+        header_fields = re.search(r"HEADER\.FIELDS \(([^)]*)\)", items)
+        for seq, (uid, raw, flags) in enumerate(messages, 1):
+            if not _in_set(uid if by_uid else seq, ranges):
+                continue
+            attrs = [f"UID {uid}"]
+            if "RFC822.SIZE" in items:
+                attrs.append(f"RFC822.SIZE {len(raw)}")
+            if header_fields:
+                wanted = {f.upper() for f in header_fields.group(1).split()}
+                headers = BytesHeaderParser().parsebytes(raw)
+                literal = "".join(f"{k}: {v}\r\n" for k, v in headers.items() if k.upper() in wanted).encode("utf-8", "replace") + b"\r\n"
+                name = f"BODY[HEADER.FIELDS ({header_fields.group(1)})]"
+            elif "BODY.PEEK[]" in items or "BODY[]" in items:
+                literal, name = raw, "BODY[]"
+            elif "RFC822" in items.replace("RFC822.SIZE", ""):
+                literal, name = raw, "RFC822"
+                flags.add("\\Seen")
+            else:
+                self.send(f"* {seq} FETCH ({' '.join(attrs)})".encode())
+                continue
+            head = f"* {seq} FETCH ({' '.join(attrs)} {name} {{{len(literal)}}}".encode()
+            self.wfile.write(head + b"\r\n" + literal + b")\r\n")
+        self.wfile.flush()
+
+
+class _TlsServerMixin:
+    tls_context: Optional[ssl.SSLContext] = None
+
+    def get_request(self):
+        conn, addr = self.socket.accept()
+        if self.tls_context is not None:
+            conn = self.tls_context.wrap_socket(conn, server_side=True, do_handshake_on_connect=False)
+        return conn, addr
+
+    def finish_request(self, request, client_address):
+        if isinstance(request, ssl.SSLSocket):
+            try:
+                request.do_handshake()
+            except (ssl.SSLError, OSError):
+                return
+        super().finish_request(request, client_address)
+
+
+class _ThreadingServer(_TlsServerMixin, socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _StandinBase:
+    """Общий запуск/остановка сервера в фоновом потоке."""
+
+    _server: socketserver.BaseServer
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.2}, daemon=True,
+                         name=f"{type(self).__name__}-{self.port}").start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StandinImapServer(_StandinBase):
+    def __init__(self, mailbox: StandinMailbox, user: str, password: str,
+                 host: str = "127.0.0.1", port: int = 0, tls_context: Optional[ssl.SSLContext] = None):
+        self._server = _ThreadingServer((host, port), _ImapHandler)
+        self._server.tls_context = tls_context or make_server_tls_context()
+        self._server.mailbox = mailbox
+        self._server.user = user
+        self._server.password = password
+
+
+# ─── SMTP ─────────────────────────────────────────────────────────────
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    server: "_ThreadingServer"
+
+    def send(self, line: str) -> None:
+        self.wfile.write(line.encode() + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        standin: StandinSmtpServer = self.server.standin
+        self.send("220 localhost ERIS stand-in ESMTP")
+        mail_from, rcpts = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode("utf-8", "replace").rstrip("\r\n")
+            verb = cmd.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                caps = ["localhost"]
+                if not isinstance(self.connection, ssl.SSLSocket):
+                    caps.append("STARTTLS")
+                caps += ["AUTH PLAIN LOGIN", "SIZE 104857600", "8BITMIME"]
+                for cap in caps[:-1]:
+                    self.send(f"250-{cap}")
+                self.send(f"250 {caps[-1]}")
+            elif verb == "STARTTLS":
+                self.send("220 Ready to start TLS")
+                self.connection = standin.tls_context.wrap_socket(self.connection, server_side=True)
+                self.rfile = self.connection.makefile("rb")
+                self.wfile = self.connection.makefile("wb")
+            elif verb == "AUTH":
+                parts = cmd.split()
+                if parts[1].upper() == "LOGIN":
+                    self.send("334 VXNlcm5hbWU6")
+                    self.rfile.readline()
+                    self.send("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                elif len(parts) < 3:
+                    self.send("334 ")
+                    self.rfile.readline()
+                self.send("235 Authentication successful")
+            elif verb == "MAIL":
+                mail_from, rcpts = cmd.split(":", 1)[1].strip(" <>"), []
+                self.send("250 OK")
+            elif verb == "RCPT":
+                rcpts.append(cmd.split(":", 1)[1].strip(" <>"))
+                self.send("250 OK")
+            elif verb == "DATA":
+                self.send("354 End data with <CR><LF>.<CR><LF>")
+                chunks = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    chunks.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                standin.deliver(mail_from or "", rcpts, b"".join(chunks))
+                self.send(f"250 OK queued as {uuid.uuid4().hex[:10]}")
+            elif verb == "RSET":
+                mail_from, rcpts = None, []
+                self.send("250 OK")
+            elif verb == "NOOP":
+                self.send("250 OK")
+            elif verb == "QUIT":
+                self.send("221 Bye")
+                return
+            else:
+                self.send("502 Command not implemented")
+
+
+class StandinSmtpServer(_StandinBase):
+    """Письма для mailbox_address -> mailbox (SMTP -> IMAP), остальные — в sent (ответы клиентам)."""
+
+    def __init__(self, mailbox: Optional[StandinMailbox] = None, mailbox_address: str = "",
+                 host: str = "127.0.0.1", port: int = 0, tls_context: Optional[ssl.SSLContext] = None):
+        self._server = _ThreadingServer((host, port), _SmtpHandler)
+        self._server.standin = self
+        self.tls_context = tls_context or make_server_tls_context()
+        self.mailbox = mailbox
+        self.mailbox_address = mailbox_address.lower()
+        self.sent: List[Tuple[str, List[str], bytes]] = []
+        self._lock = threading.Lock()
+
+    def deliver(self, mail_from: str, rcpts: List[str], data: bytes) -> None:
+        if self.mailbox is not None and any(r.lower() == self.mailbox_address for r in rcpts):
+            self.mailbox.append(data)
+        else:
+            with self._lock:
+                self.sent.append((mail_from, rcpts, data))
+
+
+# ─── LLM ──────────────────────────────────────────────────────────────
+
+
+class _LlmHandler(BaseHTTPRequestHandler):
+    server: "ThreadingHTTPServer"
+
+    def log_message(self, format, *args):  # noqa: A002 - без access-лога в stdout
+        pass
+
+    def do_POST(self):
+        standin: StandinLlmServer = self.server.standin
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            request = {}
+        time.sleep(max(0.0, random.gauss(standin.latency, standin.latency * 0.2)))
+        user_text = next((m.get("content", "") for m in request.get("messages", []) if m.get("role") == "user"), "")
+        payload = json.dumps({
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "standin"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": standin.answer(user_text)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": 200, "total_tokens": len(body) // 4 + 200},
+        }, ensure_ascii=False).encode()
+        with standin._lock:
+            standin.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class StandinLlmServer(_StandinBase):
+    """OpenAI-совместимый /v1/chat/completions: задержка latency (сек, ±20%) и разбор письма по шаблону."""
+
+    def __init__(self, latency: float = 0.5, host: str = "127.0.0.1", port: int = 0):
+        self._server = ThreadingHTTPServer((host, port), _LlmHandler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    @staticmethod
+    def answer(user_text: str) -> str:
+        serials = re.findall(r"№\s?(\d{6,8})", user_text)
+        device = next((d for d in DEVICES if d in user_text), None)
+        negative = any(w in user_text.lower() for w in ("срочно", "недопустимо", "третий раз"))
+        return json.dumps({
+            "full_name": None,
+            "object_name": None,
+            "phone": None,
+            "serial_numbers": serials,
+            "device_type": device,
+            "sentiment": "negative" if negative else "neutral",
+            "category": "неисправность" if "ошибк" in user_text.lower() else "консультация",
+            "issue_summary": "Обращение по работе газоанализатора",
+            "reply": "Здравствуйте! Спасибо за обращение, специалист ЭРИС свяжется с вами.",
+            "operator_required": negative,
+            "operator_reason": "Срочное обращение" if negative else None,
+        }, ensure_ascii=False)
+
+
+# ─── Генератор писем ──────────────────────────────────────────────────
+
+DEVICES = ["ДГС ЭРИС-210", "ДГС ЭРИС-230", "ПГ ЭРИС-414", "ПГ ЭРИС-411", "СГОЭС", "ЭРИС-130", "ГИБ ЭРИС-100"]
+COMPANIES = ["АО «СеверНефтеГаз»", "ООО «ТрансГазСервис»", "ПАО «УралХимПром»", "ООО «Нефтехиммонтаж»", "АО «КрасЭнергоРемонт»"]
+FIRST_NAMES = ["Иван", "Сергей", "Ольга", "Марина", "Алексей", "Дмитрий", "Наталья", "Павел"]
+LAST_NAMES = ["Петров", "Смирнов", "Кузнецова", "Иванова", "Соколов", "Волков", "Лебедева", "Морозов"]
+ISSUES = [
+    "после замены сенсора показывает ошибку калибровки нуля",
+    "нет связи по Modbus RTU с контроллером верхнего уровня",
+    "просим выслать паспорт и методику поверки",
+    "прибор периодически уходит в ошибку 04, срочно нужна консультация",
+    "требуется замена датчика, гарантийный срок не истёк",
+    "показания по метану завышены на 10% НКПР после калибровки",
+    "уже третий раз обращаемся, газоанализатор не выходит на режим",
+]
+NEWSLETTERS = [
+    ("newsletter@promo-market.ru", "Newsletter: скидки недели"),
+    ("noreply@accounts.example.com", "Security alert: new sign-in"),
+    ("marketing@expo-gas.ru", "Приглашение на выставку"),
+]
+
+
+def _make_pdf(lines: List[str]) -> bytes:
+    """Минимальный валидный PDF со строками текста (ASCII, Helvetica)."""
+    text = "BT /F1 11 Tf 50 780 Td 14 TL " + " ".join(
+        "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") '" for line in lines
+    ) + " ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(text)).encode() + b" >>\nstream\n" + text.encode("latin-1") + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{i} 0 obj\n".encode() + obj + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for off in offsets:
+        out.write(f"{off:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def _make_photo(rng: random.Random, caption: str) -> Optional[bytes]:
+    """JPEG «фото шильдика» (Pillow); None — Pillow не установлен."""
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        return None
+    img = Image.new("RGB", (640, 360), (rng.randint(180, 230),) * 3)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((40, 40, 600, 320), outline=(30, 30, 30), width=4)
+    draw.text((70, 160), caption, fill=(0, 0, 0))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=80)
+    return buf.getvalue()
+
+
+def generate_eris_mail(
+    i: int,
+    to: str,
+    rng: Optional[random.Random] = None,
+    attachment_ratio: float = 0.5,
+    spam_ratio: float = 0.1,
+    large_attachment_kb: int = 0,
+) -> Tuple[bytes, str, bool]:
+    """
+    Письмо №i. Returns: (raw RFC 5322, Message-ID, is_spam).
+    attachment_ratio — доля писем с вложениями (акт PDF, фото, журнал событий);
+    large_attachment_kb > 0 — к письмам с вложениями добавляется дамп такого размера.
+    """
+    rng = rng or random.Random(i)
+    msg = EmailMessage()
+    message_id = make_msgid(idstring=f"bench{i}", domain="client.example")
+    msg["Message-ID"] = message_id
+    msg["To"] = to
+    msg["Date"] = format_datetime(datetime.now(timezone.utc))
+
+    if rng.random() < spam_ratio:
+        sender, subject = rng.choice(NEWSLETTERS)
+        msg["From"] = sender
+        msg["Subject"] = subject
+        msg.set_content("Только на этой неделе! " * 200)
+        return msg.as_bytes(), message_id, True
+
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    device = rng.choice(DEVICES)
+    serial = rng.randint(1000000, 9999999)
+    company = rng.choice(COMPANIES)
+    issue = rng.choice(ISSUES)
+    msg["From"] = f"{first} {last} <{first.lower()}.{i}@client.example>"
+    msg["Subject"] = f"{device} зав. № {serial} — {issue[:40]}"
+    msg.set_content(
+        f"Добрый день!\n\nНа объекте {company} установлен {device}, заводской № {serial}.\n"
+        f"Проблема: {issue}.\n\nПрошу помочь.\n\nС уважением,\n{first} {last}\n"
+        f"{company}\nтел. +7 9{rng.randint(10, 99)} {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}\n"
+    )
+
+    if rng.random() < attachment_ratio:
+        msg.add_attachment(
+            _make_pdf([f"Service report #{i}", f"Device serial {serial}", "Zero calibration failed, code 04"]),
+            maintype="application", subtype="pdf", filename=f"akt_{serial}.pdf",
+        )
+        if rng.random() < 0.5:
+            photo = _make_photo(rng, f"SN {serial}")
+            if photo:
+                msg.add_attachment(photo, maintype="image", subtype="jpeg", filename=f"photo_{serial}.jpg")
+        if rng.random() < 0.3:
+            log = "\n".join(f"2024-05-{d:02d} 10:{m:02d} CH4 {rng.uniform(0, 5):.2f} %НКПР" for d in range(1, 29) for m in range(0, 60, 15))
+            msg.add_attachment(log.encode("utf-8"), maintype="text", subtype="plain", filename="journal.txt")
+        if large_attachment_kb > 0:
+            msg.add_attachment(rng.randbytes(large_attachment_kb * 1024), maintype="application",
+                               subtype="octet-stream", filename=f"dump_{serial}.bin")
+    return msg.as_bytes(), message_id, False
@@ -249,22 +249,45 @@ export default function TicketDetailPage() {
                 </div>
                 <div className="divide-y divide-slate-100">
                   {attachments.map((att) => {
-                    const url = att.download_url || `/uploads/${att.storage_path}`;
+                    const url = att.download_url || `/api/tickets/${att.ticket_id}/attachments/${att.id}/download`;
                     const isImage = /^image\/(jpeg|jpg|png|webp|gif)$/i.test(att.mime_type);
                     return (
-                      <div key={att.id} className="px-6 py-4 flex items-center gap-4 hover:bg-slate-50/50 transition-colors">
-                        <div className="w-10 h-10 rounded-lg bg-slate-100 flex items-center justify-center flex-shrink-0">
-                          {isImage ? (
-                            <svg className="w-5 h-5 text-blue-500" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M4 16l4.586-4.586a2 2 0 012.828 0L16 16m-2-2l1.586-1.586a2 2 0 012.828 0L20 14m-6-6h.01M6 20h12a2 2 0 002-2V6a2 2 0 00-2-2H6a2 2 0 00-2 2v12a2 2 0 002 2z" /></svg>
-                          ) : (
-                            <svg className="w-5 h-5 text-slate-400" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M7 21h10a2 2 0 002-2V9.414a1 1 0 00-.293-.707l-5.414-5.414A1 1 0 0012.586 3H7a2 2 0 00-2 2v14a2 2 0 002 2z" /></svg>
-                          )}
-                        </div>
+                      <div key={att.id} className="px-6 py-4 flex items-start gap-4 hover:bg-slate-50/50 transition-colors">
+                        {att.preview_url ? (
+                          <a href={url} target="_blank" rel="noopener noreferrer" className="flex-shrink-0">
+                            <img src={att.preview_url} alt={att.filename} loading="lazy" decoding="async" className="w-16 h-16 rounded-lg object-cover bg-slate-100 border border-slate-200" />
+                          </a>
+                        ) : (
+                          <div className="w-10 h-10 rounded-lg bg-slate-100 flex items-center justify-center flex-shrink-0">
+                            {isImage ? (
+                              <svg className="w-5 h-5 text-blue-500" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M4 16l4.586-4.586a2 2 0 012.828 0L16 16m-2-2l1.586-1.586a2 2 0 012.828 0L20 14m-6-6h.01M6 20h12a2 2 0 002-2V6a2 2 0 00-2-2H6a2 2 0 00-2 2v12a2 2 0 002 2z" /></svg>
+                            ) : (
+                              <svg className="w-5 h-5 text-slate-400" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M7 21h10a2 2 0 002-2V9.414a1 1 0 00-.293-.707l-5.414-5.414A1 1 0 0012.586 3H7a2 2 0 00-2 2v14a2 2 0 002 2z" /></svg>
+                            )}
+                          </div>
+                        )}
                         <div className="min-w-0 flex-1">
                           <p className="text-sm font-medium text-slate-700 truncate">{att.filename}</p>
                           <p className="text-xs text-slate-400">
                             {att.mime_type}{att.size_bytes != null && ` · ${(att.size_bytes / 1024).toFixed(1)} KB`}
+                            {att.page_count != null && ` · ${att.page_count} стр.`}
+                            {att.ocr_used && " · OCR"}
+                            {att.extract_ms != null && ` · ${(att.extract_ms / 1000).toFixed(1)} с`}
                           </p>
+                          {att.extract_status === "failed" && (
+                            <p className="text-xs text-amber-600 mt-0.5">Текст не извлечён — повторится при следующем анализе</p>
+                          )}
+                          {att.extract_status == null && (
+                            <p className="text-xs text-slate-400 mt-0.5">Текст ещё не извлечён</p>
+                          )}
+                          {att.extracted_text && (
+                            <details className="mt-1">
+                              <summary className="text-xs text-violet-600 cursor-pointer select-none">
+                                {att.extract_status === "done" ? `Текст для AI (${att.extracted_text.length} симв.)` : "Заметка для AI"}
+                              </summary>
+                              <pre className="mt-2 max-h-64 overflow-auto whitespace-pre-wrap text-xs text-slate-600 bg-slate-50 rounded-lg p-3 border border-slate-100">{att.extracted_text}</pre>
+                            </details>
+                          )}
                         </div>
                         <div className="flex items-center gap-2 flex-shrink-0">
                           <a href={url} target="_blank" rel="noopener noreferrer" className="inline-flex items-center gap-1 px-3 py-1.5 rounded-lg text-xs font-medium text-emerald-700 bg-emerald-50 hover:bg-emerald-100 border border-emerald-200/60 transition-colors">
@@ -294,6 +317,16 @@ export default function TicketDetailPage() {
                 <h3 className="text-base font-semibold text-slate-800">Ответ AI-агента</h3>
               </div>
               <div className="px-6 py-5">
+                {ticket.duplicate_of_id && (
+                  <div className="mb-4 p-4 rounded-xl bg-sky-50 border border-sky-200 text-sky-800 text-sm">
+                    Похоже на повтор обращения{" "}
+                    <Link href={`/tickets/${ticket.duplicate_of_id}`} className="font-semibold hover:underline">
+                      #{ticket.duplicate_of_id}
+                    </Link>
+                    : анализ взят из него.
+                  </div>
+                )}
+
                 {ticket.ai_status === "failed" && (
                   <div className="mb-4 p-4 rounded-xl bg-red-50 border border-red-200">
                     <p className="text-sm font-semibold text-red-800">AI анализ не выполнен</p>
@@ -301,7 +334,7 @@ export default function TicketDetailPage() {
                   </div>
                 )}
 
-                {ticket.ai_status === "pending" && !ticket.ai_reply && (
+                {(ticket.ai_status === "pending" || ticket.ai_status === "extracting") && !ticket.ai_reply && (
                   <div className="p-4 rounded-xl bg-amber-50 border border-amber-200 text-amber-800 text-sm flex items-center gap-2">
                     <div className="w-4 h-4 border-2 border-amber-400 border-t-transparent rounded-full animate-spin" />
                     AI анализ выполняется… Обновите страницу через несколько секунд.
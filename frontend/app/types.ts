@@ -39,8 +39,9 @@ export interface Ticket {
   operator_required?: boolean;
   operator_reason?: string | null;
   device_info?: string | null;
-  ai_status?: string | null;   // pending | done | failed
+  ai_status?: string | null;   // extracting | pending | done | failed
   ai_error?: string | null;     // failed ise kısa hata
+  duplicate_of_id?: number | null;  // почти-дубликат: анализ взят у этого тикета
 }
 
 export interface TicketCreate {
@@ -91,4 +92,10 @@ export interface TicketAttachmentRead {
   storage_path: string;
   created_at?: string | null;
   download_url?: string | null;
+  preview_url?: string | null;
+  extract_status?: "done" | "unsupported" | "failed" | null;
+  page_count?: number | null;
+  ocr_used?: boolean | null;
+  extract_ms?: number | null;
+  extracted_text?: string | null;
 }
@@ -128,17 +128,23 @@ export default function UserTicketDetailPage() {
             </div>
             <div className="divide-y divide-slate-100">
               {attachments.map((att) => {
-                const url = att.download_url || `/uploads/${att.storage_path}`;
+                const url = att.download_url || `/api/tickets/${att.ticket_id}/attachments/${att.id}/download`;
                 const isImage = /^image\/(jpeg|jpg|png|webp|gif)$/i.test(att.mime_type);
                 return (
                   <div key={att.id} className="px-6 py-3.5 flex items-center gap-4 hover:bg-slate-50/50 transition-colors">
-                    <div className="w-9 h-9 rounded-lg bg-slate-100 flex items-center justify-center flex-shrink-0">
-                      {isImage ? (
-                        <svg className="w-4 h-4 text-blue-500" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M4 16l4.586-4.586a2 2 0 012.828 0L16 16m-2-2l1.586-1.586a2 2 0 012.828 0L20 14m-6-6h.01M6 20h12a2 2 0 002-2V6a2 2 0 00-2-2H6a2 2 0 00-2 2v12a2 2 0 002 2z" /></svg>
-                      ) : (
-                        <svg className="w-4 h-4 text-slate-400" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M7 21h10a2 2 0 002-2V9.414a1 1 0 00-.293-.707l-5.414-5.414A1 1 0 0012.586 3H7a2 2 0 00-2 2v14a2 2 0 002 2z" /></svg>
-                      )}
-                    </div>
+                    {att.preview_url ? (
+                      <a href={url} target="_blank" rel="noopener noreferrer" className="flex-shrink-0">
+                        <img src={att.preview_url} alt={att.filename} loading="lazy" decoding="async" className="w-16 h-16 rounded-lg object-cover bg-slate-100 border border-slate-200" />
+                      </a>
+                    ) : (
+                      <div className="w-9 h-9 rounded-lg bg-slate-100 flex items-center justify-center flex-shrink-0">
+                        {isImage ? (
+                          <svg className="w-4 h-4 text-blue-500" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M4 16l4.586-4.586a2 2 0 012.828 0L16 16m-2-2l1.586-1.586a2 2 0 012.828 0L20 14m-6-6h.01M6 20h12a2 2 0 002-2V6a2 2 0 00-2-2H6a2 2 0 00-2 2v12a2 2 0 002 2z" /></svg>
+                        ) : (
+                          <svg className="w-4 h-4 text-slate-400" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M7 21h10a2 2 0 002-2V9.414a1 1 0 00-.293-.707l-5.414-5.414A1 1 0 0012.586 3H7a2 2 0 00-2 2v14a2 2 0 002 2z" /></svg>
+                        )}
+                      </div>
+                    )}
                     <div className="min-w-0 flex-1">
                       <p className="text-sm font-medium text-slate-700 truncate">{att.filename}</p>
                       <p className="text-xs text-slate-400">{att.mime_type}{att.size_bytes != null && ` · ${(att.size_bytes / 1024).toFixed(1)} KB`}</p>